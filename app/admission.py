@@ -0,0 +1,153 @@
+"""
+Admission control for Secret Management System
+Bounds concurrent Argon2id derivations and throttles password attempts per client
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from app.metrics import KDF_REJECTED
+
+T = TypeVar("T")
+
+
+class KdfBusy(Exception):
+    """Raised when the KDF executor's wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"KDF executor is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class KdfExecutor:
+    """
+    Size-bounded pool for key derivations.
+
+    At most `max_in_flight` derivations run at once (each Argon2id holds its
+    memory cost, so this caps KDF memory per worker) and at most `max_queue`
+    more wait for a slot. Further calls are refused with KdfBusy instead of
+    piling up; its retry_after estimates when a slot frees up. Argon2
+    releases the GIL, so threads run derivations in parallel.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="kdf"
+        )
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self._rejected = 0
+        self._avg_seconds = None
+
+    def _retry_after(self) -> int:
+        """Seconds until the admitted work has likely drained."""
+        per_call = self._avg_seconds or 1.0
+        rounds = self._admitted / self.max_in_flight
+        return max(1, math.ceil(rounds * per_call))
+
+    def _call(self, fn: Callable[..., T], args: tuple) -> T:
+        with self._lock:
+            self._running += 1
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._running -= 1
+                self._avg_seconds = (
+                    elapsed
+                    if self._avg_seconds is None
+                    else 0.8 * self._avg_seconds + 0.2 * elapsed
+                )
+
+    def run(self, fn: Callable[..., T], *args) -> T:
+        """
+        Run fn(*args) on the pool and wait for its result.
+        Raises KdfBusy if max_in_flight + max_queue calls are already admitted.
+        """
+        with self._lock:
+            if self._admitted >= self.max_in_flight + self.max_queue:
+                self._rejected += 1
+                KDF_REJECTED.inc()
+                raise KdfBusy(self._retry_after())
+            self._admitted += 1
+
+        try:
+            return self._pool.submit(self._call, fn, args).result()
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def status(self) -> dict:
+        """Running and waiting derivations, for /health."""
+        with self._lock:
+            return {
+                "in_flight": self._running,
+                "queued": self._admitted - self._running,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "rejected": self._rejected,
+            }
+
+
+class AttemptThrottle:
+    """
+    Failed password attempts per client in a sliding window.
+
+    A client with `max_attempts` failures within `window` seconds is locked
+    out until the oldest of them leaves the window. Tracks at most
+    `max_clients` clients, dropping the least recently seen.
+    """
+
+    def __init__(self, max_attempts: int, window: float, max_clients: int = 10000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._failures = OrderedDict()
+
+    def _recent(self, client: str, now: float) -> Optional[deque]:
+        failures = self._failures.get(client)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[client]
+            return None
+        return failures
+
+    def retry_after(self, client: str) -> int:
+        """Seconds the client has to wait before trying again, 0 if allowed."""
+        if self.max_attempts <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            failures = self._recent(client, now)
+            if failures is None or len(failures) < self.max_attempts:
+                return 0
+            return max(1, math.ceil(failures[0] + self.window - now))
+
+    def failed(self, client: str):
+        """Record a failed attempt."""
+        with self._lock:
+            now = time.monotonic()
+            failures = self._recent(client, now) or deque()
+            failures.append(now)
+            self._failures[client] = failures
+            self._failures.move_to_end(client)
+            while len(self._failures) > self.max_clients:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, client: str):
+        """Forget a client's failures after a correct password."""
+        with self._lock:
+            self._failures.pop(client, None)
@@ -4,136 +4,220 @@ A secure, self-hosted password and identity management system
 """
 
 import os
+import atexit
+import csv
+import hmac
+import io
 import secrets
 from functools import wraps
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import (
+    Flask,
+    Response,
+    g,
+    render_template,
+    request,
+    jsonify,
+    session,
+    redirect,
+    stream_with_context,
+    url_for,
+)
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app.admission import AttemptThrottle, KdfBusy, KdfExecutor
+from app.assets import use_built_assets
+from app.cache import KeyCache, SessionKeyStore, VaultCache
+from app.metrics import CONTENT_TYPE, FAILED_LOGINS, FILE_BYTES, REGISTRY
+from app.profiling import (
+    SERVER_TIMING,
+    end_timing,
+    phase,
+    profiler,
+    start_timing,
+)
+from app.schema import VALID_ENTRY_TYPES, ENTRY_FIELDS
+from app.search import SearchIndex, DEFAULT_LIMIT
+from app.transfer import (
+    EXPORT_FORMATS,
+    IMPORT_FORMATS,
+    MAX_IMPORT_SIZE,
+    dedupe_key,
+    export_entries,
+    parse_import,
+)
 from app.crypto_utils import (
-    encrypt_vault,
-    decrypt_vault,
+    RECORDS_FORMAT_VERSION,
+    JournalCorruptError,
+    VaultKey,
+    create_vault_key,
+    kdf_outdated,
+    unlock_vault_key,
+    rewrap_vault_key,
+    get_vault_file_id,
+    parse_vault_file,
+    replace_vault_header,
+    encrypt_vault_with_key,
+    decrypt_vault_with_key,
+    read_vault_head,
     create_empty_vault,
-    generate_entry_id,
+    generate_revision_id,
+)
+from app.vault_store import (
+    JOURNAL_MAX_RECORDS,
+    Compactor,
+    append_changes,
+    journal_needs_compaction,
+    journal_path,
+    open_vault,
+    read_entry,
+    read_file,
+    read_vault_files,
+    record_changes,
+    record_revision,
+    save_snapshot,
+    vault_lock,
+    vault_read_lock,
+    vault_signature,
+    write_snapshot,
 )
+from app.vault_model import Entry, Vault, parse_revision_tag
 from app.drive_sync import (
-    sync_on_startup,
+    start_startup_sync,
+    startup_sync_done,
     upload_vault_async,
-    is_drive_sync_enabled,
+    flush_uploads,
+    is_sync_enabled,
+    uploader,
+    SYNC_BACKEND,
 )
 
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON responses, with encoding timed as the serialize phase."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        with phase("serialize"):
+            return super().dumps(obj, **kwargs)
+
+
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(32))
 
+# "production" serves the output of `flask vault build-assets` (fingerprinted,
+# precompressed static files and compiled templates) and never reloads templates
+APP_ENV = os.environ.get("APP_ENV", "development").lower()
+
 # Security configurations
 app.config.update(
     SESSION_COOKIE_SECURE=False,  # Set True in production with HTTPS
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE="Lax",
     PERMANENT_SESSION_LIFETIME=1800,  # 30 minutes
-    TEMPLATES_AUTO_RELOAD=True,  # Auto reload templates
+    MAX_CONTENT_LENGTH=MAX_IMPORT_SIZE,  # Largest request: an import file
+    TEMPLATES_AUTO_RELOAD=APP_ENV != "production",  # Auto reload templates
 )
 
+if APP_ENV == "production":
+    use_built_assets(app)
+
 VAULT_FILE = os.environ.get("VAULT_FILE_PATH", "./vault.enc")
 
-# Sync vault from Google Drive on startup (if configured)
-print("[Startup] Checking for vault sync...")
-sync_on_startup(VAULT_FILE)
-if is_drive_sync_enabled():
-    print("[Startup] Google Drive sync is ENABLED")
+# Derived keys per session, so Argon2id runs at login instead of every request
+key_cache = KeyCache(
+    ttl=app.permanent_session_lifetime.total_seconds(),
+    max_size=int(os.environ.get("KEY_CACHE_MAX_SIZE", "64")),
+)
+
+# The same keys for every worker, each sealed with a secret that only the
+# session cookie holds, so a session opens the vault on any worker without
+# the master password outliving the login request
+session_keys = SessionKeyStore(
+    directory=os.environ.get("SESSION_KEY_DIR", "./data/sessions"),
+    ttl=app.permanent_session_lifetime.total_seconds(),
+)
+
+# Decrypted vault per worker, invalidated when the vault files change
+vault_cache = VaultCache()
+
+# Argon2id derivations per worker: at most KDF_MAX_IN_FLIGHT run at once
+# (each holds ARGON2_MEMORY_COST of RAM) and KDF_MAX_QUEUE wait; beyond
+# that requests get 503 with Retry-After
+kdf_executor = KdfExecutor(
+    max_in_flight=int(os.environ.get("KDF_MAX_IN_FLIGHT", "2")),
+    max_queue=int(os.environ.get("KDF_MAX_QUEUE", "8")),
+)
+
+# Failed password attempts allowed per client IP within the window. Counted
+# per worker: with WEB_CONCURRENCY workers a client gets up to that many
+# times LOGIN_MAX_ATTEMPTS before every worker has locked it out
+login_throttle = AttemptThrottle(
+    max_attempts=int(os.environ.get("LOGIN_MAX_ATTEMPTS", "10")),
+    window=float(os.environ.get("LOGIN_ATTEMPT_WINDOW", "300")),
+)
+
+# Bearer token required to scrape /metrics; when unset, only clients on
+# this host (e.g. a Prometheus sidecar) may scrape it
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Bearer token for the /api/admin/* routes (disabled when unset)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Number of reverse proxies in front of the app whose X-Forwarded-For is
+# trusted for the client IP (0: use the connection address). Must be set
+# behind a proxy or load balancer, or every client shares the proxy's
+# address, and so one login throttle
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+_proxy_warning_shown = False
+
+
+def on_vault_compacted(signature: tuple, vault_key: VaultKey, vault: dict):
+    """Keep the worker cache warm and back up the compacted snapshot."""
+    cached = vault_cache.peek()
+    if (
+        cached is not None
+        and cached[0].file_id == vault_key.file_id
+        and cached[1].revision == vault.get("revision", 0)
+    ):
+        # Same content as cached; keep its indexes and memoized previews
+        vault_cache.put(signature, vault_key, cached[1])
+    else:
+        vault_cache.put(signature, vault_key, Vault.from_dict(vault))
+    upload_vault_async(VAULT_FILE)
+
+
+# Search index over entry previews, per worker
+search_index = SearchIndex()
+
+# Folds the journal into the snapshot off the request path
+compactor = Compactor(VAULT_FILE, on_compacted=on_vault_compacted)
+
+
+@atexit.register
+def flush_on_exit():
+    """On graceful shutdown, fold the journal and upload what is pending."""
+    if not is_sync_enabled():
+        return
+    try:
+        compactor.flush()
+    except Exception as e:
+        print(f"[Shutdown] Error compacting journal: {e}")
+    if not flush_uploads():
+        print("[Shutdown] Vault changes could not be uploaded to the sync backend")
+
+
+if is_sync_enabled():
+    print(f"[Startup] Vault sync is ENABLED ({SYNC_BACKEND})")
 else:
-    print("[Startup] Google Drive sync is DISABLED (no credentials configured)")
-
-# Valid entry types
-VALID_ENTRY_TYPES = [
-    "login",
-    "note",
-    "credit_card",
-    "identity",
-    "api_credential",
-    "database",
-    "server",
-    "software_license",
-    "ssh_key",
-    "wifi",
-    "bank_account",
-]
-
-# Entry type field definitions
-ENTRY_FIELDS = {
-    "login": ["url", "username", "password", "notes"],
-    "note": ["notes"],
-    "credit_card": [
-        "cardholder_name",
-        "card_number",
-        "expiration_date",
-        "security_code",
-        "pin",
-        "notes",
-    ],
-    "identity": [
-        # Personal details
-        "prefix_title",
-        "full_name",
-        "email",
-        "phone",
-        "birth_date",
-        "gender",
-        # Address details
-        "organization",
-        "address",
-        "postal_code",
-        "city",
-        "state",
-        "country",
-        # Contact details
-        "ssn",
-        "passport_number",
-        "license_number",
-        "website",
-        "x_handle",
-        "linkedin",
-        "reddit",
-        "facebook",
-        "yahoo",
-        "instagram",
-        # Work details
-        "company",
-        "job_title",
-        "work_website",
-        "work_phone",
-        "work_email",
-        "notes",
-    ],
-    "api_credential": [
-        "api_key",
-        "api_secret",
-        "expiration_date",
-        "permissions",
-        "notes",
-    ],
-    "database": [
-        "host",
-        "port",
-        "username",
-        "password",
-        "database_type",
-        "database_name",
-        "notes",
-    ],
-    "server": ["ip_address", "hostname", "os", "username", "password", "notes"],
-    "software_license": ["license_key", "product", "expiry_date", "owner", "notes"],
-    "ssh_key": ["public_key", "private_key", "passphrase", "username", "host", "notes"],
-    "wifi": ["ssid", "password", "security_type", "notes"],
-    "bank_account": [
-        "bank_name",
-        "account_number",
-        "routing_number",
-        "account_type",
-        "iban",
-        "swift_bic",
-        "holder_name",
-        "notes",
-    ],
-}
+    print("[Startup] Vault sync is DISABLED (no backend configured)")
+
+# Most operations accepted by one /api/entries/batch request
+MAX_BATCH_OPERATIONS = int(os.environ.get("MAX_BATCH_OPERATIONS", "1000"))
+
+BATCH_OPS = ("create", "update", "delete")
 
 
 def get_vault_path():
@@ -146,31 +230,387 @@ def vault_exists():
     return os.path.exists(get_vault_path())
 
 
-def load_vault(master_password: str) -> dict | None:
-    """Load and decrypt vault from file."""
-    if not vault_exists():
+def read_vault_file() -> bytes | None:
+    """Read the encrypted vault snapshot from file."""
+    return read_file(get_vault_path())
+
+
+def write_vault_file(encrypted_data: bytes) -> tuple | None:
+    """
+    Write a full encrypted vault snapshot, then sync to Google Drive.
+    Returns the vault signature right after the write.
+    """
+    vault_path = get_vault_path()
+    signature = write_snapshot(vault_path, encrypted_data)
+
+    # Sync to Google Drive in background
+    upload_vault_async(vault_path)
+    return signature
+
+
+def start_key_session(vault_key: VaultKey):
+    """Cache the unlocked key under a fresh handle for the current session."""
+    key_cache.evict(session.get("key_handle"))
+    session_keys.evict(session.get("key_handle"))
+    handle = key_cache.new_handle()
+    secret = session_keys.new_secret()
+    key_cache.put(handle, vault_key)
+    session_keys.put(handle, secret, vault_key)
+    session["key_handle"] = handle
+    session["key_secret"] = secret
+
+
+def end_key_session():
+    """Forget the cached key and clear the session."""
+    key_cache.evict(session.get("key_handle"))
+    session_keys.evict(session.get("key_handle"))
+    session.clear()
+
+
+def set_session_key(vault_key: VaultKey):
+    """Replace the cached key for the current session."""
+    handle = session.get("key_handle")
+    secret = session.get("key_secret")
+    if handle and secret:
+        key_cache.put(handle, vault_key)
+        session_keys.put(handle, secret, vault_key)
+    else:
+        start_key_session(vault_key)
+
+
+def cached_session_key() -> VaultKey | None:
+    """The session's unlocked key, from this worker's cache or the shared store."""
+    handle = session.get("key_handle")
+    if not handle:
+        return None
+    vault_key = key_cache.get(handle)
+    if vault_key is None:
+        vault_key = session_keys.get(handle, session.get("key_secret", ""))
+        if vault_key is not None:
+            key_cache.put(handle, vault_key)
+    return vault_key
+
+
+def run_kdf(fn, *args):
+    """Run a key derivation on the bounded executor, timed as the kdf phase."""
+    with phase("kdf"):
+        return kdf_executor.run(fn, *args)
+
+
+def get_session_key(encrypted_data: bytes) -> VaultKey | None:
+    """
+    Get the vault key for the current session, if it opens this vault file.
+    The master password is not kept, so once the key is gone (expired) or
+    the vault header changed (re-created vault, password change in another
+    session) the user has to log in again.
+    """
+    cached = cached_session_key()
+    if cached and cached.file_id == get_vault_file_id(encrypted_data):
+        return cached
+    return None
+
+
+def unlock_vault(master_password: str) -> Vault | None:
+    """Unwrap the data key with the master password and decrypt the vault."""
+    signature, encrypted_data, journal = read_vault_files(get_vault_path())
+    if encrypted_data is None:
         return None
 
-    with open(get_vault_path(), "rb") as f:
-        encrypted_data = f.read()
+    vault_key = run_kdf(unlock_vault_key, encrypted_data, master_password)
+    if vault_key is None:
+        return None
 
-    return decrypt_vault(encrypted_data, master_password)
+    vault = open_vault(encrypted_data, journal, vault_key)
+    if vault is None:
+        return None
+    with phase("parse"):
+        vault = Vault.from_dict(vault)
+
+    start_key_session(vault_key)
+    vault_cache.put(signature, vault_key, vault)
+    index_vault(vault, vault_key)
+    return vault
+
+
+def rewrap_outdated_key(master_password: str):
+    """
+    Re-wrap the session's data key if the vault header records other KDF
+    parameters than this host's (e.g. after calibration), so later unlocks
+    take the configured time. Only the header is rewritten, and not before
+    the startup sync is done (a download would replace it); a later login
+    re-wraps then.
+    """
+    if not startup_sync_done():
+        return
+    vault_key = cached_session_key()
+    if vault_key is None or vault_key.legacy_key or not kdf_outdated(vault_key):
+        return
+
+    with vault_lock(get_vault_path()):
+        signature = vault_signature(get_vault_path())
+        encrypted_data = read_vault_file()
+        if encrypted_data is None or get_vault_file_id(encrypted_data) != vault_key.file_id:
+            return
+        cached = vault_cache.get(signature)
+
+        try:
+            new_key = run_kdf(rewrap_vault_key, vault_key, master_password)
+        except KdfBusy:
+            return  # Try again on a later login
+        signature = write_vault_file(replace_vault_header(encrypted_data, new_key.header))
+
+    # The payload is unchanged, so the cached vault stays valid
+    if cached is not None:
+        vault_cache.put(signature, new_key, cached[1])
+    else:
+        vault_cache.invalidate()
+    set_session_key(new_key)
+    print("[Login] Re-wrapped the vault key with the current KDF parameters")
+
+
+def client_address() -> str:
+    """
+    IP of the client. With TRUSTED_PROXIES set, ProxyFix has already put
+    the address the proxies forwarded in remote_addr.
+    """
+    global _proxy_warning_shown
+    if not TRUSTED_PROXIES and not _proxy_warning_shown and request.headers.get("X-Forwarded-For"):
+        _proxy_warning_shown = True
+        print(
+            "[Security] Requests carry X-Forwarded-For but TRUSTED_PROXIES is 0: "
+            "failed logins are counted per proxy address, not per client"
+        )
+    return request.remote_addr or ""
+
+
+def attempt_throttled():
+    """429 response if the client made too many failed password attempts."""
+    retry_after = login_throttle.retry_after(client_address())
+    if not retry_after:
+        return None
 
+    response = jsonify({"error": "Too many failed attempts. Try again later."})
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
+
+
+@app.before_request
+def ensure_startup_sync():
+    """
+    Sync the vault from the sync backend (if configured) with the first
+    request rather than on import, so CLI commands never sync. Under
+    gunicorn.conf.py the master already did, once, before forking this
+    worker; otherwise it runs in the background and /ready answers 503
+    until it is done.
+    """
+    start_startup_sync(VAULT_FILE)
+
+
+@app.before_request
+def start_request_timing():
+    """Time /api/* requests for Server-Timing and maybe profile them."""
+    if not request.path.startswith("/api/"):
+        return
+    if SERVER_TIMING:
+        g.timing_token = start_timing()
+    g.profile_token = profiler.start()
+
+
+@app.after_request
+def add_server_timing(response):
+    """Add the phase breakdown to the response and end its profile."""
+    token = g.pop("timing_token", None)
+    if token is not None:
+        response.headers["Server-Timing"] = end_timing(token).header()
+    profiler.stop(g.pop("profile_token", None))
+    return response
+
+
+@app.teardown_request
+def end_request_timing(error=None):
+    """Stop timing and profiling if the request failed before after_request."""
+    token = g.pop("timing_token", None)
+    if token is not None:
+        end_timing(token)
+    profiler.stop(g.pop("profile_token", None))
+
+
+@app.errorhandler(KdfBusy)
+def kdf_busy(error: KdfBusy):
+    """Too many key derivations waiting: ask the client to come back later."""
+    response = jsonify({"error": "Server is busy. Try again shortly."})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
+
+def index_vault(vault: Vault, vault_key: VaultKey):
+    """(Re)build the search index from the vault's entry previews."""
+    with phase("preview"):
+        previews = vault.previews()
+    with phase("search"):
+        search_index.build(previews, vault_key.data_key, vault.revision)
+
+
+def get_cached_vault() -> Vault | None:
+    """Return the worker-cached vault if the session key opens it."""
+    cached = vault_cache.get(vault_signature(get_vault_path()))
+    if cached is None:
+        return None
 
-def save_vault(vault_data: dict, master_password: str):
-    """Encrypt and save vault to file, then sync to Google Drive."""
-    encrypted_data = encrypt_vault(vault_data, master_password)
+    cached_key, vault = cached
+    vault_key = cached_session_key()
+    if (
+        vault_key is not None
+        and vault_key.file_id == cached_key.file_id
+        and hmac.compare_digest(vault_key.data_key, cached_key.data_key)
+    ):
+        return vault
+    return None
+
+
+def load_vault(for_update: bool = False) -> Vault | None:
+    """
+    Load and decrypt vault from file using the session key.
+    Served from the worker cache while the file is unchanged. The cached
+    vault is shared, so pass for_update=True to get a copy safe to mutate.
+    """
+    vault = get_cached_vault()
+    if vault is not None:
+        return vault.copy() if for_update else vault
+
+    signature, encrypted_data, journal = read_vault_files(get_vault_path())
+    if encrypted_data is None:
+        return None
 
-    vault_path = get_vault_path()
+    vault_key = get_session_key(encrypted_data)
+    if vault_key is None:
+        return None
 
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(vault_path), exist_ok=True)
+    vault = open_vault(encrypted_data, journal, vault_key)
+    if vault is None:
+        return None
+    with phase("parse"):
+        vault = Vault.from_dict(vault)
+
+    vault_cache.put(signature, vault_key, vault)
+    return vault.copy() if for_update else vault
+
+
+def load_entry(entry_id: str) -> tuple[bool, dict | None]:
+    """
+    Load a single entry using the session key.
+    Uses the worker cache when warm; otherwise only the index, the journal
+    and the one record are read and decrypted from a v3 vault file.
+    Returns (unlocked, entry); unlocked is False if the session key no
+    longer opens the vault, entry is None if it does not exist.
+    """
+    vault = get_cached_vault()
+    if vault is None and vault_exists():
+        # The open file keeps this snapshot even if a compaction replaces it
+        with vault_read_lock(get_vault_path()):
+            f = open(get_vault_path(), "rb")
+            journal = read_file(journal_path(get_vault_path()))
+        with f:
+            head = read_vault_head(f)
+            if head and parse_vault_file(head)[0] == RECORDS_FORMAT_VERSION:
+                vault_key = get_session_key(head)
+                if vault_key is None:
+                    return False, None
+                try:
+                    return True, read_entry(f, journal, vault_key, entry_id)
+                except JournalCorruptError:
+                    raise
+                except ValueError:
+                    return False, None
 
-    with open(vault_path, "wb") as f:
-        f.write(encrypted_data)
+    if vault is None:
+        vault = load_vault()
+    if vault is None:
+        return False, None
 
-    # Sync to Google Drive in background
-    upload_vault_async(vault_path)
+    entry = vault.get(entry_id)
+    return True, entry.to_dict() if entry is not None else None
+
+
+def save_vault(
+    vault_data: Vault,
+    changed: set | None = None,
+    deleted: set | None = None,
+    vault_key: VaultKey | None = None,
+):
+    """
+    Save the vault using the session key.
+
+    Pass the ids of created/updated entries as `changed` and of removed
+    entries as `deleted`: in journal mode these are appended to the journal
+    and compacted in the background. Otherwise the full snapshot is written,
+    copying the records of unchanged entries; v1/v2 vaults are migrated to
+    v3 here. Without `changed`, every entry is re-encrypted.
+
+    Change sets too large for the journal go straight to a snapshot.
+
+    Bumps the vault revision. Call under vault_lock() with a vault loaded
+    under the same lock, so no other worker's write is overwritten.
+    Uses the session key unless `vault_key` is given (CLI, no session).
+    """
+    vault_path = get_vault_path()
+    session_key = vault_key is None
+    if session_key:
+        vault_key = cached_session_key()
+    if vault_key is None:
+        raise PermissionError("No vault key for this session")
+
+    revision = vault_data.revision + 1
+    revision_id = generate_revision_id()
+    vault_data.revision = revision
+    record_revision(vault_data.meta, revision, revision_id)
+    if changed is not None:
+        record_changes(vault_data.meta, changed, deleted or set(), revision)
+
+    # Previews are built before anything is written, so an entry that
+    # cannot be previewed aborts the save instead of leaving a change on
+    # disk that the cache and the search index never saw
+    previews = None
+    if changed is not None:
+        previews = [vault_data.get(entry_id).preview() for entry_id in changed]
+
+    appended = None
+    if (
+        changed is not None
+        and not vault_key.legacy_key
+        and len(changed) + len(deleted or ()) < JOURNAL_MAX_RECORDS
+    ):
+        stamp = {"revision": revision, "revision_id": revision_id}
+        changes = [
+            {"op": "put", "entry": vault_data.get(entry_id).to_dict(), **stamp}
+            for entry_id in changed
+        ]
+        changes += [{"op": "delete", "id": entry_id, **stamp} for entry_id in deleted or ()]
+        appended = append_changes(vault_path, vault_key, changes)
+
+    if appended is not None:
+        records, signature = appended
+        # The synced backup holds only the snapshot, so fold right away if syncing
+        if is_sync_enabled() or journal_needs_compaction(vault_path, records):
+            compactor.schedule(vault_key)
+    else:
+        signature = save_snapshot(vault_path, vault_data.to_dict(), vault_key, changed)
+        upload_vault_async(vault_path)
+
+    if vault_key.legacy_key:
+        vault_key = vault_key.migrated()
+        if session_key:
+            set_session_key(vault_key)
+
+    # Write-through: the saved vault becomes the cached vault
+    vault_cache.put(signature, vault_key, vault_data)
+
+    # Keep the search index in step; it is rebuilt on the next search if
+    # it was not at the previous revision
+    if previews is not None:
+        search_index.update(
+            previews, deleted or set(), vault_key.data_key, revision - 1, revision
+        )
 
 
 def login_required(f):
@@ -187,90 +627,198 @@ def login_required(f):
     return decorated_function
 
 
-def get_entry_preview(entry: dict) -> dict:
-    """Get preview fields for an entry based on its type."""
-    safe_entry = {
-        "id": entry["id"],
-        "type": entry["type"],
-        "title": entry["title"],
-        "created_at": entry.get("created_at", ""),
-        "updated_at": entry.get("updated_at", ""),
-    }
+def vault_write(f):
+    """
+    Decorator to run a read-modify-write route under the vault lock.
+    Until the startup sync is done it answers 503, so a vault downloaded
+    by the sync cannot replace a change made meanwhile.
+    """
 
-    entry_type = entry["type"]
-
-    if entry_type == "login":
-        safe_entry["username"] = entry.get("username", "")
-        safe_entry["url"] = entry.get("url", "")
-    elif entry_type == "note":
-        notes = entry.get("notes", "")
-        safe_entry["preview"] = notes[:50] + "..." if len(notes) > 50 else notes
-    elif entry_type == "credit_card":
-        card_num = entry.get("card_number", "")
-        safe_entry["card_last4"] = card_num[-4:] if len(card_num) >= 4 else ""
-        safe_entry["cardholder_name"] = entry.get("cardholder_name", "")
-    elif entry_type == "identity":
-        safe_entry["full_name"] = entry.get("full_name", "")
-        safe_entry["email"] = entry.get("email", "")
-    elif entry_type == "api_credential":
-        safe_entry["permissions"] = entry.get("permissions", "")
-    elif entry_type == "database":
-        safe_entry["host"] = entry.get("host", "")
-        safe_entry["database_type"] = entry.get("database_type", "")
-    elif entry_type == "server":
-        safe_entry["ip_address"] = entry.get("ip_address", "")
-        safe_entry["hostname"] = entry.get("hostname", "")
-    elif entry_type == "software_license":
-        safe_entry["product"] = entry.get("product", "")
-        safe_entry["expiry_date"] = entry.get("expiry_date", "")
-    elif entry_type == "ssh_key":
-        safe_entry["host"] = entry.get("host", "")
-        safe_entry["username"] = entry.get("username", "")
-    elif entry_type == "wifi":
-        safe_entry["ssid"] = entry.get("ssid", "")
-        safe_entry["security_type"] = entry.get("security_type", "")
-    elif entry_type == "bank_account":
-        safe_entry["bank_name"] = entry.get("bank_name", "")
-        acc_num = entry.get("account_number", "")
-        safe_entry["account_last4"] = acc_num[-4:] if len(acc_num) >= 4 else ""
-
-    return safe_entry
-
-
-def create_entry_from_data(data: dict, entry_type: str) -> dict:
-    """Create a new entry dict from request data."""
-    now = datetime.utcnow().isoformat() + "Z"
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not startup_sync_done():
+            response = jsonify({"error": "Vault is syncing. Try again shortly."})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        with vault_lock(get_vault_path()):
+            return f(*args, **kwargs)
 
-    new_entry = {
-        "id": generate_entry_id(),
-        "type": entry_type,
-        "title": data.get("title", ""),
-        "created_at": now,
-        "updated_at": now,
-    }
+    return decorated_function
 
-    # Add fields based on entry type
-    fields = ENTRY_FIELDS.get(entry_type, [])
-    for field in fields:
-        new_entry[field] = data.get(field, "")
 
-    return new_entry
+def check_revision(vault: Vault):
+    """
+    Optimistic concurrency: if the client sent If-Match with the revision
+    tag it last saw, reject the write when the vault has moved on (or is
+    another vault at the same revision number).
+    Returns an error response, or None if the write may proceed.
+    """
+    expected = request.headers.get("If-Match")
+    if not expected or expected.strip() == "*":
+        return None
 
+    if expected.strip().removeprefix("W/").strip('"') != vault.revision_tag:
+        return jsonify(
+            {
+                "error": "Vault was modified by another session. Reload and try again.",
+                "revision": vault.revision,
+                "revision_tag": vault.revision_tag,
+            }
+        ), 409
+    return None
+
+
+def entries_etag(vault: Vault) -> str:
+    """ETag of the entry list: the vault revision tag, as used with If-Match."""
+    return vault.revision_tag
+
+
+def with_etag(response, etag: str):
+    """Tag a response so the browser revalidates it instead of refetching."""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+    return response
+
+
+def not_modified(etag: str):
+    """
+    Answer a conditional GET whose If-None-Match still matches with 304.
+    Returns None if the client has to get the full response.
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = app.response_class(status=304)
+    return with_etag(response, etag)
 
-def update_entry_from_data(entry: dict, data: dict) -> dict:
-    """Update an entry dict from request data."""
-    now = datetime.utcnow().isoformat() + "Z"
 
-    entry["title"] = data.get("title", entry["title"])
-    entry["updated_at"] = now
+def create_entry_from_data(data: dict, entry_type: str) -> Entry:
+    """Create a new entry from request data."""
+    now = datetime.utcnow().isoformat() + "Z"
+    return Entry.create(data, entry_type, now)
 
-    # Update fields based on entry type
-    fields = ENTRY_FIELDS.get(entry["type"], [])
-    for field in fields:
-        if field in data:
-            entry[field] = data[field]
 
-    return entry
+def update_entry_from_data(entry: Entry, data: dict) -> Entry:
+    """Updated copy of an entry from request data."""
+    now = datetime.utcnow().isoformat() + "Z"
+    return entry.updated(data, now)
+
+
+def validate_entry_data(
+    data: dict, entry_type: str, ignore_unknown: bool = False
+) -> str | None:
+    """
+    Check that request data only holds string values for the title and the
+    fields of its entry type. With `ignore_unknown` other keys (such as the
+    timestamps of an entry sent back by the edit form) are skipped instead
+    of rejected; they are not stored either way. Returns an error message,
+    or None if valid.
+    """
+    allowed = {"title", *ENTRY_FIELDS[entry_type]}
+    for key, value in data.items():
+        if key in ("op", "id", "type"):
+            continue
+        if key not in allowed:
+            if ignore_unknown:
+                continue
+            return f"Unknown field '{key}' for {entry_type} entries"
+        if not isinstance(value, str):
+            return f"Field '{key}' must be a string"
+    return None
+
+
+def apply_batch(vault: Vault, operations: list) -> tuple[list[dict], set, set, bool]:
+    """
+    Apply create/update/delete operations in order to a vault loaded for
+    update. Every operation is validated; later operations see the effect
+    of earlier ones. Returns (per-operation results, ids put, ids deleted,
+    ok); when ok is False the vault must be discarded, not saved.
+    """
+    created = set()
+    changed = set()
+    deleted = set()
+    results = []
+    ok = True
+
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in BATCH_OPS:
+            results.append({"index": i, "error": "op must be one of create, update, delete"})
+            ok = False
+            continue
+
+        op = operation["op"]
+        if op == "create":
+            entry_type = operation.get("type")
+            if entry_type not in VALID_ENTRY_TYPES:
+                error = "Invalid entry type"
+            else:
+                error = validate_entry_data(operation, entry_type)
+            if error:
+                results.append({"index": i, "op": op, "error": error})
+                ok = False
+                continue
+
+            new_entry = create_entry_from_data(operation, entry_type)
+            vault.put(new_entry)
+            created.add(new_entry.id)
+            changed.add(new_entry.id)
+            results.append({"index": i, "op": op, "id": new_entry.id, "status": "created"})
+            continue
+
+        entry_id = operation.get("id")
+        entry = vault.get(entry_id) if isinstance(entry_id, str) else None
+        if entry is None:
+            results.append({"index": i, "op": op, "id": entry_id, "error": "Entry not found"})
+            ok = False
+            continue
+
+        if op == "update":
+            error = validate_entry_data(operation, entry.type)
+            if error:
+                results.append({"index": i, "op": op, "id": entry_id, "error": error})
+                ok = False
+                continue
+
+            vault.put(update_entry_from_data(entry, operation))
+            changed.add(entry_id)
+            results.append({"index": i, "op": op, "id": entry_id, "status": "updated"})
+        else:
+            vault.remove(entry_id)
+            changed.discard(entry_id)
+            if entry_id not in created:
+                deleted.add(entry_id)
+            results.append({"index": i, "op": op, "id": entry_id, "status": "deleted"})
+
+    return results, changed, deleted, ok
+
+
+def import_entries(vault: Vault, records) -> tuple[set, dict]:
+    """
+    Add imported entry data to a vault loaded for update, skipping records
+    whose title and URL match an existing or already imported entry.
+    Returns (ids of the new entries, counts of imported/duplicate/skipped).
+    """
+    seen = {dedupe_key(entry) for entry in vault}
+    new_ids = set()
+    report = {"imported": 0, "duplicates": 0, "skipped": 0}
+
+    for data in records:
+        if data is None:
+            report["skipped"] += 1
+            continue
+
+        key = dedupe_key(data)
+        if key in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+
+        new_entry = create_entry_from_data(data, data["type"])
+        vault.put(new_entry)
+        new_ids.add(new_entry.id)
+        report["imported"] += 1
+
+    return new_ids, report
 
 
 # ============== ROUTES ==============
@@ -279,12 +827,68 @@ def update_entry_from_data(entry: dict, data: dict) -> dict:
 @app.route("/health")
 def health_check():
     """Health check endpoint for monitoring and load balancers."""
-    return jsonify(
-        {
-            "status": "healthy",
-            "service": "secret-management-system",
-        }
-    ), 200
+    health = {
+        "status": "healthy",
+        "service": "secret-management-system",
+    }
+    if is_sync_enabled():
+        health["sync"] = {"backend": SYNC_BACKEND, **uploader.status()}
+    health["kdf"] = kdf_executor.status()
+
+    return jsonify(health), 200
+
+
+@app.route("/ready")
+def readiness_check():
+    """Readiness probe: 503 until the startup vault sync has finished."""
+    if not startup_sync_done():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready"}), 200
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics of every worker of this server."""
+    if not METRICS_TOKEN:
+        if client_address() not in ("127.0.0.1", "::1"):
+            return Response("Forbidden\n", status=403, mimetype="text/plain")
+    elif not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    for kind, path in (("snapshot", VAULT_FILE), ("journal", journal_path(VAULT_FILE))):
+        try:
+            FILE_BYTES.set(os.path.getsize(path), file=kind)
+        except OSError:
+            FILE_BYTES.set(0, file=kind)
+
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/api/admin/profiling", methods=["GET", "POST"])
+def admin_profiling():
+    """Show or switch request profiling for all workers (needs ADMIN_TOKEN)."""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}"
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        settings = profiler.settings()
+        try:
+            profiler.configure(
+                data.get("mode", settings["mode"]),
+                int(data.get("every", settings["every"])),
+                float(data.get("interval_ms", settings["interval_ms"])),
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+    return jsonify(profiler.status())
 
 
 @app.route("/")
@@ -297,6 +901,7 @@ def index():
 
 
 @app.route("/api/setup", methods=["POST"])
+@vault_write
 def setup():
     """Create new vault with master password."""
     if vault_exists():
@@ -313,12 +918,14 @@ def setup():
         return jsonify({"error": "Passwords do not match"}), 400
 
     # Create and save empty vault
+    vault_key = run_kdf(create_vault_key, master_password)
     vault = create_empty_vault()
-    save_vault(vault, master_password)
+    signature = write_vault_file(encrypt_vault_with_key(vault, vault_key))
+    vault_cache.put(signature, vault_key, Vault.from_dict(vault))
 
     # Auto login after setup
+    start_key_session(vault_key)
     session["authenticated"] = True
-    session["master_password"] = master_password  # Stored in server-side session
     session.permanent = True
 
     return jsonify({"success": True, "message": "Vault created successfully"})
@@ -330,24 +937,76 @@ def login():
     if not vault_exists():
         return jsonify({"error": "No vault found. Please setup first."}), 400
 
+    throttled = attempt_throttled()
+    if throttled:
+        return throttled
+
     data = request.get_json()
     master_password = data.get("master_password", "")
 
-    vault = load_vault(master_password)
+    vault = unlock_vault(master_password)
     if vault is None:
+        login_throttle.failed(client_address())
+        FAILED_LOGINS.inc()
         return jsonify({"error": "Invalid master password"}), 401
+    login_throttle.succeeded(client_address())
+
+    rewrap_outdated_key(master_password)
 
     session["authenticated"] = True
-    session["master_password"] = master_password
     session.permanent = True
 
     return jsonify({"success": True})
 
 
+@app.route("/api/change-password", methods=["POST"])
+@login_required
+@vault_write
+def change_password():
+    """Change the master password by re-wrapping the vault data key."""
+    data = request.get_json()
+    current_password = data.get("current_password", "")
+    new_password = data.get("new_password", "")
+    confirm_password = data.get("confirm_password", "")
+
+    if len(new_password) < 8:
+        return jsonify({"error": "Password must be at least 8 characters"}), 400
+
+    if new_password != confirm_password:
+        return jsonify({"error": "Passwords do not match"}), 400
+
+    encrypted_data = read_vault_file()
+    if encrypted_data is None:
+        return jsonify({"error": "No vault found. Please setup first."}), 400
+
+    throttled = attempt_throttled()
+    if throttled:
+        return throttled
+
+    vault_key = run_kdf(unlock_vault_key, encrypted_data, current_password)
+    if vault_key is None:
+        login_throttle.failed(client_address())
+        FAILED_LOGINS.inc()
+        return jsonify({"error": "Invalid master password"}), 401
+
+    new_key = run_kdf(rewrap_vault_key, vault_key, new_password)
+    if vault_key.legacy_key:
+        # v1 vault: the payload itself must be re-encrypted once
+        vault = decrypt_vault_with_key(encrypted_data, vault_key)
+        write_vault_file(encrypt_vault_with_key(vault, new_key))
+    else:
+        write_vault_file(replace_vault_header(encrypted_data, new_key.header))
+
+    vault_cache.invalidate()
+    start_key_session(new_key)
+
+    return jsonify({"success": True})
+
+
 @app.route("/api/logout", methods=["POST"])
 def logout():
     """Clear session and logout."""
-    session.clear()
+    end_key_session()
     return jsonify({"success": True})
 
 
@@ -361,107 +1020,370 @@ def dashboard():
 @app.route("/api/entries", methods=["GET"])
 @login_required
 def get_entries():
-    """Get all vault entries (without sensitive data)."""
-    master_password = session.get("master_password")
-    vault = load_vault(master_password)
+    """Get all vault entries, or those of one ?type= (without sensitive data)."""
+    vault = load_vault()
 
     if vault is None:
-        session.clear()
+        end_key_session()
         return jsonify({"error": "Session expired"}), 401
 
+    entry_type = request.args.get("type") or None
+    if entry_type is not None and entry_type not in VALID_ENTRY_TYPES:
+        return jsonify({"error": "Invalid entry type"}), 400
+
+    etag = entries_etag(vault)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
     # Return entries with preview fields only
-    safe_entries = [get_entry_preview(entry) for entry in vault.get("entries", [])]
+    with phase("preview"):
+        safe_entries = vault.previews(entry_type)
+
+    response = jsonify(
+        {"entries": safe_entries, "revision": vault.revision, "revision_tag": etag}
+    )
+    return with_etag(response, etag)
+
+
+@app.route("/api/entries/changes", methods=["GET"])
+@login_required
+def get_entry_changes():
+    """Get previews of entries changed and ids of entries deleted since a revision tag."""
+    vault = load_vault()
+
+    if vault is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
+
+    since = request.args.get("since", "")
+    try:
+        parse_revision_tag(since)
+    except ValueError:
+        return jsonify({"error": "since must be a revision tag from the entry list"}), 400
+
+    revision = vault.revision
+    revision_tag = vault.revision_tag
+    delta = vault.changes_since(since)
+    if delta is None:
+        # Too old (or another vault): send the whole list instead
+        with phase("preview"):
+            safe_entries = vault.previews()
+        return jsonify(
+            {
+                "reset": True,
+                "entries": safe_entries,
+                "deleted": [],
+                "revision": revision,
+                "revision_tag": revision_tag,
+            }
+        )
+
+    entries, deleted = delta
+    with phase("preview"):
+        previews = [entry.preview() for entry in entries]
+    return jsonify(
+        {
+            "reset": False,
+            "entries": previews,
+            "deleted": deleted,
+            "revision": revision,
+            "revision_tag": revision_tag,
+        }
+    )
+
+
+@app.route("/api/entries/search", methods=["GET"])
+@login_required
+def search_entries():
+    """Search entry previews, ranked and paginated."""
+    vault = load_vault()
+
+    if vault is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
+
+    entry_type = request.args.get("type") or None
+    if entry_type is not None and entry_type not in VALID_ENTRY_TYPES:
+        return jsonify({"error": "Invalid entry type"}), 400
+
+    try:
+        cursor = int(request.args.get("cursor") or 0)
+        limit = int(request.args.get("limit") or DEFAULT_LIMIT)
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+
+    vault_key = cached_session_key()
+    if vault_key is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
 
-    return jsonify({"entries": safe_entries})
+    revision = vault.revision
+    if not search_index.matches(vault_key.data_key, revision):
+        index_vault(vault, vault_key)
+
+    with phase("search"):
+        results, next_cursor, total = search_index.search(
+            request.args.get("q", ""), entry_type, cursor, limit
+        )
+
+    return jsonify(
+        {
+            "entries": results,
+            "next_cursor": str(next_cursor) if next_cursor is not None else None,
+            "total": total,
+            "revision": revision,
+            "revision_tag": vault.revision_tag,
+        }
+    )
 
 
 @app.route("/api/entries/<entry_id>", methods=["GET"])
 @login_required
 def get_entry(entry_id):
     """Get full entry details including sensitive data."""
-    master_password = session.get("master_password")
-    vault = load_vault(master_password)
+    unlocked, entry = load_entry(entry_id)
 
-    if vault is None:
-        session.clear()
+    if not unlocked:
+        end_key_session()
         return jsonify({"error": "Session expired"}), 401
 
-    for entry in vault.get("entries", []):
-        if entry["id"] == entry_id:
-            return jsonify({"entry": entry})
+    if entry is None:
+        return jsonify({"error": "Entry not found"}), 404
 
-    return jsonify({"error": "Entry not found"}), 404
+    return jsonify({"entry": entry})
 
 
 @app.route("/api/entries", methods=["POST"])
 @login_required
+@vault_write
 def create_entry():
     """Create new vault entry."""
-    master_password = session.get("master_password")
-    vault = load_vault(master_password)
+    vault = load_vault(for_update=True)
 
     if vault is None:
-        session.clear()
+        end_key_session()
         return jsonify({"error": "Session expired"}), 401
 
+    stale = check_revision(vault)
+    if stale:
+        return stale
+
     data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     entry_type = data.get("type")
 
     if entry_type not in VALID_ENTRY_TYPES:
         return jsonify({"error": "Invalid entry type"}), 400
 
+    error = validate_entry_data(data, entry_type, ignore_unknown=True)
+    if error:
+        return jsonify({"error": error}), 400
+
     new_entry = create_entry_from_data(data, entry_type)
 
-    vault["entries"].append(new_entry)
-    save_vault(vault, master_password)
+    vault.put(new_entry)
+    save_vault(vault, changed={new_entry.id})
+
+    return jsonify(
+        {
+            "success": True,
+            "entry": new_entry.to_dict(),
+            "revision": vault.revision,
+            "revision_tag": vault.revision_tag,
+        }
+    )
+
+
+@app.route("/api/entries/batch", methods=["POST"])
+@login_required
+@vault_write
+def batch_entries():
+    """Apply many creates, updates and deletes with a single save, all or nothing."""
+    vault = load_vault(for_update=True)
+
+    if vault is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
+
+    stale = check_revision(vault)
+    if stale:
+        return stale
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify(
+            {"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}
+        ), 400
+
+    results, changed, deleted, ok = apply_batch(vault, operations)
+    if not ok:
+        return jsonify(
+            {
+                "success": False,
+                "error": "Batch rejected, no changes were saved",
+                "results": results,
+            }
+        ), 400
+
+    save_vault(vault, changed=changed, deleted=deleted)
+
+    return jsonify(
+        {
+            "success": True,
+            "results": results,
+            "revision": vault.revision,
+            "revision_tag": vault.revision_tag,
+        }
+    )
+
+
+@app.route("/api/import", methods=["POST"])
+@login_required
+@vault_write
+def import_vault():
+    """Import entries from an uploaded export file, saved all at once."""
+    vault = load_vault(for_update=True)
+
+    if vault is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
+
+    stale = check_revision(vault)
+    if stale:
+        return stale
+
+    upload = request.files.get("file")
+    file_format = request.form.get("format", "")
+
+    if upload is None:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    if file_format not in IMPORT_FORMATS:
+        return jsonify(
+            {"error": f"format must be one of {', '.join(IMPORT_FORMATS)}"}
+        ), 400
 
-    return jsonify({"success": True, "entry": new_entry})
+    # Parsed as it is read; nothing is saved if the file turns out malformed
+    fh = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    try:
+        new_ids, report = import_entries(vault, parse_import(fh, file_format))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Could not read import file: {e}"}), 400
+
+    if new_ids:
+        save_vault(vault, changed=new_ids)
+
+    return jsonify(
+        {
+            "success": True,
+            **report,
+            "revision": vault.revision,
+            "revision_tag": vault.revision_tag,
+        }
+    )
+
+
+@app.route("/api/export", methods=["GET"])
+@login_required
+def export_vault():
+    """Stream every decrypted entry as a JSON or CSV download."""
+    vault = load_vault()
+
+    if vault is None:
+        end_key_session()
+        return jsonify({"error": "Session expired"}), 401
+
+    file_format = request.args.get("format", "json")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify(
+            {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}
+        ), 400
+
+    # The cached vault may be replaced (not mutated) while streaming
+    entries = list(vault)
+    filename = f"vault-export-{datetime.utcnow():%Y%m%d}.{file_format}"
+
+    return Response(
+        stream_with_context(export_entries(entries, file_format)),
+        mimetype="application/json" if file_format == "json" else "text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        },
+    )
 
 
 @app.route("/api/entries/<entry_id>", methods=["PUT"])
 @login_required
+@vault_write
 def update_entry(entry_id):
     """Update existing vault entry."""
-    master_password = session.get("master_password")
-    vault = load_vault(master_password)
+    vault = load_vault(for_update=True)
 
     if vault is None:
-        session.clear()
+        end_key_session()
         return jsonify({"error": "Session expired"}), 401
 
+    stale = check_revision(vault)
+    if stale:
+        return stale
+
     data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
 
-    for i, entry in enumerate(vault.get("entries", [])):
-        if entry["id"] == entry_id:
-            updated_entry = update_entry_from_data(entry, data)
-            vault["entries"][i] = updated_entry
-            save_vault(vault, master_password)
+    entry = vault.get(entry_id)
+    if entry is None:
+        return jsonify({"error": "Entry not found"}), 404
+
+    error = validate_entry_data(data, entry.type, ignore_unknown=True)
+    if error:
+        return jsonify({"error": error}), 400
 
-            return jsonify({"success": True, "entry": updated_entry})
+    updated_entry = update_entry_from_data(entry, data)
+    vault.put(updated_entry)
+    save_vault(vault, changed={entry_id})
 
-    return jsonify({"error": "Entry not found"}), 404
+    return jsonify(
+        {
+            "success": True,
+            "entry": updated_entry.to_dict(),
+            "revision": vault.revision,
+            "revision_tag": vault.revision_tag,
+        }
+    )
 
 
 @app.route("/api/entries/<entry_id>", methods=["DELETE"])
 @login_required
+@vault_write
 def delete_entry(entry_id):
     """Delete vault entry."""
-    master_password = session.get("master_password")
-    vault = load_vault(master_password)
+    vault = load_vault(for_update=True)
 
     if vault is None:
-        session.clear()
+        end_key_session()
         return jsonify({"error": "Session expired"}), 401
 
-    original_length = len(vault.get("entries", []))
-    vault["entries"] = [e for e in vault.get("entries", []) if e["id"] != entry_id]
+    stale = check_revision(vault)
+    if stale:
+        return stale
 
-    if len(vault["entries"]) == original_length:
+    if vault.remove(entry_id) is None:
         return jsonify({"error": "Entry not found"}), 404
 
-    save_vault(vault, master_password)
+    save_vault(vault, changed=set(), deleted={entry_id})
 
-    return jsonify({"success": True})
+    return jsonify(
+        {"success": True, "revision": vault.revision, "revision_tag": vault.revision_tag}
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+"""
+Production assets for Secret Management System
+Build step for fingerprinted, precompressed static files and precompiled templates, and serving them
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import Flask, request, send_from_directory
+from jinja2 import ChoiceLoader, ModuleLoader
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional, gzip is always built
+    brotli = None
+
+# Where `flask vault build-assets` writes its output
+ASSETS_BUILD_DIR = os.environ.get(
+    "ASSETS_BUILD_DIR", os.path.join(os.path.dirname(__file__), "build")
+)
+
+MANIFEST_FILE = "manifest.json"
+
+# Fingerprinted names change with the content, so browsers may keep them forever
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Text files get .br/.gz variants, kept only when they are smaller
+COMPRESSIBLE_TYPES = (".css", ".js", ".svg", ".json", ".txt", ".html")
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Preferred first; suffix of the precompressed file per Content-Encoding
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _fingerprinted(name: str, data: bytes) -> str:
+    """css/index.css -> css/index.<hash>.css"""
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def build_assets(app: Flask, build_dir: str = ASSETS_BUILD_DIR) -> dict:
+    """
+    Build `build_dir` from the app's static folder and templates:
+    static/<name>.<hash>.<ext> with .br/.gz variants, templates/ compiled
+    to Python modules, and the manifest mapping source names to built
+    ones. The old build is replaced once the new one is complete.
+    Returns the manifest.
+    """
+    tmp_dir = build_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    static_out = os.path.join(tmp_dir, "static")
+
+    assets = {}
+    encodings = {}
+    for root, _, files in os.walk(app.static_folder):
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, app.static_folder).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+
+            built = _fingerprinted(name, data)
+            target = os.path.join(static_out, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+
+            available = []
+            if name.endswith(COMPRESSIBLE_TYPES):
+                for encoding, suffix in ENCODINGS:
+                    if encoding == "br" and brotli is None:
+                        continue
+                    compressed = _compress(encoding, data)
+                    if len(compressed) < len(data):
+                        with open(target + suffix, "wb") as f:
+                            f.write(compressed)
+                        available.append(encoding)
+            assets[name] = built
+            encodings[built] = available
+
+    # Compile with the source loader, even when the app already serves a build
+    env = app.jinja_env.overlay(loader=app.create_global_jinja_loader())
+    env.compile_templates(os.path.join(tmp_dir, "templates"), zip=None)
+
+    manifest = {"assets": assets, "encodings": encodings}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.replace(tmp_dir, build_dir)
+    return manifest
+
+
+def use_built_assets(app: Flask, build_dir: str = ASSETS_BUILD_DIR) -> bool:
+    """
+    Serve the build in `build_dir`: url_for("static", ...) links to the
+    fingerprinted files, which are sent precompressed when the client
+    accepts it and with an immutable Cache-Control; templates load from
+    their compiled modules. Returns False (and changes nothing) if there
+    is no build.
+    """
+    try:
+        with open(os.path.join(build_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[Assets] No asset build in {build_dir} ({e}), serving sources")
+        return False
+
+    assets = manifest["assets"]
+    encodings = manifest["encodings"]
+    static_dir = os.path.join(build_dir, "static")
+    send_static_file = app.view_functions["static"]
+
+    @app.url_defaults
+    def fingerprinted_static_url(endpoint, values):
+        if endpoint == "static" and values.get("filename") in assets:
+            values["filename"] = assets[values["filename"]]
+
+    def static(filename):
+        available = encodings.get(filename)
+        if available is None:
+            return send_static_file(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, suffix in ENCODINGS:
+            if encoding in available and request.accept_encodings[encoding]:
+                response = send_from_directory(
+                    static_dir, filename + suffix, mimetype=mimetype, max_age=ASSET_MAX_AGE
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(
+                static_dir, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE
+            )
+        response.cache_control.immutable = True
+        response.vary.add("Accept-Encoding")
+        return response
+
+    app.view_functions["static"] = static
+
+    # Compiled templates first; sources for any added after the build
+    app.jinja_env.loader = ChoiceLoader(
+        [ModuleLoader(os.path.join(build_dir, "templates")), app.jinja_env.loader]
+    )
+    print(f"[Assets] Serving {len(assets)} built assets and compiled templates")
+    return True
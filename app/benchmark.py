@@ -0,0 +1,395 @@
+"""
+Benchmarks for Secret Management System
+Times key derivation, vault encryption/decryption, entry previews and the
+/api/entries routes on synthetic vaults, and writes the results as JSON.
+Run with: python -m app.benchmark [--output bench.json] [--compare old.json]
+"""
+
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+import click
+
+from app import crypto_utils
+from app.crypto_utils import (
+    create_vault_key,
+    decrypt_vault,
+    decrypt_vault_with_key,
+    derive_key,
+    encrypt_vault,
+    encrypt_vault_with_key,
+)
+from app.schema import VALID_ENTRY_TYPES, ENTRY_FIELDS
+
+# Version of the result document, bumped when its layout changes
+RESULTS_FORMAT = 1
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+MASTER_PASSWORD = "benchmark-password"
+
+# Fields filled with digits rather than words
+DIGIT_FIELDS = {
+    "card_number": 16,
+    "security_code": 3,
+    "pin": 4,
+    "account_number": 12,
+    "routing_number": 9,
+    "phone": 12,
+    "postal_code": 5,
+}
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+        for _ in range(count)
+    )
+
+
+def synthetic_entry(rng: random.Random, i: int) -> dict:
+    """One entry of realistic shape; types cycle through all entry types."""
+    entry_type = VALID_ENTRY_TYPES[i % len(VALID_ENTRY_TYPES)]
+    entry = {
+        "id": f"bench-{i:07d}",
+        "type": entry_type,
+        "title": f"{_words(rng, 2).title()} {i}",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+    }
+    for field in ENTRY_FIELDS[entry_type]:
+        if field in DIGIT_FIELDS:
+            entry[field] = "".join(rng.choices(string.digits, k=DIGIT_FIELDS[field]))
+        elif field in ("notes", "private_key", "public_key", "license_key"):
+            entry[field] = _words(rng, rng.randint(10, 40))
+        elif field in ("password", "api_key", "api_secret", "secret"):
+            entry[field] = "".join(rng.choices(string.ascii_letters + string.digits, k=24))
+        else:
+            entry[field] = _words(rng, 1)
+    return entry
+
+
+def synthetic_vault(size: int, seed: int = 0) -> dict:
+    """A vault with `size` entries, the same for the same seed."""
+    rng = random.Random(seed)
+    return {
+        "version": 1,
+        "revision": 1,
+        "entries": [synthetic_entry(rng, i) for i in range(size)],
+    }
+
+
+def measure(func: Callable[[int], object], repeat: int) -> dict:
+    """Call func(i) `repeat` times; timings in milliseconds."""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "max_ms": round(max(samples), 4),
+    }
+
+
+class Runner:
+    """Collects one result per benchmark and echoes progress to stderr."""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name: str, func: Callable[[int], object], entries=None, repeat=None, **extra):
+        result = {"name": name, "entries": entries, **extra}
+        result.update(measure(func, repeat or self.repeat))
+        self.results.append(result)
+        size = f"[{entries}]" if entries is not None else ""
+        size_info = f" {result['bytes']:>12,} bytes" if "bytes" in result else ""
+        click.echo(
+            f"{name + size:<40} median {result['median_ms']:>10.2f} ms{size_info}", err=True
+        )
+        return result
+
+
+# ============== BENCHMARKS ==============
+
+
+def bench_kdf(runner: Runner):
+    salt = os.urandom(crypto_utils.SALT_SIZE)
+    runner.run("derive_key", lambda i: derive_key(MASTER_PASSWORD, salt))
+
+
+def bench_crypto(runner: Runner, size: int, vault: dict):
+    """Whole-vault encryption, with and without key derivation."""
+    vault_key = create_vault_key(MASTER_PASSWORD)
+    encrypted = encrypt_vault_with_key(vault, vault_key)
+    extra = {"bytes": len(encrypted)}
+
+    runner.run("encrypt_vault", lambda i: encrypt_vault(vault, MASTER_PASSWORD), size, **extra)
+    runner.run("decrypt_vault", lambda i: decrypt_vault(encrypted, MASTER_PASSWORD), size, **extra)
+    runner.run("encrypt_vault_with_key", lambda i: encrypt_vault_with_key(vault, vault_key), size, **extra)
+    runner.run("decrypt_vault_with_key", lambda i: decrypt_vault_with_key(encrypted, vault_key), size, **extra)
+
+    # Saving one changed entry copies the other records
+    one = {vault["entries"][0]["id"]} if vault["entries"] else set()
+    runner.run(
+        "encrypt_vault_with_key.one_changed",
+        lambda i: encrypt_vault_with_key(vault, vault_key, previous=encrypted, changed=one),
+        size,
+        **extra,
+    )
+
+
+def bench_compression(runner: Runner, size: int, vault: dict):
+    """Snapshot size against encrypt/decrypt time for each codec."""
+    codecs = ["none", "zlib"] + (["zstd"] if crypto_utils.zstandard is not None else [])
+    vault_key = create_vault_key(MASTER_PASSWORD)
+    setting = crypto_utils.COMPRESSION
+    try:
+        for codec in codecs:
+            crypto_utils.COMPRESSION = codec
+            encrypted = encrypt_vault_with_key(vault, vault_key)
+            extra = {"compression": codec, "bytes": len(encrypted)}
+            runner.run(
+                f"compression.{codec}.encrypt",
+                lambda i: encrypt_vault_with_key(vault, vault_key),
+                size,
+                **extra,
+            )
+            runner.run(
+                f"compression.{codec}.decrypt",
+                lambda i, encrypted=encrypted: decrypt_vault_with_key(encrypted, vault_key),
+                size,
+                **extra,
+            )
+    finally:
+        crypto_utils.COMPRESSION = setting
+
+
+def bench_previews(runner: Runner, size: int, vault: dict):
+    """Building the vault model, previews cold and memoized, id lookups."""
+    from app.vault_model import Vault
+
+    model = Vault.from_dict(vault)
+    ids = [entry["id"] for entry in vault["entries"]]
+
+    runner.run("Vault.from_dict", lambda i: Vault.from_dict(vault), size)
+    runner.run("Vault.previews.cold", lambda i: Vault.from_dict(vault).previews(), size)
+    model.previews()
+    runner.run("Vault.previews", lambda i: model.previews(), size)
+    runner.run("Vault.get", lambda i: [model.get(entry_id) for entry_id in ids[:1000]], size)
+    runner.run("Vault.copy", lambda i: model.copy(), size)
+
+
+def bench_routes(runner: Runner, size: int, vault: dict):
+    """Every /api/entries route through the Flask test client, logged in."""
+    from app import app as web
+    from app.vault_store import write_snapshot
+
+    vault_key = create_vault_key(MASTER_PASSWORD)
+    write_snapshot(web.VAULT_FILE, encrypt_vault_with_key(vault, vault_key))
+    web.vault_cache.invalidate()
+
+    client = web.app.test_client()
+
+    def login(i):
+        response = client.post("/api/login", json={"master_password": MASTER_PASSWORD})
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    runner.run("POST /api/login", login, size, repeat=min(runner.repeat, 3))
+
+    def get(url, status=200, **kwargs):
+        def call(i):
+            response = client.get(url, **kwargs)
+            assert response.status_code == status, (url, response.status_code)
+            return response
+
+        return call
+
+    listing = get("/api/entries")(0)
+    etag = listing.headers["ETag"]
+    revision = listing.get_json()["revision"]
+    ids = [e["id"] for e in vault["entries"]]
+    term = vault["entries"][0]["title"].split()[0] if ids else "x"
+
+    runner.run("GET /api/entries", get("/api/entries"), size)
+    runner.run(
+        "GET /api/entries (304)",
+        get("/api/entries", 304, headers={"If-None-Match": etag}),
+        size,
+    )
+    runner.run("GET /api/entries/changes", get(f"/api/entries/changes?since={revision}"), size)
+    runner.run("GET /api/entries/search", get(f"/api/entries/search?q={term}"), size)
+    if ids:
+        runner.run("GET /api/entries/<id>", get(f"/api/entries/{ids[len(ids) // 2]}"), size)
+
+    def write(method, url_of, body_of):
+        def call(i):
+            response = client.open(url_of(i), method=method, json=body_of(i))
+            assert response.status_code == 200, (url_of(i), response.get_data(as_text=True))
+
+        return call
+
+    runner.run(
+        "POST /api/entries",
+        write("POST", lambda i: "/api/entries", lambda i: {"type": "login", "title": f"New {i}"}),
+        size,
+    )
+    if len(ids) >= runner.repeat * 12:
+        runner.run(
+            "PUT /api/entries/<id>",
+            write("PUT", lambda i: f"/api/entries/{ids[i]}", lambda i: {"title": f"Renamed {i}"}),
+            size,
+        )
+        runner.run(
+            "POST /api/entries/batch",
+            write(
+                "POST",
+                lambda i: "/api/entries/batch",
+                lambda i: {
+                    "operations": [
+                        {"op": "update", "id": ids[-1 - i * 10 - k], "title": f"Batch {i}.{k}"}
+                        for k in range(10)
+                    ]
+                },
+            ),
+            size,
+            operations=10,
+        )
+        runner.run(
+            "DELETE /api/entries/<id>",
+            write("DELETE", lambda i: f"/api/entries/{ids[runner.repeat + i]}", lambda i: None),
+            size,
+        )
+
+    web.compactor.flush()
+
+
+# ============== REPORT ==============
+
+
+def environment() -> dict:
+    """What the numbers depend on besides the code."""
+    from importlib import metadata
+
+    try:
+        version = metadata.version("secret-management-system")
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        "version": version,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "argon2": {
+            "time_cost": crypto_utils.ARGON2_TIME_COST,
+            "memory_cost": crypto_utils.ARGON2_MEMORY_COST,
+            "parallelism": crypto_utils.ARGON2_PARALLELISM,
+        },
+    }
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[str]:
+    """Print median ratios against a baseline; return the regressions."""
+    previous = {(r["name"], r["entries"]): r for r in baseline.get("results", [])}
+    regressions = []
+    click.echo(f"\n{'benchmark':<40} {'baseline':>10} {'now':>10} {'ratio':>7}", err=True)
+    for result in results:
+        old = previous.get((result["name"], result["entries"]))
+        if not old or not old["median_ms"]:
+            continue
+        ratio = result["median_ms"] / old["median_ms"]
+        label = result["name"] + (f"[{result['entries']}]" if result["entries"] is not None else "")
+        flag = " !" if ratio > threshold else ""
+        click.echo(
+            f"{label:<40} {old['median_ms']:>10.2f} {result['median_ms']:>10.2f} {ratio:>6.2f}x{flag}",
+            err=True,
+        )
+        if ratio > threshold:
+            regressions.append(label)
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default=",".join(map(str, DEFAULT_SIZES)),
+    show_default=True,
+    help="Comma-separated vault sizes (number of entries).",
+)
+@click.option("--repeat", default=5, show_default=True, help="Runs per benchmark.")
+@click.option(
+    "--only",
+    type=click.Choice(["kdf", "crypto", "compression", "preview", "routes"]),
+    multiple=True,
+    help="Run only these groups (repeatable).",
+)
+@click.option("--output", type=click.File("w"), default="-", help="Write JSON results here.")
+@click.option(
+    "--compare",
+    "baseline",
+    type=click.File("r"),
+    help="Earlier results to compare medians against.",
+)
+@click.option(
+    "--threshold",
+    default=1.25,
+    show_default=True,
+    help="With --compare, exit non-zero if a median grew by more than this factor.",
+)
+def main(sizes, repeat, only, output, baseline, threshold):
+    """Benchmark the crypto, storage and HTTP hot paths."""
+    sizes = [int(s) for s in sizes.split(",") if s.strip()]
+    groups = set(only) or {"kdf", "crypto", "compression", "preview", "routes"}
+    runner = Runner(repeat)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The app reads its configuration at import; keep it away from real data
+        os.environ["VAULT_FILE_PATH"] = os.path.join(workdir, "vault.enc")
+        os.environ["SYNC_BACKEND"] = "none"
+
+        if "kdf" in groups:
+            bench_kdf(runner)
+        for size in sizes:
+            vault = synthetic_vault(size)
+            if "crypto" in groups:
+                bench_crypto(runner, size, vault)
+            if "compression" in groups:
+                bench_compression(runner, size, vault)
+            if "preview" in groups:
+                bench_previews(runner, size, vault)
+            if "routes" in groups:
+                bench_routes(runner, size, vault)
+
+    document = {
+        "format": RESULTS_FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "results": runner.results,
+    }
+    json.dump(document, output, indent=2)
+    output.write("\n")
+    output.flush()
+
+    if baseline is not None:
+        regressions = compare(runner.results, json.load(baseline), threshold)
+        if regressions:
+            click.echo(f"\n{len(regressions)} benchmark(s) slower than {threshold}x baseline", err=True)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
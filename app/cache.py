@@ -0,0 +1,253 @@
+"""
+Caches for Secret Management System
+Keeps derived vault keys per session so Argon2id runs once per login
+(in memory, and sealed on disk for the other workers), and the decrypted
+vault per worker until the vault files change
+"""
+
+import base64
+import dataclasses
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.crypto_utils import NONCE_SIZE, VaultKey
+from app.metrics import CACHE_REQUESTS, ENTRIES
+from app.schema import VALID_ENTRY_TYPES
+from app.vault_model import Vault
+
+
+class KeyCache:
+    """
+    Bounded, thread-safe map of opaque session handle -> unlocked vault key.
+
+    Entries expire after `ttl` seconds without use (sliding, like the Flask
+    session cookie) and the least recently used entry is dropped once
+    `max_size` handles are cached.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 64):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_handle() -> str:
+        """Generate an opaque handle to store in the session cookie."""
+        return secrets.token_urlsafe(32)
+
+    def get(self, handle: str) -> Optional[VaultKey]:
+        """Return the key for a handle, or None if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(handle)
+            if item is not None and item[1] <= now:
+                del self._entries[handle]
+                item = None
+            if item is None:
+                CACHE_REQUESTS.inc(cache="key", result="miss")
+                return None
+
+            vault_key = item[0]
+            self._entries[handle] = (vault_key, now + self.ttl)
+            self._entries.move_to_end(handle)
+            CACHE_REQUESTS.inc(cache="key", result="hit")
+            return vault_key
+
+    def put(self, handle: str, vault_key: VaultKey):
+        """Cache an unlocked key under a session handle."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[handle] = (vault_key, now + self.ttl)
+            self._entries.move_to_end(handle)
+            self._prune(now)
+
+    def evict(self, handle: Optional[str]):
+        """Forget the key for a handle (logout / expired session)."""
+        if not handle:
+            return
+        with self._lock:
+            self._entries.pop(handle, None)
+
+    def clear(self):
+        """Forget every cached key."""
+        with self._lock:
+            self._entries.clear()
+
+    def _prune(self, now: float):
+        """Drop expired entries, then the oldest ones above max_size."""
+        expired = [h for h, item in self._entries.items() if item[1] <= now]
+        for handle in expired:
+            del self._entries[handle]
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class SessionKeyStore:
+    """
+    Unlocked vault keys shared by the workers, one file per session handle.
+
+    Each key is sealed with AES-GCM under a random secret that only the
+    session cookie holds, so the files alone open nothing. A worker whose
+    KeyCache misses (another worker unlocked, or a restart) reads the key
+    from here instead of deriving it again. Files expire `ttl` seconds after
+    their last use, like the session cookie.
+    """
+
+    _HANDLE = re.compile(r"^[A-Za-z0-9_-]{16,128}$")
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+
+    @staticmethod
+    def new_secret() -> str:
+        """Generate the secret to store in the session cookie next to the handle."""
+        return base64.urlsafe_b64encode(secrets.token_bytes(32)).decode("ascii")
+
+    def _path(self, handle: str) -> Optional[str]:
+        if not handle or not self._HANDLE.match(handle):
+            return None
+        return os.path.join(self.directory, handle)
+
+    def get(self, handle: str, secret: str) -> Optional[VaultKey]:
+        """Return the key for a handle, or None if missing, expired or not openable."""
+        path = self._path(handle)
+        if path is None or not secret:
+            return None
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                self.evict(handle)
+                return None
+            with open(path, "rb") as f:
+                sealed = f.read()
+            key = base64.urlsafe_b64decode(secret)
+            data = AESGCM(key).decrypt(
+                sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], handle.encode("ascii")
+            )
+            os.utime(path)
+        except (OSError, ValueError, InvalidTag):
+            return None
+
+        fields = json.loads(data)
+        return VaultKey(
+            **{name: value and base64.b64decode(value) for name, value in fields.items()}
+        )
+
+    def put(self, handle: str, secret: str, vault_key: VaultKey):
+        """Seal a key under a session handle (0600, written atomically)."""
+        path = self._path(handle)
+        if path is None:
+            return
+        fields = {
+            name: value and base64.b64encode(value).decode("ascii")
+            for name, value in dataclasses.asdict(vault_key).items()
+        }
+        data = json.dumps(fields).encode("utf-8")
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = nonce + AESGCM(base64.urlsafe_b64decode(secret)).encrypt(
+            nonce, data, handle.encode("ascii")
+        )
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(sealed)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[Session] Error writing session key: {e}")
+            return
+        self._prune()
+
+    def evict(self, handle: Optional[str]):
+        """Forget the key for a handle (logout / expired session)."""
+        path = self._path(handle)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[Session] Error removing session key: {e}")
+
+    def _prune(self):
+        """Remove the files of sessions unused for longer than the TTL."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) <= cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class VaultCache:
+    """
+    Per-worker cache of the decrypted vault, validated against the files.
+
+    The cached vault is tied to the signature (inode, size, mtime) of the
+    vault snapshot and journal, so any write by another worker or a Drive
+    download invalidates it. The cached Vault is shared between request
+    threads and must be treated as read-only; callers that mutate take a
+    copy first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._key = None
+        self._vault = None
+
+    def get(self, signature: Optional[tuple]) -> Optional[tuple[VaultKey, Vault]]:
+        """Return (key, vault) if cached for the current file signature."""
+        with self._lock:
+            if signature is None or signature != self._signature:
+                CACHE_REQUESTS.inc(cache="vault", result="miss")
+                return None
+            CACHE_REQUESTS.inc(cache="vault", result="hit")
+            return self._key, self._vault
+
+    def peek(self) -> Optional[tuple[VaultKey, Vault]]:
+        """Return (key, vault) of whatever is cached, whatever its signature."""
+        with self._lock:
+            if self._vault is None:
+                return None
+            return self._key, self._vault
+
+    def put(self, signature: Optional[tuple], vault_key: VaultKey, vault: Vault):
+        """
+        Cache a vault for the file signature it was read or written with.
+        Readers take the signature before reading, writers right after
+        writing, so a concurrent write can only cause a miss.
+        """
+        with self._lock:
+            self._signature = signature
+            self._key = vault_key
+            self._vault = vault
+
+        for entry_type in VALID_ENTRY_TYPES:
+            ENTRIES.set(vault.count(entry_type), type=entry_type)
+
+    def invalidate(self):
+        """Drop the cached vault."""
+        with self._lock:
+            self._signature = None
+            self._key = None
+            self._vault = None
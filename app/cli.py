@@ -0,0 +1,214 @@
+"""
+Command line tools for Secret Management System
+Run with: flask --app app.cli vault <command>
+"""
+
+import csv
+import os
+import re
+
+import click
+
+from app.app import (
+    app,
+    VAULT_FILE,
+    import_entries,
+    save_vault,
+)
+from app.assets import ASSETS_BUILD_DIR, build_assets
+from app.crypto_utils import (
+    ARGON2_MEMORY_COST,
+    ARGON2_PARALLELISM,
+    KDF_MIN_MEMORY_COST,
+    VaultKey,
+    calibrate_kdf,
+    unlock_vault_key,
+)
+from app.transfer import EXPORT_FORMATS, IMPORT_FORMATS, export_entries, parse_import
+from app.vault_model import Vault
+from app.vault_store import open_vault, read_vault_files, vault_lock
+
+vault_cli = click.Group("vault", help="Manage the vault from the command line.")
+app.cli.add_command(vault_cli)
+
+password_option = click.option(
+    "--master-password",
+    prompt=True,
+    hide_input=True,
+    envvar="VAULT_MASTER_PASSWORD",
+    help="Master password (prompted if omitted).",
+)
+
+
+def open_vault_or_exit(master_password: str) -> tuple[VaultKey, Vault]:
+    """Unlock and decrypt the vault, or exit with an error message."""
+    _, encrypted_data, journal = read_vault_files(VAULT_FILE)
+    if encrypted_data is None:
+        raise click.ClickException(f"No vault found at {VAULT_FILE}")
+
+    vault_key = unlock_vault_key(encrypted_data, master_password)
+    try:
+        vault = open_vault(encrypted_data, journal, vault_key) if vault_key else None
+    except ValueError as e:
+        raise click.ClickException(f"Vault journal is damaged: {e}") from e
+    if vault is None:
+        raise click.ClickException("Invalid master password")
+    return vault_key, Vault.from_dict(vault)
+
+
+@vault_cli.command("import")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(IMPORT_FORMATS),
+    required=True,
+    help="Format of the source file.",
+)
+@password_option
+def import_command(source, file_format, master_password):
+    """Import entries from the SOURCE file in one save."""
+    with vault_lock(VAULT_FILE):
+        vault_key, vault = open_vault_or_exit(master_password)
+
+        try:
+            with open(source, encoding="utf-8-sig", newline="") as fh:
+                new_ids, report = import_entries(vault, parse_import(fh, file_format))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            raise click.ClickException(f"Could not read import file: {e}") from e
+
+        if new_ids:
+            save_vault(vault, changed=new_ids, vault_key=vault_key)
+
+    click.echo(
+        f"Imported {report['imported']} entries "
+        f"({report['duplicates']} duplicates, {report['skipped']} skipped)"
+    )
+
+
+@vault_cli.command("export")
+@click.argument("target", type=click.File("w", encoding="utf-8", lazy=True), default="-")
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(EXPORT_FORMATS),
+    default="json",
+    show_default=True,
+    help="Format of the export.",
+)
+@password_option
+def export_command(target, file_format, master_password):
+    """Export every decrypted entry to TARGET (stdout by default)."""
+    _, vault = open_vault_or_exit(master_password)
+
+    for chunk in export_entries(vault, file_format):
+        target.write(chunk)
+    target.flush()
+
+    click.echo(f"Exported {len(vault)} entries", err=True)
+
+
+@vault_cli.command("migrate")
+@password_option
+def migrate_command(master_password):
+    """Rewrite the vault now in the current file and entry formats."""
+    with vault_lock(VAULT_FILE):
+        vault_key, vault = open_vault_or_exit(master_password)
+        # Without a change set every record is re-encrypted
+        save_vault(vault, vault_key=vault_key)
+
+    click.echo(f"Rewrote {len(vault)} entries")
+
+
+def update_env_file(path: str, values: dict):
+    """Set KEY=value lines in a dotenv file, keeping everything else."""
+    lines = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        match = re.match(r"\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*=", line)
+        if match and match.group(1) in remaining:
+            lines[i] = f"{match.group(1)}={remaining.pop(match.group(1))}"
+    lines += [f"{key}={value}" for key, value in remaining.items()]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+@vault_cli.command("calibrate-kdf")
+@click.option(
+    "--target-ms",
+    type=click.FloatRange(min=1),
+    default=500,
+    show_default=True,
+    help="Unlock latency to aim for, in milliseconds.",
+)
+@click.option(
+    "--max-memory",
+    type=click.IntRange(min=KDF_MIN_MEMORY_COST),
+    default=ARGON2_MEMORY_COST,
+    show_default=True,
+    help="Most memory one derivation may use, in KiB.",
+)
+@click.option(
+    "--parallelism",
+    type=click.IntRange(min=1),
+    default=ARGON2_PARALLELISM,
+    show_default=True,
+    help="Argon2id lanes (threads).",
+)
+@click.option(
+    "--env-file",
+    type=click.Path(dir_okay=False),
+    help="Also write the parameters into this dotenv file.",
+)
+def calibrate_kdf_command(target_ms, max_memory, parallelism, env_file):
+    """
+    Pick Argon2id parameters for this machine. Vaults are re-wrapped with
+    them on the next login once the app runs with the printed settings.
+    """
+    params, elapsed = calibrate_kdf(target_ms, max_memory, parallelism)
+    values = {
+        "ARGON2_TIME_COST": params.time_cost,
+        "ARGON2_MEMORY_COST": params.memory_cost,
+        "ARGON2_PARALLELISM": params.parallelism,
+    }
+
+    click.echo(
+        f"Argon2id with {params.time_cost} passes, {params.memory_cost} KiB, "
+        f"{params.parallelism} lanes takes {elapsed:.0f} ms here",
+        err=True,
+    )
+    for key, value in values.items():
+        click.echo(f"{key}={value}")
+
+    if env_file:
+        update_env_file(env_file, values)
+        click.echo(f"Saved to {env_file}", err=True)
+
+
+@vault_cli.command("build-assets")
+@click.option(
+    "--build-dir",
+    type=click.Path(file_okay=False),
+    default=ASSETS_BUILD_DIR,
+    show_default=True,
+    help="Where to write the build (ASSETS_BUILD_DIR).",
+)
+def build_assets_command(build_dir):
+    """
+    Fingerprint and precompress the static files and compile the templates,
+    for APP_ENV=production. Re-run after changing either.
+    """
+    manifest = build_assets(app, build_dir)
+    for name, built in manifest["assets"].items():
+        encodings = ", ".join(manifest["encodings"][built]) or "uncompressed"
+        click.echo(f"{name} -> {built} ({encodings})")
+    click.echo(f"Built {len(manifest['assets'])} assets into {build_dir}", err=True)
+
+
+if __name__ == "__main__":
+    vault_cli()
@@ -5,89 +5,856 @@ Uses AES-256-GCM for encryption and Argon2id for key derivation
 
 import os
 import json
+import zlib
 import base64
+import struct
+import time
+import dataclasses
+from dataclasses import dataclass
 from typing import Optional
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from argon2.low_level import hash_secret_raw, Type
 
+from app.metrics import DECRYPT_SECONDS, ENCRYPT_SECONDS, KDF_INVOCATIONS, KDF_SECONDS
+from app.profiling import phase
+from app.schema import ENTRY_FORMAT_VERSION, pack_entry, unpack_entry
 
-# Argon2id parameters (OWASP recommendations)
-ARGON2_TIME_COST = 3
-ARGON2_MEMORY_COST = 65536  # 64 MB
-ARGON2_PARALLELISM = 4
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+
+# Argon2id parameters for new key wraps (OWASP recommendations by default).
+# Each vault header records the parameters it was wrapped with, so they can
+# be tuned per host (flask vault calibrate-kdf) without breaking vaults.
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", "65536"))  # KiB, 64 MB
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "4"))
 ARGON2_HASH_LEN = 32  # 256 bits for AES-256
 
+# Lowest parameters calibration may pick (OWASP minimum: 19 MiB, 2 passes)
+KDF_MIN_TIME_COST = 2
+KDF_MIN_MEMORY_COST = 19456
+KDF_MAX_TIME_COST = 10
+
+# Highest parameters accepted from a vault header (and picked by calibration),
+# so a tampered or foreign header cannot make an unlock run for minutes or
+# take gigabytes; never below this host's own parameters
+KDF_MAX_MEMORY_COST = max(
+    ARGON2_MEMORY_COST, int(os.environ.get("ARGON2_MAX_MEMORY_COST", "262144"))  # KiB, 256 MB
+)
+KDF_MAX_PARALLELISM = max(ARGON2_PARALLELISM, 16)
+
+# Version of the key-wrap header JSON; headers without one are version 1,
+# which did not record KDF parameters
+HEADER_VERSION = 2
+
 # AES-GCM parameters
 NONCE_SIZE = 12  # 96 bits recommended for AES-GCM
 SALT_SIZE = 16  # 128 bits
+DATA_KEY_SIZE = 32  # 256-bit random data-encryption key
+
+# Vault file formats with envelope encryption share a prefix:
+#   magic (4) || version (1) || header length (4) || header JSON || payload
+# v2 payload: nonce (12) || ciphertext of the whole vault JSON
+# v3 payload: index length (4) || nonce (12) || index ciphertext || records
+#   where each record is nonce (12) || ciphertext of one entry, and the
+#   index maps entry ids to record offsets so one entry can be read alone.
+# Files without the magic are v1: salt (16) || nonce (12) || ciphertext
+VAULT_MAGIC = b"SMSV"
+BLOB_FORMAT_VERSION = 2
+RECORDS_FORMAT_VERSION = 3
+VAULT_FORMAT_VERSION = RECORDS_FORMAT_VERSION  # format written on save
+HEADER_LEN_FORMAT = ">I"
+HEADER_PREFIX_SIZE = len(VAULT_MAGIC) + 1 + struct.calcsize(HEADER_LEN_FORMAT)
+INDEX_LEN_FORMAT = ">I"
+INDEX_LEN_SIZE = struct.calcsize(INDEX_LEN_FORMAT)
+TAG_SIZE = 16  # AES-GCM authentication tag
+
+# Associated data binding each ciphertext to its role in the file
+KEY_WRAP_AAD = VAULT_MAGIC + bytes([BLOB_FORMAT_VERSION]) + b"key"
+PAYLOAD_AAD = VAULT_MAGIC + bytes([BLOB_FORMAT_VERSION]) + b"payload"
+INDEX_AAD = VAULT_MAGIC + bytes([RECORDS_FORMAT_VERSION]) + b"index"
+RECORD_AAD = VAULT_MAGIC + bytes([RECORDS_FORMAT_VERSION]) + b"record:"
+
+# Optional compression of entry records, the index and journal records
+# before encryption: "none", "zlib", "zstd" (needs the zstandard package,
+# falls back to zlib) or "auto" (zstd if installed, else zlib). Compressed
+# plaintexts are recognized by their magic bytes (JSON starts with "{"), so
+# any setting reads vaults written with any other. The codec is not in the
+# plaintext vault header: records are compressed one by one (journal
+# records may use another setting than the snapshot they sit on), and the
+# header would reveal it unencrypted. The snapshot's codec is recorded in
+# the encrypted v3 index instead, for inspection.
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZLIB_MAGIC = 0x78  # deflate, 32K window
+
+
+def _compression_setting(value: str) -> str:
+    if value in ("zstd", "auto"):
+        return "zstd" if zstandard is not None else "zlib"
+    if value == "zlib":
+        return "zlib"
+    return "none"
+
+
+COMPRESSION = _compression_setting(os.environ.get("VAULT_COMPRESSION", "none").lower())
+
+# Journal of entry changes on top of a v3 snapshot:
+#   magic (4) || snapshot id (16) || { record length (4) || nonce (12) || ciphertext }*
+JOURNAL_MAGIC = b"SMSJ"
+JOURNAL_LEN_FORMAT = ">I"
+JOURNAL_LEN_SIZE = struct.calcsize(JOURNAL_LEN_FORMAT)
+JOURNAL_AAD = VAULT_MAGIC + bytes([RECORDS_FORMAT_VERSION]) + b"journal:"
 
 
-def derive_key(master_password: str, salt: bytes) -> bytes:
+@dataclass(frozen=True)
+class VaultKey:
+    """
+    Unlocked key material for a vault.
+
+    `data_key` encrypts the payload and `header` holds it wrapped with the
+    Argon2id-derived key (and the KDF parameters used), ready to be written
+    with the next save. Keys opened from a v1 file also carry the legacy
+    payload key and salt until that next save migrates the file to v3.
+    """
+
+    data_key: bytes
+    header: bytes
+    legacy_salt: Optional[bytes] = None
+    legacy_key: Optional[bytes] = None
+
+    @property
+    def file_id(self) -> bytes:
+        """Header of the file this key opens (the salt for v1 files)."""
+        return self.legacy_salt if self.legacy_key else self.header
+
+    def migrated(self) -> "VaultKey":
+        """Return the key as it applies once the vault is written as v3."""
+        return dataclasses.replace(self, legacy_salt=None, legacy_key=None)
+
+    def with_header(self, header: bytes) -> "VaultKey":
+        """Return the key with another wrap of the same data key (password change)."""
+        return dataclasses.replace(self, header=header)
+
+
+@dataclass(frozen=True)
+class KdfParams:
+    """Key derivation algorithm and cost parameters, as stored in the header."""
+
+    time_cost: int
+    memory_cost: int  # KiB
+    parallelism: int
+    hash_len: int = ARGON2_HASH_LEN
+    algorithm: str = "argon2id"
+
+    def to_header(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_header(cls, fields: dict) -> "KdfParams":
+        """Parameters from a header's "kdf" object; ValueError if unusable."""
+        try:
+            params = cls(
+                time_cost=int(fields["time_cost"]),
+                memory_cost=int(fields["memory_cost"]),
+                parallelism=int(fields["parallelism"]),
+                hash_len=int(fields.get("hash_len", ARGON2_HASH_LEN)),
+                algorithm=fields.get("algorithm", "argon2id"),
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid KDF parameters: {e}") from e
+        if params.algorithm != "argon2id":
+            raise ValueError(f"Unsupported KDF '{params.algorithm}'")
+        if params.hash_len != ARGON2_HASH_LEN or min(
+            params.time_cost, params.memory_cost, params.parallelism
+        ) < 1:
+            raise ValueError("Invalid KDF parameters")
+        if (
+            params.time_cost > max(KDF_MAX_TIME_COST, ARGON2_TIME_COST)
+            or params.memory_cost > KDF_MAX_MEMORY_COST
+            or params.parallelism > KDF_MAX_PARALLELISM
+        ):
+            raise ValueError("KDF parameters exceed this host's limits")
+        return params
+
+
+# Parameters new key wraps use on this host
+KDF_PARAMS = KdfParams(ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM)
+
+# Parameters of v1 files and of headers written before they were recorded
+LEGACY_KDF_PARAMS = KdfParams(time_cost=3, memory_cost=65536, parallelism=4)
+
+
+def derive_key(
+    master_password: str, salt: bytes, params: Optional[KdfParams] = None
+) -> bytes:
     """
     Derive encryption key from master password using Argon2id.
     Argon2id is resistant to both side-channel and GPU attacks.
+    Uses this host's parameters unless the vault's are given.
     """
-    return hash_secret_raw(
-        secret=master_password.encode("utf-8"),
-        salt=salt,
-        time_cost=ARGON2_TIME_COST,
-        memory_cost=ARGON2_MEMORY_COST,
-        parallelism=ARGON2_PARALLELISM,
-        hash_len=ARGON2_HASH_LEN,
-        type=Type.ID,
-    )
+    params = params or KDF_PARAMS
+    KDF_INVOCATIONS.inc()
+    with KDF_SECONDS.time():
+        return hash_secret_raw(
+            secret=master_password.encode("utf-8"),
+            salt=salt,
+            time_cost=params.time_cost,
+            memory_cost=params.memory_cost,
+            parallelism=params.parallelism,
+            hash_len=params.hash_len,
+            type=Type.ID,
+        )
 
 
-def encrypt_vault(data: dict, master_password: str) -> bytes:
+def calibrate_kdf(
+    target_ms: float,
+    max_memory_cost: int = ARGON2_MEMORY_COST,
+    parallelism: int = ARGON2_PARALLELISM,
+) -> tuple[KdfParams, float]:
+    """
+    Pick Argon2id parameters that take about `target_ms` on this machine.
+    Memory is preferred over passes: start at `max_memory_cost` with the
+    minimum passes, halve memory while that is too slow, then add passes
+    up to the target. Stays within KDF_MIN_*/KDF_MAX_* (and so within what
+    from_header() accepts).
+    Returns the parameters and their measured latency in milliseconds.
     """
-    Encrypt vault data using AES-256-GCM.
+    salt = os.urandom(SALT_SIZE)
+
+    def measure(params: KdfParams) -> float:
+        best = None
+        for _ in range(2):
+            start = time.perf_counter()
+            derive_key("calibration", salt, params)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    memory = max(KDF_MIN_MEMORY_COST, min(max_memory_cost, KDF_MAX_MEMORY_COST))
+    parallelism = min(parallelism, KDF_MAX_PARALLELISM)
+    params = KdfParams(KDF_MIN_TIME_COST, memory, parallelism)
+    elapsed = measure(params)
+    while elapsed > target_ms and memory > KDF_MIN_MEMORY_COST:
+        memory = max(KDF_MIN_MEMORY_COST, memory // 2)
+        params = KdfParams(KDF_MIN_TIME_COST, memory, parallelism)
+        elapsed = measure(params)
+
+    # Time grows linearly with the number of passes
+    per_pass = elapsed / params.time_cost
+    passes = int(target_ms // per_pass) if per_pass > 0 else KDF_MAX_TIME_COST
+    passes = max(KDF_MIN_TIME_COST, min(KDF_MAX_TIME_COST, passes))
+    if passes != params.time_cost:
+        params = KdfParams(passes, memory, parallelism)
+        elapsed = measure(params)
+    return params, elapsed
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
 
-    Output format: salt (16 bytes) || nonce (12 bytes) || ciphertext
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data.encode("ascii"))
+
+
+def _wrap_data_key(
+    data_key: bytes, kek: bytes, salt: bytes, params: KdfParams
+) -> bytes:
+    """
+    Wrap the data key with a key-encryption key and build the v2 header,
+    recording the KDF parameters the key-encryption key was derived with.
+    """
+    nonce = os.urandom(NONCE_SIZE)
+    wrapped_key = AESGCM(kek).encrypt(nonce, data_key, KEY_WRAP_AAD)
+    header = {
+        "header_version": HEADER_VERSION,
+        "kdf": params.to_header(),
+        "salt": _b64encode(salt),
+        "wrap_nonce": _b64encode(nonce),
+        "wrapped_key": _b64encode(wrapped_key),
+    }
+    return json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+
+def parse_vault_file(encrypted_data: bytes) -> tuple[int, bytes, int]:
+    """
+    Split a vault file into (format version, header, payload offset).
+    For v1 files the header is the salt.
     """
-    # Generate random salt and nonce
+    if encrypted_data[: len(VAULT_MAGIC)] == VAULT_MAGIC:
+        version = encrypted_data[len(VAULT_MAGIC)]
+        (header_len,) = struct.unpack_from(
+            HEADER_LEN_FORMAT, encrypted_data, len(VAULT_MAGIC) + 1
+        )
+        offset = HEADER_PREFIX_SIZE + header_len
+        if (
+            version in (BLOB_FORMAT_VERSION, RECORDS_FORMAT_VERSION)
+            and offset <= len(encrypted_data)
+        ):
+            return version, encrypted_data[HEADER_PREFIX_SIZE:offset], offset
+
+    return 1, encrypted_data[:SALT_SIZE], SALT_SIZE
+
+
+def read_vault_head(fh) -> bytes:
+    """
+    Read the magic, version and header of a vault file without its payload.
+    Returns an empty result for v1 files, whose header cannot be split off.
+    """
+    prefix = fh.read(HEADER_PREFIX_SIZE)
+    if len(prefix) < HEADER_PREFIX_SIZE or prefix[: len(VAULT_MAGIC)] != VAULT_MAGIC:
+        return b""
+
+    (header_len,) = struct.unpack_from(HEADER_LEN_FORMAT, prefix, len(VAULT_MAGIC) + 1)
+    return prefix + fh.read(header_len)
+
+
+def header_kdf_params(header: bytes) -> KdfParams:
+    """KDF parameters recorded in a key-wrap header (legacy ones if none)."""
+    fields = json.loads(header.decode("utf-8"))
+    if "kdf" not in fields:
+        return LEGACY_KDF_PARAMS
+    return KdfParams.from_header(fields["kdf"])
+
+
+def kdf_outdated(vault_key: VaultKey) -> bool:
+    """Check whether the key is wrapped with other than this host's KDF parameters."""
+    try:
+        return header_kdf_params(vault_key.header) != KDF_PARAMS
+    except ValueError:
+        return True
+
+
+def get_vault_file_id(encrypted_data: bytes) -> bytes:
+    """Return the header identifying which key opens this vault file."""
+    return parse_vault_file(encrypted_data)[1]
+
+
+def create_vault_key(master_password: str) -> VaultKey:
+    """Generate a random data key and wrap it for a new vault."""
     salt = os.urandom(SALT_SIZE)
+    data_key = AESGCM.generate_key(bit_length=DATA_KEY_SIZE * 8)
+    kek = derive_key(master_password, salt)
+    return VaultKey(data_key, _wrap_data_key(data_key, kek, salt, KDF_PARAMS))
+
+
+def rewrap_vault_key(vault_key: VaultKey, new_password: str) -> VaultKey:
+    """
+    Wrap the existing data key for a new master password (or for the same
+    one with this host's current KDF parameters).
+    """
+    salt = os.urandom(SALT_SIZE)
+    kek = derive_key(new_password, salt)
+    return VaultKey(
+        vault_key.data_key, _wrap_data_key(vault_key.data_key, kek, salt, KDF_PARAMS)
+    )
+
+
+def unlock_vault_key(encrypted_data: bytes, master_password: str) -> Optional[VaultKey]:
+    """
+    Derive the key-encryption key and unwrap the data key of a vault file.
+    v1 files get a fresh data key wrapped with their existing derived key,
+    so the migration on the next write does not need another Argon2id run.
+    Returns None if the password is wrong or the file is corrupted.
+    """
+    try:
+        version, header, _ = parse_vault_file(encrypted_data)
+
+        if version == 1:
+            salt = header
+            legacy_key = derive_key(master_password, salt, LEGACY_KDF_PARAMS)
+            # Check the password before minting a data key for it
+            if decrypt_vault_with_key(encrypted_data, VaultKey(b"", b"", salt, legacy_key)) is None:
+                return None
+            data_key = AESGCM.generate_key(bit_length=DATA_KEY_SIZE * 8)
+            return VaultKey(
+                data_key,
+                _wrap_data_key(data_key, legacy_key, salt, LEGACY_KDF_PARAMS),
+                salt,
+                legacy_key,
+            )
+
+        fields = json.loads(header.decode("utf-8"))
+        kek = derive_key(
+            master_password, _b64decode(fields["salt"]), header_kdf_params(header)
+        )
+        data_key = AESGCM(kek).decrypt(
+            _b64decode(fields["wrap_nonce"]),
+            _b64decode(fields["wrapped_key"]),
+            KEY_WRAP_AAD,
+        )
+        return VaultKey(data_key, header)
+    except Exception:
+        return None
+
+
+def _compress(plaintext: bytes) -> bytes:
+    """Compress with the configured codec, unless that does not shrink it."""
+    if COMPRESSION == "zstd":
+        compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(plaintext)
+    elif COMPRESSION == "zlib":
+        compressed = zlib.compress(plaintext, ZLIB_LEVEL)
+    else:
+        return plaintext
+    return compressed if len(compressed) < len(plaintext) else plaintext
+
+
+def _decompress(plaintext: bytes) -> bytes:
+    """Undo _compress(), detecting the codec from the data."""
+    if plaintext[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("Vault is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(plaintext)
+    if plaintext[:1] == bytes([ZLIB_MAGIC]):
+        return zlib.decompress(plaintext)
+    return plaintext
+
+
+def _encode(value: dict) -> bytes:
+    return _compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def _decode(plaintext: bytes) -> dict:
+    return json.loads(_decompress(plaintext).decode("utf-8"))
+
+
+def _seal_record(aesgcm: AESGCM, entry: dict) -> bytes:
+    """Encrypt one entry in its compact storage form, bound to its id."""
     nonce = os.urandom(NONCE_SIZE)
+    plaintext = _encode(pack_entry(entry))
+    aad = RECORD_AAD + entry["id"].encode("utf-8")
+    return nonce + aesgcm.encrypt(nonce, plaintext, aad)
 
-    # Derive key from master password
-    key = derive_key(master_password, salt)
 
-    # Encrypt data
-    aesgcm = AESGCM(key)
-    plaintext = json.dumps(data, ensure_ascii=False).encode("utf-8")
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
+def _decrypt_record(aesgcm: AESGCM, record: bytes, row: list) -> bytes:
+    """Decrypt one entry record checked against its index row, undecoded."""
+    entry_id, _, _, tag = row
+    if record[-TAG_SIZE:] != _b64decode(tag):
+        raise ValueError(f"Record {entry_id} does not match the vault index")
 
-    # Combine salt + nonce + ciphertext
-    return salt + nonce + ciphertext
+    aad = RECORD_AAD + entry_id.encode("utf-8")
+    return aesgcm.decrypt(record[:NONCE_SIZE], record[NONCE_SIZE:], aad)
 
 
-def decrypt_vault(encrypted_data: bytes, master_password: str) -> Optional[dict]:
+def _open_record(aesgcm: AESGCM, record: bytes, row: list) -> dict:
+    """Decrypt and decode one entry record checked against its index row."""
+    return unpack_entry(_decode(_decrypt_record(aesgcm, record, row)))
+
+
+def _open_index(aesgcm: AESGCM, index_blob: bytes) -> dict:
+    """Decrypt the v3 index: vault metadata plus [id, offset, length, tag] rows."""
+    plaintext = aesgcm.decrypt(
+        index_blob[:NONCE_SIZE], index_blob[NONCE_SIZE:], INDEX_AAD
+    )
+    return _decode(plaintext)
+
+
+def _split_records_payload(payload: bytes) -> tuple[bytes, bytes]:
+    """Split a v3 payload into (index blob, records region)."""
+    (index_len,) = struct.unpack_from(INDEX_LEN_FORMAT, payload, 0)
+    index_end = INDEX_LEN_SIZE + index_len
+    return payload[INDEX_LEN_SIZE:index_end], payload[index_end:]
+
+
+def _reusable_records(previous: bytes, vault_key: VaultKey) -> dict:
+    """Map entry id -> sealed record from a previous v3 file with the same key."""
+    try:
+        version, _, offset = parse_vault_file(previous)
+        if version != RECORDS_FORMAT_VERSION:
+            return {}
+
+        aesgcm = AESGCM(vault_key.data_key)
+        index_blob, records = _split_records_payload(previous[offset:])
+        index = _open_index(aesgcm, index_blob)
+    except Exception:
+        return {}
+
+    # Records in an older entry format are re-sealed, migrating the vault
+    if index.get("entry_format", 1) != ENTRY_FORMAT_VERSION:
+        return {}
+
+    reusable = {}
+    for entry_id, start, length, tag in index["entries"]:
+        record = records[start : start + length]
+        if len(record) == length and record[-TAG_SIZE:] == _b64decode(tag):
+            reusable[entry_id] = record
+    return reusable
+
+
+@ENCRYPT_SECONDS.timed
+def encrypt_vault_with_key(
+    data: dict,
+    vault_key: VaultKey,
+    previous: Optional[bytes] = None,
+    changed: Optional[set] = None,
+) -> bytes:
     """
-    Decrypt vault data using AES-256-GCM.
-    Returns None if decryption fails (wrong password or corrupted data).
+    Encrypt vault data using AES-256-GCM with the vault's data key.
+    Each entry is sealed as its own record; only a fresh nonce is needed,
+    no key derivation.
+
+    When the previous file and the set of changed entry ids are given,
+    records of unchanged entries are copied as-is instead of re-encrypted.
+    """
+    aesgcm = AESGCM(vault_key.data_key)
+    reusable = {}
+    if previous is not None and changed is not None:
+        reusable = _reusable_records(previous, vault_key)
+
+    rows = []
+    records = []
+    offset = 0
+    for entry in data.get("entries", []):
+        record = None
+        if changed is not None and entry["id"] not in changed:
+            record = reusable.get(entry["id"])
+        if record is None:
+            record = _seal_record(aesgcm, entry)
+
+        rows.append([entry["id"], offset, len(record), _b64encode(record[-TAG_SIZE:])])
+        records.append(record)
+        offset += len(record)
+
+    index = {
+        "vault": {k: v for k, v in data.items() if k != "entries"},
+        "compression": COMPRESSION,
+        "entry_format": ENTRY_FORMAT_VERSION,
+        "entries": rows,
+    }
+    nonce = os.urandom(NONCE_SIZE)
+    index_blob = nonce + aesgcm.encrypt(nonce, _encode(index), INDEX_AAD)
+
+    payload = (
+        struct.pack(INDEX_LEN_FORMAT, len(index_blob))
+        + index_blob
+        + b"".join(records)
+    )
+    return _pack_vault_file(vault_key.header, payload)
+
+
+@DECRYPT_SECONDS.timed
+def decrypt_vault_with_key(encrypted_data: bytes, vault_key: VaultKey) -> Optional[dict]:
+    """
+    Decrypt vault data (v1, v2 or v3) using AES-256-GCM with an unlocked key.
+    Returns None if decryption fails (wrong key or corrupted data).
     """
     try:
-        # Extract salt, nonce, and ciphertext
-        salt = encrypted_data[:SALT_SIZE]
-        nonce = encrypted_data[SALT_SIZE : SALT_SIZE + NONCE_SIZE]
-        ciphertext = encrypted_data[SALT_SIZE + NONCE_SIZE :]
+        version, _, offset = parse_vault_file(encrypted_data)
+
+        if version == RECORDS_FORMAT_VERSION:
+            aesgcm = AESGCM(vault_key.data_key)
+            with phase("decrypt"):
+                index_blob, records = _split_records_payload(encrypted_data[offset:])
+                index = _open_index(aesgcm, index_blob)
+                plaintexts = [
+                    _decrypt_record(aesgcm, records[row[1] : row[1] + row[2]], row)
+                    for row in index["entries"]
+                ]
 
-        # Derive key from master password
-        key = derive_key(master_password, salt)
+            with phase("parse"):
+                vault = dict(index["vault"])
+                vault["entries"] = [unpack_entry(_decode(p)) for p in plaintexts]
+            return vault
+
+        if version == 1:
+            key, aad = vault_key.legacy_key, None
+        else:
+            key, aad = vault_key.data_key, PAYLOAD_AAD
+
+        # Extract nonce and ciphertext
+        nonce = encrypted_data[offset : offset + NONCE_SIZE]
+        ciphertext = encrypted_data[offset + NONCE_SIZE :]
 
         # Decrypt data
         aesgcm = AESGCM(key)
-        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+        with phase("decrypt"):
+            plaintext = aesgcm.decrypt(nonce, ciphertext, aad)
 
-        return json.loads(plaintext.decode("utf-8"))
+        with phase("parse"):
+            return json.loads(plaintext.decode("utf-8"))
     except Exception:
         return None
 
 
+def read_vault_index(fh, vault_key: VaultKey) -> tuple[dict, bytes]:
+    """
+    Decrypt the index of a v3 vault file without reading its records.
+    `fh` must be positioned right after the header (read_vault_head) and is
+    left at the start of the records. Returns (index, snapshot id); raises
+    ValueError if the vault cannot be decrypted with this key.
+    """
+    try:
+        (index_len,) = struct.unpack(INDEX_LEN_FORMAT, fh.read(INDEX_LEN_SIZE))
+        index_blob = fh.read(index_len)
+        index = _open_index(AESGCM(vault_key.data_key), index_blob)
+    except Exception as e:
+        raise ValueError("Vault cannot be decrypted with this key") from e
+
+    return index, index_blob[-TAG_SIZE:]
+
+
+def decrypt_entry_from_file(
+    fh, vault_key: VaultKey, index: dict, records_start: int, entry_id: str
+) -> Optional[dict]:
+    """
+    Decrypt a single entry record of a v3 vault file, using its index.
+    Returns None if the entry does not exist; raises ValueError if the
+    record cannot be decrypted with this key.
+    """
+    for row in index["entries"]:
+        if row[0] == entry_id:
+            fh.seek(records_start + row[1])
+            try:
+                return _open_record(AESGCM(vault_key.data_key), fh.read(row[2]), row)
+            except ValueError:
+                raise
+            except Exception as e:
+                raise ValueError("Record cannot be decrypted with this key") from e
+    return None
+
+
+def get_snapshot_id(encrypted_data: bytes) -> bytes:
+    """
+    Identify a v3 snapshot by the tag of its index, which changes on every
+    write. Journals are bound to this id. Empty for v1/v2 files.
+    """
+    version, _, offset = parse_vault_file(encrypted_data)
+    if version != RECORDS_FORMAT_VERSION:
+        return b""
+
+    index_blob, _ = _split_records_payload(encrypted_data[offset:])
+    return index_blob[-TAG_SIZE:]
+
+
+def read_snapshot_id(fh) -> bytes:
+    """Read the snapshot id of a vault file without decrypting anything."""
+    head = read_vault_head(fh)
+    if not head or parse_vault_file(head)[0] != RECORDS_FORMAT_VERSION:
+        return b""
+
+    (index_len,) = struct.unpack(INDEX_LEN_FORMAT, fh.read(INDEX_LEN_SIZE))
+    fh.seek(index_len - TAG_SIZE, os.SEEK_CUR)
+    return fh.read(TAG_SIZE)
+
+
+def check_vault_file(fh) -> bool:
+    """
+    Check that a file is a complete vault without decrypting it: a known
+    format, a key-wrap header with well-formed salt, nonce and wrapped key,
+    and (v3) an index that fits in the file. Used to vet downloaded copies.
+    """
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    fh.seek(0)
+
+    head = read_vault_head(fh)
+    if not head:
+        # v1: salt, nonce and at least a GCM tag
+        return size >= SALT_SIZE + NONCE_SIZE + TAG_SIZE
+
+    try:
+        version, header, offset = parse_vault_file(head)
+        if version == 1 or offset != len(head):
+            return False
+
+        fields = json.loads(header.decode("utf-8"))
+        if (
+            len(_b64decode(fields["salt"])) != SALT_SIZE
+            or len(_b64decode(fields["wrap_nonce"])) != NONCE_SIZE
+            or len(_b64decode(fields["wrapped_key"])) != DATA_KEY_SIZE + TAG_SIZE
+        ):
+            return False
+        header_kdf_params(header)
+    except (ValueError, KeyError, TypeError, struct.error):
+        return False
+
+    if version == BLOB_FORMAT_VERSION:
+        return size >= offset + NONCE_SIZE + TAG_SIZE
+
+    index_prefix = fh.read(INDEX_LEN_SIZE)
+    if len(index_prefix) < INDEX_LEN_SIZE:
+        return False
+    (index_len,) = struct.unpack(INDEX_LEN_FORMAT, index_prefix)
+    return (
+        index_len >= NONCE_SIZE + TAG_SIZE
+        and offset + INDEX_LEN_SIZE + index_len <= size
+    )
+
+
+def journal_file_header(snapshot_id: bytes) -> bytes:
+    """Start of a journal file written on top of the given snapshot."""
+    return JOURNAL_MAGIC + snapshot_id
+
+
+def scan_journal(journal_data: bytes, snapshot_id: bytes) -> tuple[int, int]:
+    """
+    Find the complete records of a journal without decrypting them.
+    Returns (record count, valid length); (0, 0) if the journal belongs
+    to another snapshot.
+    """
+    header = journal_file_header(snapshot_id)
+    if not snapshot_id or journal_data[: len(header)] != header:
+        return 0, 0
+
+    count = 0
+    position = len(header)
+    while position + JOURNAL_LEN_SIZE <= len(journal_data):
+        (length,) = struct.unpack_from(JOURNAL_LEN_FORMAT, journal_data, position)
+        end = position + JOURNAL_LEN_SIZE + length
+        if end > len(journal_data):
+            break
+        count += 1
+        position = end
+    return count, position
+
+
+def seal_journal_record(
+    vault_key: VaultKey, snapshot_id: bytes, seq: int, change: dict
+) -> bytes:
+    """
+    Encrypt one journal change ({"op": "put", "entry": ...} or
+    {"op": "delete", "id": ...}), bound to its snapshot and position.
+    """
+    if change.get("op") == "put":
+        change = {**change, "entry": pack_entry(change["entry"])}
+    nonce = os.urandom(NONCE_SIZE)
+    plaintext = _encode(change)
+    aad = JOURNAL_AAD + snapshot_id + struct.pack(">Q", seq)
+    record = nonce + AESGCM(vault_key.data_key).encrypt(nonce, plaintext, aad)
+    return struct.pack(JOURNAL_LEN_FORMAT, len(record)) + record
+
+
+class JournalCorruptError(ValueError):
+    """A journal record other than the last one fails to decrypt."""
+
+
+def _open_journal_records(
+    journal_data: bytes, vault_key: VaultKey, snapshot_id: bytes
+) -> tuple[list[bytes], int]:
+    """
+    Decrypt the records of a journal. Returns (plaintexts, valid length).
+    A last record that fails to decrypt is a torn append and is left out;
+    a bad record with more records after it cannot come from an append
+    (each one truncates a torn tail first), so the journal is corrupt and
+    JournalCorruptError is raised instead of silently dropping the later
+    changes.
+    """
+    count, valid_length = scan_journal(journal_data, snapshot_id)
+    aesgcm = AESGCM(vault_key.data_key)
+
+    plaintexts = []
+    position = len(journal_file_header(snapshot_id))
+    for seq in range(count):
+        start = position
+        (length,) = struct.unpack_from(JOURNAL_LEN_FORMAT, journal_data, position)
+        record = journal_data[position + JOURNAL_LEN_SIZE : position + JOURNAL_LEN_SIZE + length]
+        position += JOURNAL_LEN_SIZE + length
+
+        aad = JOURNAL_AAD + snapshot_id + struct.pack(">Q", seq)
+        try:
+            plaintexts.append(aesgcm.decrypt(record[:NONCE_SIZE], record[NONCE_SIZE:], aad))
+        except Exception as e:
+            if seq == count - 1:
+                return plaintexts, start
+            raise JournalCorruptError(f"Journal record {seq + 1} of {count} is corrupt") from e
+
+    return plaintexts, valid_length
+
+
+def check_journal(
+    journal_data: bytes, vault_key: VaultKey, snapshot_id: bytes
+) -> tuple[int, int]:
+    """
+    Like scan_journal(), but also authenticates the records, so a torn
+    last record with an intact length prefix is not counted either.
+    Raises JournalCorruptError if a record before the last one is corrupt.
+    """
+    plaintexts, valid_length = _open_journal_records(journal_data, vault_key, snapshot_id)
+    return len(plaintexts), valid_length
+
+
+def open_journal(
+    journal_data: bytes, vault_key: VaultKey, snapshot_id: bytes
+) -> list[dict]:
+    """
+    Decrypt the changes of a journal written on top of a snapshot.
+    A torn last record is skipped; a journal left over from an older
+    snapshot yields no changes. Raises JournalCorruptError if the journal
+    is corrupt before its last record.
+    """
+    changes = []
+    for plaintext in _open_journal_records(journal_data, vault_key, snapshot_id)[0]:
+        change = _decode(plaintext)
+        if change.get("op") == "put":
+            change["entry"] = unpack_entry(change["entry"])
+        changes.append(change)
+    return changes
+
+
+def _pack_vault_file(
+    header: bytes, payload: bytes, version: int = VAULT_FORMAT_VERSION
+) -> bytes:
+    """Assemble a vault file from its header and encrypted payload."""
+    return (
+        VAULT_MAGIC
+        + bytes([version])
+        + struct.pack(HEADER_LEN_FORMAT, len(header))
+        + header
+        + payload
+    )
+
+
+def replace_vault_header(encrypted_data: bytes, header: bytes) -> bytes:
+    """
+    Swap the header of a v2/v3 vault file, keeping the encrypted payload.
+    Used on password change, which only rewrites the wrapped data key.
+    """
+    version, _, offset = parse_vault_file(encrypted_data)
+    if version == 1:
+        raise ValueError("v1 vault files have no replaceable header")
+
+    return _pack_vault_file(header, encrypted_data[offset:], version)
+
+
+def encrypt_vault(data: dict, master_password: str) -> bytes:
+    """
+    Encrypt vault data using AES-256-GCM under a new random data key.
+    """
+    return encrypt_vault_with_key(data, create_vault_key(master_password))
+
+
+def decrypt_vault(encrypted_data: bytes, master_password: str) -> Optional[dict]:
+    """
+    Decrypt vault data using AES-256-GCM.
+    Returns None if decryption fails (wrong password or corrupted data).
+    """
+    vault_key = unlock_vault_key(encrypted_data, master_password)
+    if vault_key is None:
+        return None
+
+    return decrypt_vault_with_key(encrypted_data, vault_key)
+
+
 def create_empty_vault() -> dict:
     """Create a new empty vault structure."""
-    return {"version": 1, "entries": []}
+    return {
+        "version": 1,
+        "revision": 0,
+        "revision_ids": {"0": generate_revision_id()},
+        "entries": [],
+    }
 
 
 def generate_entry_id() -> str:
     """Generate a random ID for vault entries."""
     return base64.urlsafe_b64encode(os.urandom(12)).decode("ascii")
+
+
+def generate_revision_id() -> str:
+    """Generate the random ID a vault revision is saved with."""
+    return os.urandom(8).hex()
@@ -1,23 +1,35 @@
 """
-Google Drive Sync for Secret Manager
-Handles backup and restore of vault.enc to/from Google Drive
-Uses OAuth2 for personal Google accounts
+Vault Sync for Secret Manager
+Handles backup and restore of vault.enc through a sync backend:
+Google Drive (OAuth2 for personal Google accounts) or a local/NFS mirror
 """
 
 import os
 import io
+import functools
 import json
+import random
+import tempfile
 import threading
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Optional
 from pathlib import Path
 
-# Google Drive API imports
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+# The Google client libraries take a while to import, so they are imported
+# where Drive is used, i.e. only when SYNC_BACKEND=gdrive
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.http import MediaFileUpload
+
+from app.crypto_utils import check_vault_file
+from app.metrics import SYNC_SECONDS, UPLOAD_BACKLOG
+from app.sync_backends import LocalDirectoryBackend, SyncBackend, file_md5, find_file
+from app.vault_store import fsync_dir, journal_has_changes, journal_path, vault_lock
 
 # Configuration from environment
+SYNC_BACKEND = os.environ.get("SYNC_BACKEND", "gdrive").lower()  # gdrive or local
+SYNC_DIR = os.environ.get("SYNC_DIR")  # Mirror directory for the local backend
 GOOGLE_OAUTH_CREDENTIALS = os.environ.get(
     "GOOGLE_OAUTH_CREDENTIALS"
 )  # OAuth client JSON
@@ -26,12 +38,37 @@ GOOGLE_DRIVE_FOLDER_ID = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")  # Folder ID i
 TOKEN_FILE = os.environ.get("GOOGLE_TOKEN_FILE", "./data/google_token.json")
 VAULT_FILENAME = "vault.enc"
 
+# Background uploads: wait this long after the last save before uploading,
+# but never longer than the max delay after the first pending save
+UPLOAD_DEBOUNCE = float(os.environ.get("DRIVE_UPLOAD_DEBOUNCE", "2"))
+UPLOAD_MAX_DELAY = float(os.environ.get("DRIVE_UPLOAD_MAX_DELAY", "30"))
+# Failed uploads are retried with exponential backoff up to this delay
+UPLOAD_RETRY_BASE = 2.0
+UPLOAD_RETRY_MAX = float(os.environ.get("DRIVE_UPLOAD_RETRY_MAX", "300"))
+# How long shutdown waits for pending uploads
+UPLOAD_FLUSH_TIMEOUT = float(os.environ.get("DRIVE_UPLOAD_FLUSH_TIMEOUT", "30"))
+
+# Transfers go in chunks of DRIVE_CHUNK_SIZE bytes, rounded down to a multiple
+# of 256 KiB as Drive requires for resumable uploads; each chunk is retried
+# up to DRIVE_CHUNK_RETRIES times and the transfer resumes where it stopped
+CHUNK_ALIGN = 256 * 1024
+CHUNK_SIZE = max(
+    1, int(os.environ.get("DRIVE_CHUNK_SIZE", str(8 * 1024 * 1024))) // CHUNK_ALIGN
+) * CHUNK_ALIGN
+CHUNK_RETRIES = int(os.environ.get("DRIVE_CHUNK_RETRIES", "5"))
+
 # Scopes needed for Google Drive
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 
 
-def is_drive_sync_enabled() -> bool:
-    """Check if Google Drive sync is properly configured."""
+def is_sync_enabled() -> bool:
+    """Check if a sync backend is properly configured."""
+    if _backend_override is not None:
+        return True
+    if SYNC_BACKEND == "local":
+        return bool(SYNC_DIR)
+    if SYNC_BACKEND != "gdrive":
+        return False
     if not GOOGLE_DRIVE_FOLDER_ID:
         return False
     # Need either token or credentials to authenticate
@@ -42,8 +79,11 @@ def is_drive_sync_enabled() -> bool:
     return True
 
 
-def get_credentials() -> Optional[Credentials]:
+def get_credentials() -> Optional["Credentials"]:
     """Get or refresh OAuth2 credentials."""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
     creds = None
 
     # Try to load from environment variable first
@@ -63,8 +103,8 @@ def get_credentials() -> Optional[Credentials]:
         except Exception as e:
             print(f"[Drive Sync] Error loading token file: {e}")
 
-    # Refresh if expired
-    if creds and creds.expired and creds.refresh_token:
+    # Refresh only if there is no usable access token
+    if creds and not creds.valid and creds.refresh_token:
         try:
             creds.refresh(Request())
             # Save refreshed token
@@ -85,7 +125,7 @@ def get_credentials() -> Optional[Credentials]:
     return creds
 
 
-def save_token(creds: Credentials):
+def save_token(creds: "Credentials"):
     """Save credentials to token file."""
     try:
         Path(TOKEN_FILE).parent.mkdir(parents=True, exist_ok=True)
@@ -95,161 +135,753 @@ def save_token(creds: Credentials):
         print(f"[Drive Sync] Error saving token: {e}")
 
 
+# Drive file metadata returned by every call on a file
+FILE_FIELDS = "id, name, md5Checksum, modifiedTime, size, version"
+
+# One authorized Drive service (and HTTP connection) per process. httplib2
+# is not thread-safe, so Drive calls are serialized on this lock.
+_drive_lock = threading.RLock()
+_service = None
+_credentials = None
+_saved_token = None
+
+# The sync backend of this process; transfers are serialized on _sync_lock
+_sync_lock = threading.RLock()
+_backend = None
+_backend_override = None
+
+
 def get_drive_service():
-    """Get authenticated Google Drive service."""
-    if not is_drive_sync_enabled():
-        return None
+    """
+    Get the authenticated Google Drive service, built once and reused.
+    The access token is refreshed by the HTTP transport only when it has
+    expired; refreshed tokens are saved after each call (save_refreshed_token).
+    """
+    global _service, _credentials, _saved_token
 
-    creds = get_credentials()
-    if not creds:
-        return None
+    with _drive_lock:
+        if _service is not None:
+            return _service
 
-    try:
-        service = build("drive", "v3", credentials=creds)
-        return service
-    except Exception as e:
-        print(f"[Drive Sync] Error creating service: {e}")
-        return None
+        from googleapiclient.discovery import build
 
+        creds = get_credentials()
+        if not creds:
+            return None
 
-def find_vault_in_drive(service) -> Optional[str]:
-    """Find vault.enc file ID in Google Drive folder."""
-    try:
-        query = f"name = '{VAULT_FILENAME}' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and trashed = false"
-        results = (
-            service.files()
-            .list(
-                q=query,
-                spaces="drive",
-                fields="files(id, name, modifiedTime)",
-                pageSize=1,
+        try:
+            _service = build("drive", "v3", credentials=creds, cache_discovery=False)
+            _credentials = creds
+            _saved_token = creds.token
+            return _service
+        except Exception as e:
+            print(f"[Drive Sync] Error creating service: {e}")
+            return None
+
+
+def reset_drive_service():
+    """Forget the service and backend, e.g. after the token was revoked."""
+    global _service, _credentials, _backend
+
+    with _drive_lock:
+        _service = None
+        _credentials = None
+        if isinstance(_backend, GoogleDriveBackend):
+            _backend = None
+
+
+def save_refreshed_token():
+    """Persist the token if the transport refreshed it during the last call."""
+    global _saved_token
+
+    with _drive_lock:
+        if _credentials is not None and _credentials.token != _saved_token:
+            save_token(_credentials)
+            _saved_token = _credentials.token
+            print("[Drive Sync] Token refreshed successfully")
+
+
+def _is_not_found(error: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+def _is_auth_error(error: Exception) -> bool:
+    from google.auth.exceptions import RefreshError
+    from googleapiclient.errors import HttpError
+
+    return isinstance(error, RefreshError) or (
+        isinstance(error, HttpError) and error.resp.status == 401
+    )
+
+
+def _parse_time(value: Optional[str]) -> float:
+    """Seconds since the epoch of an RFC 3339 time from Drive (0 if missing)."""
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _drive_call(method):
+    """
+    Run a GoogleDriveBackend method under the Drive lock, saving refreshed
+    tokens afterwards and dropping the service on auth errors.
+    """
+
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        with _drive_lock:
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as e:
+                if _is_auth_error(e):
+                    reset_drive_service()
+                raise
+            finally:
+                save_refreshed_token()
+
+    return call
+
+
+class GoogleDriveBackend:
+    """
+    Files in the configured Google Drive folder.
+
+    File IDs are cached by name after the first lookup; a 404 on a cached
+    ID triggers one fresh lookup (the file was deleted or replaced). The
+    Drive `version` is used as revision. Transfers go in resumable chunks.
+    """
+
+    def __init__(self, service, folder_id: str = None):
+        self.service = service
+        self.folder_id = folder_id or GOOGLE_DRIVE_FOLDER_ID
+        self.file_ids = {}
+
+    @staticmethod
+    def _metadata(file: dict) -> dict:
+        return {
+            "name": file["name"],
+            "checksum": file.get("md5Checksum"),
+            "revision": str(file.get("version", "")),
+            "modified_time": _parse_time(file.get("modifiedTime")),
+            "size": int(file.get("size", 0)),
+            "id": file["id"],
+        }
+
+    def _query(self, name: Optional[str] = None) -> list[dict]:
+        """Files in the Drive folder (only `name` if given), paginated."""
+        query = f"'{self.folder_id}' in parents and trashed = false"
+        if name is not None:
+            query = f"name = '{name}' and " + query
+
+        files = []
+        page_token = None
+        while True:
+            results = (
+                self.service.files()
+                .list(
+                    q=query,
+                    spaces="drive",
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
+                    pageSize=1 if name is not None else 100,
+                    pageToken=page_token,
+                )
+                .execute()
             )
-            .execute()
-        )
+            files.extend(results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if name is not None or not page_token:
+                return files
+
+    def _on_file(self, name: str, action: Callable[[str], dict]) -> Optional[dict]:
+        """Run action(file_id) on a file; None if there is none."""
+        if name not in self.file_ids:
+            found = self._query(name)
+            if not found:
+                return None
+            self.file_ids[name] = found[0]["id"]
 
-        files = results.get("files", [])
-        if files:
-            return files[0]["id"]
-        return None
-    except Exception as e:
-        print(f"[Drive Sync] Error finding vault: {e}")
-        return None
+        try:
+            return action(self.file_ids[name])
+        except Exception as e:
+            if not _is_not_found(e):
+                raise
+
+        found = self._query(name)
+        if not found:
+            self.file_ids.pop(name, None)
+            return None
+        self.file_ids[name] = found[0]["id"]
+        return action(self.file_ids[name])
+
+    @_drive_call
+    def list(self) -> list[dict]:
+        files = self._query()
+        for file in files:
+            self.file_ids.setdefault(file["name"], file["id"])
+        return [self._metadata(file) for file in files]
+
+    @_drive_call
+    def get(self, name: str, local_path: str) -> Optional[dict]:
+        from googleapiclient.http import MediaIoBaseDownload
+
+        def fetch(file_id: str) -> dict:
+            file = self.service.files().get(fileId=file_id, fields=FILE_FIELDS).execute()
+            request = self.service.files().get_media(fileId=file_id)
+            with io.FileIO(local_path, "wb") as fh:
+                fh.truncate()
+                downloader = MediaIoBaseDownload(fh, request, chunksize=CHUNK_SIZE)
+                done = False
+                while not done:
+                    status, done = downloader.next_chunk(num_retries=CHUNK_RETRIES)
+            return self._metadata(file)
+
+        return self._on_file(name, fetch)
+
+    @staticmethod
+    def _send(request) -> dict:
+        """Run a resumable upload chunk by chunk; returns the file metadata."""
+        response = None
+        while response is None:
+            status, response = request.next_chunk(num_retries=CHUNK_RETRIES)
+            if status and status.total_size > CHUNK_SIZE:
+                print(f"[Drive Sync] Uploaded {int(status.progress() * 100)}%")
+        return response
+
+    @_drive_call
+    def put(self, name: str, local_path: str) -> dict:
+        def update(file_id: str) -> dict:
+            media = _media(local_path)
+            return self._send(
+                self.service.files().update(
+                    fileId=file_id, media_body=media, fields=FILE_FIELDS
+                )
+            )
+
+        file = self._on_file(name, update)
+        if file is None:
+            # Create new file in folder
+            file_metadata = {
+                "name": name,
+                "parents": [self.folder_id],
+            }
+            media = _media(local_path)
+            file = self._send(
+                self.service.files().create(
+                    body=file_metadata, media_body=media, fields=FILE_FIELDS
+                )
+            )
+            self.file_ids[name] = file["id"]
+        return self._metadata(file)
 
 
-def download_vault_from_drive(local_path: str) -> bool:
+def _media(local_path: str) -> "MediaFileUpload":
     """
-    Download vault.enc from Google Drive to local path.
-    Returns True if successful, False otherwise.
+    Resumable upload body for a local file. The file is opened right away,
+    so a snapshot swapped in meanwhile does not mix into the upload.
     """
-    if not is_drive_sync_enabled():
-        print("[Drive Sync] Not enabled, skipping download")
-        return False
+    from googleapiclient.http import MediaFileUpload
 
-    service = get_drive_service()
-    if not service:
-        print("[Drive Sync] Could not create Drive service")
-        return False
+    return MediaFileUpload(
+        local_path,
+        mimetype="application/octet-stream",
+        chunksize=CHUNK_SIZE,
+        resumable=True,
+    )
+
+
+def get_sync_backend() -> Optional[SyncBackend]:
+    """The sync backend of this process (built once), None if unavailable."""
+    global _backend
+
+    with _sync_lock:
+        if _backend_override is not None:
+            return _backend_override
+        if not is_sync_enabled():
+            return None
+
+        if _backend is None:
+            if SYNC_BACKEND == "local":
+                _backend = LocalDirectoryBackend(SYNC_DIR)
+            else:
+                service = get_drive_service()
+                if service is not None:
+                    _backend = GoogleDriveBackend(service)
+        return _backend
+
+
+def use_sync_backend(backend: Optional[SyncBackend]):
+    """
+    Sync against another backend, such as sync_backends.MemoryBackend in
+    tests; this also enables sync. Pass None to go back to the configured
+    backend.
+    """
+    global _backend_override
+
+    with _sync_lock:
+        _backend_override = backend
+
+
+# ============== SYNC STATE ==============
+
+
+def sync_state_path(local_path: str) -> str:
+    """Path of the file remembering what was last synced."""
+    return local_path + ".sync"
 
+
+def read_sync_state(local_path: str) -> dict:
+    """Backend metadata of the vault content last uploaded or downloaded."""
     try:
-        file_id = find_vault_in_drive(service)
-        if not file_id:
-            print("[Drive Sync] No vault.enc found in Drive (fresh install)")
-            return False
+        with open(sync_state_path(local_path), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # State files written before sync backends used Drive's field names
+    if "md5Checksum" in state:
+        state = {
+            "checksum": state["md5Checksum"],
+            "modified_time": _parse_time(state.get("modifiedTime")),
+        }
+    return state
+
+
+def write_sync_state(local_path: str, metadata: dict):
+    """Remember the backend metadata of the content just synced."""
+    state = {
+        "checksum": metadata.get("checksum"),
+        "revision": metadata.get("revision"),
+        "modified_time": metadata.get("modified_time"),
+    }
+    path = sync_state_path(local_path)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[Sync] Error saving sync state: {e}")
 
-        # Download file
-        request = service.files().get_media(fileId=file_id)
 
-        # Ensure directory exists
-        Path(local_path).parent.mkdir(parents=True, exist_ok=True)
+# ============== TRANSFERS ==============
 
-        with io.FileIO(local_path, "wb") as fh:
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
 
-        print(f"[Drive Sync] Downloaded vault.enc from Drive")
-        return True
-    except Exception as e:
-        print(f"[Drive Sync] Error downloading vault: {e}")
+def download_vault(local_path: str, backup_path: Optional[str] = None) -> bool:
+    """
+    Download vault.enc from the sync backend to local path.
+    The file is downloaded into a temp file next to the vault and only
+    swapped in once its MD5 matches the backend's checksum and it is a
+    complete vault file, so an interrupted or corrupted download never
+    replaces the local copy. With `backup_path`, the local vault (and its
+    journal) is moved there instead of being overwritten.
+    Returns True if successful, False otherwise.
+    """
+    if not is_sync_enabled():
+        print("[Sync] Not enabled, skipping download")
         return False
 
+    with _sync_lock:
+        backend = get_sync_backend()
+        if not backend:
+            print("[Sync] Could not connect to the sync backend")
+            return False
 
-def upload_vault_to_drive(local_path: str) -> bool:
+        # Ensure directory exists
+        vault_dir = os.path.dirname(local_path) or "."
+        Path(vault_dir).mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=vault_dir, prefix="." + os.path.basename(local_path) + ".download."
+        )
+        os.close(fd)
+
+        try:
+            with SYNC_SECONDS.time(direction="download"):
+                metadata = backend.get(VAULT_FILENAME, tmp_path)
+            if metadata is None:
+                print("[Sync] No vault.enc found in the sync backend (fresh install)")
+                return False
+
+            if file_md5(tmp_path) != metadata.get("checksum"):
+                raise ValueError("checksum does not match the backend's")
+            with open(tmp_path, "r+b") as f:
+                if not check_vault_file(f):
+                    raise ValueError("not a complete vault file")
+                os.fsync(f.fileno())
+
+            with vault_lock(local_path):
+                if backup_path and os.path.exists(local_path):
+                    os.replace(local_path, backup_path)
+                    if os.path.exists(journal_path(local_path)):
+                        os.replace(journal_path(local_path), journal_path(backup_path))
+                os.replace(tmp_path, local_path)
+                fsync_dir(vault_dir)
+
+            write_sync_state(local_path, metadata)
+            print(f"[Sync] Downloaded vault.enc (revision {metadata.get('revision')})")
+            return True
+        except Exception as e:
+            print(f"[Sync] Error downloading vault: {e}")
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def upload_vault(local_path: str) -> bool:
     """
-    Upload vault.enc from local path to Google Drive.
+    Upload vault.enc from local path to the sync backend.
+    Skipped when the file is byte-identical to what was last synced.
     Returns True if successful, False otherwise.
     """
-    if not is_drive_sync_enabled():
-        print("[Drive Sync] Not enabled, skipping upload")
+    if not is_sync_enabled():
+        print("[Sync] Not enabled, skipping upload")
         return False
 
     if not os.path.exists(local_path):
-        print(f"[Drive Sync] Local file not found: {local_path}")
+        print(f"[Sync] Local file not found: {local_path}")
         return False
 
-    service = get_drive_service()
-    if not service:
-        print("[Drive Sync] Could not create Drive service")
-        return False
+    with _sync_lock:
+        if file_md5(local_path) == read_sync_state(local_path).get("checksum"):
+            print("[Sync] vault.enc unchanged since last sync, skipping upload")
+            return True
 
-    try:
-        file_id = find_vault_in_drive(service)
-        media = MediaFileUpload(local_path, mimetype="application/octet-stream")
-
-        if file_id:
-            # Update existing file
-            service.files().update(
-                fileId=file_id,
-                media_body=media,
-            ).execute()
-            print(f"[Drive Sync] Updated vault.enc in Drive")
-        else:
-            # Create new file in folder
-            file_metadata = {
-                "name": VAULT_FILENAME,
-                "parents": [GOOGLE_DRIVE_FOLDER_ID],
+        backend = get_sync_backend()
+        if not backend:
+            print("[Sync] Could not connect to the sync backend")
+            return False
+
+        try:
+            with SYNC_SECONDS.time(direction="upload"):
+                metadata = backend.put(VAULT_FILENAME, local_path)
+            write_sync_state(local_path, metadata)
+            print(f"[Sync] Uploaded vault.enc (revision {metadata.get('revision')})")
+            return True
+        except Exception as e:
+            print(f"[Sync] Error uploading vault: {e}")
+            return False
+
+
+class UploadQueue:
+    """
+    Single long-lived background uploader.
+
+    Saves only mark the vault as dirty; one worker thread uploads the latest
+    file once saves have been quiet for `debounce` seconds (or `max_delay`
+    after the first pending save), so a burst of edits becomes one upload.
+    Failed uploads are retried with exponential backoff and coalesced with
+    saves made in the meantime. flush() uploads what is pending right away,
+    for graceful shutdown.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str], bool],
+        debounce: float = UPLOAD_DEBOUNCE,
+        max_delay: float = UPLOAD_MAX_DELAY,
+        retry_base: float = UPLOAD_RETRY_BASE,
+        retry_max: float = UPLOAD_RETRY_MAX,
+    ):
+        self.upload = upload
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._path = None
+        self._pending = 0  # saves not uploaded yet
+        self._first_request = 0.0
+        self._last_request = 0.0
+        self._in_flight = 0  # saves covered by the running upload
+        self._retry_at = 0.0
+        self._failures = 0
+        self._attempts = 0
+        self._last_failed_attempt = 0
+        self._flush_from = None
+        self._last_success = None
+
+    def request(self, local_path: str):
+        """Mark the vault at `local_path` as changed since the last upload."""
+        with self._cond:
+            now = time.monotonic()
+            if self._pending == 0:
+                self._first_request = now
+            self._path = local_path
+            self._pending += 1
+            self._last_request = now
+            UPLOAD_BACKLOG.set(self._pending + self._in_flight)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _wait_time(self, now: float) -> float:
+        """Seconds until the next upload may start (<= 0: now)."""
+        if self._flush_from is not None and self._last_failed_attempt <= self._flush_from:
+            return 0
+        due = min(self._last_request + self.debounce, self._first_request + self.max_delay)
+        return max(due, self._retry_at) - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending == 0:
+                        self._cond.wait()
+                        continue
+                    wait = self._wait_time(time.monotonic())
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+
+                path = self._path
+                self._in_flight = self._pending
+                self._pending = 0
+                self._attempts += 1
+                attempt = self._attempts
+
+            try:
+                ok = self.upload(path)
+            except Exception as e:
+                print(f"[Sync] Error uploading vault: {e}")
+                ok = False
+
+            with self._cond:
+                if ok:
+                    self._failures = 0
+                    self._retry_at = 0.0
+                    self._last_success = time.time()
+                else:
+                    # Put the saves back; they go out with the next attempt
+                    self._failures += 1
+                    self._last_failed_attempt = attempt
+                    delay = min(
+                        self.retry_max, self.retry_base * 2 ** (self._failures - 1)
+                    )
+                    self._retry_at = time.monotonic() + delay * random.uniform(1, 1.2)
+                    if self._pending == 0:
+                        self._first_request = time.monotonic()
+                    self._pending += self._in_flight
+                    print(f"[Sync] Upload failed, retrying in {delay:.0f}s")
+                self._in_flight = 0
+                UPLOAD_BACKLOG.set(self._pending)
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = UPLOAD_FLUSH_TIMEOUT) -> bool:
+        """
+        Upload pending changes now and wait for them, skipping the debounce
+        and backoff delays. Gives up after one failed attempt or `timeout`.
+        Returns True if nothing is left to upload.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if not self._pending and not self._in_flight:
+                return True
+
+            print(f"[Sync] Flushing {self._pending + self._in_flight} pending save(s)")
+            self._flush_from = self._attempts
+            self._cond.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    if self._last_failed_attempt > self._flush_from:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                return not self._pending and not self._in_flight
+            finally:
+                self._flush_from = None
+
+    def status(self) -> dict:
+        """Queue depth and the time of the last successful upload."""
+        with self._cond:
+            last_success = self._last_success
+            return {
+                "queue_depth": self._pending,
+                "uploading": self._in_flight > 0,
+                "consecutive_failures": self._failures,
+                "last_success": (
+                    datetime.fromtimestamp(last_success, timezone.utc).isoformat()
+                    if last_success is not None
+                    else None
+                ),
             }
-            service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields="id",
-            ).execute()
-            print(f"[Drive Sync] Created vault.enc in Drive")
 
-        return True
-    except Exception as e:
-        print(f"[Drive Sync] Error uploading vault: {e}")
-        return False
+
+# The process-wide uploader
+uploader = UploadQueue(upload_vault)
 
 
 def upload_vault_async(local_path: str):
-    """Upload vault to Drive in background thread."""
-    thread = threading.Thread(
-        target=upload_vault_to_drive, args=(local_path,), daemon=True
-    )
-    thread.start()
+    """Queue an upload of the vault (coalesced, in the background)."""
+    if not is_sync_enabled():
+        return
+    uploader.request(local_path)
 
 
-def sync_on_startup(local_path: str) -> bool:
-    """
-    Sync vault on application startup.
-    - If local vault exists: do nothing (use local)
-    - If local vault doesn't exist: try to download from Drive
+def flush_uploads(timeout: float = UPLOAD_FLUSH_TIMEOUT) -> bool:
+    """Upload pending changes before the process exits."""
+    return uploader.flush(timeout)
+
 
+def sync_on_startup(
+    local_path: str, upload: Callable[[str], object] = upload_vault_async
+) -> bool:
+    """
+    Sync vault on application startup, comparing checksums with the backend.
+    - No local vault: download it
+    - Same content in both places: nothing to do
+    - Only the remote copy changed since the last sync: download it
+    - Only the local vault changed: upload it (in the background)
+    - Both changed (or never synced): the newer one wins; a local copy
+      that loses is kept next to the vault as a .conflict file
+
+    Uploads go through `upload` (the background uploader by default).
     Returns True if vault is available after sync, False if fresh install.
     """
-    if os.path.exists(local_path):
-        print(f"[Drive Sync] Local vault exists, using local copy")
-        # Optionally upload to Drive to ensure it's backed up
-        if is_drive_sync_enabled():
-            upload_vault_async(local_path)
+    local_exists = os.path.exists(local_path)
+    if not is_sync_enabled():
+        if local_exists:
+            print("[Sync] Local vault exists, using local copy")
+        return local_exists
+
+    if not local_exists:
+        # Try to download from the backend
+        if download_vault(local_path):
+            return True
+
+        # No vault anywhere - fresh install
+        print("[Sync] No vault found anywhere, fresh install")
+        return False
+
+    with _sync_lock:
+        backend = get_sync_backend()
+        try:
+            remote = find_file(backend, VAULT_FILENAME) if backend else None
+        except Exception as e:
+            print(f"[Sync] Error reading vault metadata: {e}")
+            backend = None
+
+    if backend is None:
+        print("[Sync] Sync backend unavailable, using local copy")
         return True
 
-    # Try to download from Drive
-    if download_vault_from_drive(local_path):
+    if remote is None:
+        print("[Sync] No remote vault.enc yet, uploading local copy")
+        upload(local_path)
         return True
 
-    # No vault anywhere - fresh install
-    print("[Drive Sync] No vault found anywhere, fresh install")
-    return False
+    local_md5 = file_md5(local_path)
+    remote_md5 = remote.get("checksum")
+    synced_md5 = read_sync_state(local_path).get("checksum")
+    pending_journal = journal_has_changes(local_path)
+
+    if local_md5 == remote_md5 and not pending_journal:
+        write_sync_state(local_path, remote)
+        print("[Sync] Local vault matches the remote copy, nothing to sync")
+        return True
+
+    if remote_md5 == synced_md5:
+        print("[Sync] Local vault is newer, uploading it")
+        upload(local_path)
+        return True
+
+    local_changed = local_md5 != synced_md5 or pending_journal
+    if local_changed:
+        # Both sides changed since the last sync (or never synced)
+        if remote.get("modified_time", 0) <= os.path.getmtime(local_path):
+            print("[Sync] Vault changed in both places, local copy is newer, uploading it")
+            upload(local_path)
+            return True
+        backup_path = f"{local_path}.conflict-{datetime.now():%Y%m%d%H%M%S}"
+        print(f"[Sync] Vault changed in both places, remote copy is newer; local copy kept as {backup_path}")
+    else:
+        backup_path = None
+        print("[Sync] Remote vault is newer, downloading it")
+
+    if download_vault(local_path, backup_path=backup_path):
+        return True
+
+    print("[Sync] Download failed, using local copy")
+    return True
+
+
+# ============== STARTUP ==============
+
+# Set by the process that ran the startup sync before forking workers (the
+# Gunicorn master, see gunicorn.conf.py), so the workers skip it: "1", or
+# "upload" if its upload failed and the workers should queue it
+STARTUP_SYNCED_ENV = "VAULT_STARTUP_SYNCED"
+
+_startup_synced = threading.Event()
+_startup_lock = threading.Lock()
+_startup_started = False
+
+
+def run_startup_sync(local_path: str) -> bool:
+    """
+    Startup sync for a server about to fork its workers. Everything runs
+    in the calling thread with one upload attempt and no uploader thread,
+    so no sync lock can be held when a worker is forked; the backend
+    connection is dropped afterwards (not shared with the workers).
+    Workers forked afterwards are ready right away.
+    """
+    print("[Startup] Checking for vault sync...")
+    uploads = []
+    available = sync_on_startup(
+        local_path, upload=lambda path: uploads.append(upload_vault(path))
+    )
+    reset_drive_service()
+
+    if False in uploads:
+        print("[Startup] Vault upload failed, workers will retry it")
+        os.environ[STARTUP_SYNCED_ENV] = "upload"
+    else:
+        os.environ[STARTUP_SYNCED_ENV] = "1"
+    _startup_synced.set()
+    return available
+
+
+def start_startup_sync(local_path: str):
+    """
+    Startup sync in a worker, on the first call only: nothing to do if the
+    server already synced (or sync is off), otherwise sync in the
+    background so the worker can serve right away; startup_sync_done()
+    tells when it finished.
+    """
+    global _startup_started
+
+    if _startup_started:
+        return
+    with _startup_lock:
+        if _startup_started:
+            return
+        _startup_started = True
+
+    synced = os.environ.get(STARTUP_SYNCED_ENV)
+    if synced or not is_sync_enabled():
+        if synced == "upload":
+            upload_vault_async(local_path)
+        _startup_synced.set()
+        return
+
+    def run():
+        print("[Startup] Checking for vault sync...")
+        try:
+            sync_on_startup(local_path)
+        except Exception as e:
+            print(f"[Startup] Error syncing vault: {e}")
+        finally:
+            _startup_synced.set()
+
+    threading.Thread(target=run, name="startup-sync", daemon=True).start()
+
+
+def startup_sync_done() -> bool:
+    """Whether the startup sync of this process has finished."""
+    return _startup_synced.is_set()
@@ -0,0 +1,460 @@
+"""
+Metrics for Secret Management System
+Prometheus-style counters, gauges and histograms, aggregated across workers
+"""
+
+import atexit
+import functools
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Directory shared by the workers of one server for their metric files
+# (e.g. a tmpfs); without it /metrics reports only the worker it hits.
+# gunicorn.conf.py clears it when the server starts.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+
+# Seconds between writes of a worker's metric file
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counters and histograms of exited workers, folded together (no pid)
+EXITED_FILE = "exited.json"
+
+# Latency buckets in seconds, from a cached lookup up to a slow upload
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """A named metric with values per combination of label values."""
+
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: tuple = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def zero(self):
+        """Merged value before anything was recorded."""
+        return 0
+
+    def merge(self, values: list[dict]) -> dict:
+        """Combine the values of several workers (counters add up)."""
+        merged = {}
+        for worker in values:
+            for key, value in worker.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values: dict) -> list[str]:
+        return [
+            f"{self.name}{self._labels(key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(Metric):
+    """Monotonic count, e.g. of KDF invocations."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry._changed()
+
+
+class Gauge(Metric):
+    """
+    Current value. Workers' values are combined by `mode`: "sum" adds up
+    those of running workers (e.g. per-worker queues), "latest" takes the
+    most recently set one (e.g. the size of the shared vault file).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, labels=(), mode: str = "latest"):
+        super().__init__(registry, name, help, labels)
+        self.mode = mode
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            self._values[key] = [value, time.time()]
+        self.registry._changed()
+
+    def merge(self, values: list[dict]) -> dict:
+        merged = {}
+        for worker in values:
+            for key, (value, set_at) in worker.items():
+                if self.mode == "sum":
+                    merged[key] = [merged.get(key, [0, 0])[0] + value, set_at]
+                elif key not in merged or set_at > merged[key][1]:
+                    merged[key] = [value, set_at]
+        return {key: value for key, (value, _) in merged.items()}
+
+
+class Histogram(Metric):
+    """Distribution of durations in seconds over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds: float, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            value = self._values.get(key)
+            if value is None:
+                value = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = value[0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            value[1] += seconds
+            value[2] += 1
+        self.registry._changed()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with-block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, func):
+        """Decorator observing each call of func."""
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            with self.time():
+                return func(*args, **kwargs)
+
+        return call
+
+    def zero(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def merge(self, values: list[dict]) -> dict:
+        merged = {}
+        for worker in values:
+            for key, (counts, total, count) in worker.items():
+                if key not in merged:
+                    merged[key] = [[0] * len(counts), 0.0, 0]
+                into = merged[key]
+                into[0] = [a + b for a, b in zip(into[0], counts)]
+                into[1] += total
+                into[2] += count
+        return merged
+
+    def render(self, values: dict) -> list[str]:
+        lines = []
+        bounds = [*self.buckets, math.inf]
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of this process. With a directory, each worker writes its
+    values to <directory>/<pid>.json every `flush_interval` seconds and
+    render() combines the files of all workers, so any worker can answer
+    a scrape for the whole server. Counters and histograms of exited
+    workers are folded into one file (archive_worker()) so totals never
+    go backwards.
+    """
+
+    def __init__(self, directory: str = "", flush_interval: float = 5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._dirty = False
+        self._flusher_pid = None
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = (), mode: str = "latest") -> Gauge:
+        return self._register(Gauge(self, name, help, labels, mode))
+
+    def histogram(
+        self, name: str, help: str, labels: tuple = (), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        """
+        Start from zero, as in a forked worker: the parent reports what it
+        counted itself, so inherited values would be counted twice. The lock
+        is replaced, not taken: a thread of the parent may have held it at
+        the fork and does not exist here to release it.
+        """
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._values = {}
+        self._dirty = False
+        self._flusher_pid = None
+
+    def clear_files(self):
+        """Delete the worker files of an earlier run, before workers start."""
+        if not self.directory:
+            return
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    print(f"[Metrics] Error removing {name}: {e}")
+
+    def _read_file(self, path: str) -> dict:
+        """Values by metric name from a worker or exited file."""
+        with open(path) as f:
+            return {
+                name: {tuple(key): value for key, value in values}
+                for name, values in json.load(f).get("metrics", {}).items()
+            }
+
+    def archive_worker(self, pid: int):
+        """
+        Fold the file of an exited worker into the exited file and delete
+        it, so its counters and histograms stay in the totals while a new
+        worker given the same pid starts clean. Gauges are dropped. Call
+        from the process that reaps the workers (gunicorn child_exit).
+        """
+        if not self.directory:
+            return
+        path = self._worker_file(pid)
+        try:
+            worker = self._read_file(path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[Metrics] Error reading metrics of worker {pid}: {e}")
+            worker = {}
+
+        exited_path = os.path.join(self.directory, EXITED_FILE)
+        try:
+            exited = self._read_file(exited_path)
+        except (OSError, ValueError):
+            exited = {}
+
+        merged = {
+            name: [
+                [list(key), value]
+                for key, value in metric.merge(
+                    [exited.get(name, {}), worker.get(name, {})]
+                ).items()
+            ]
+            for name, metric in self._metrics.items()
+            if not isinstance(metric, Gauge)
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"metrics": merged}, f)
+            os.replace(tmp_path, exited_path)
+            os.remove(path)
+        except OSError as e:
+            print(f"[Metrics] Error archiving metrics of worker {pid}: {e}")
+
+    def _changed(self):
+        """Mark values for writing; starts this process's flusher on first use."""
+        self._dirty = True
+        if self.directory and self._flusher_pid != os.getpid():
+            # Also after a fork: threads of the parent do not carry over
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _snapshot(self) -> str:
+        """This process's values as JSON, taken under the lock."""
+        with self._lock:
+            return json.dumps(
+                {
+                    name: [[list(key), value] for key, value in metric._values.items()]
+                    for name, metric in self._metrics.items()
+                }
+            )
+
+    def _worker_file(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def flush(self):
+        """Write this worker's values to its file, if any changed."""
+        if not self.directory or not self._dirty:
+            return
+        self._dirty = False
+        data = f'{{"pid": {os.getpid()}, "metrics": {self._snapshot()}}}'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, self._worker_file(os.getpid()))
+        except OSError as e:
+            print(f"[Metrics] Error writing metrics file: {e}")
+
+    def _workers(self) -> list[tuple[bool, dict]]:
+        """(running, values by metric) of this process and every worker file."""
+        workers = [(True, json.loads(self._snapshot()))]
+        if not self.directory:
+            return workers
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return workers
+        for name in names:
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # The exited file has no pid: never running
+            running = "pid" in data and _pid_alive(data["pid"])
+            workers.append((running, data.get("metrics", {})))
+        return workers
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        self.flush()
+        workers = self._workers()
+
+        lines = []
+        for name, metric in self._metrics.items():
+            values = []
+            for running, worker in workers:
+                if isinstance(metric, Gauge) and metric.mode == "sum" and not running:
+                    continue
+                values.append({tuple(key): value for key, value in worker.get(name, [])})
+            merged = metric.merge(values)
+            if not metric.labelnames and not merged:
+                merged[()] = metric.zero()
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+atexit.register(REGISTRY.flush)
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+# Crypto
+KDF_SECONDS = REGISTRY.histogram("vault_kdf_seconds", "Argon2id key derivation time.")
+KDF_INVOCATIONS = REGISTRY.counter("vault_kdf_invocations_total", "Argon2id key derivations.")
+KDF_REJECTED = REGISTRY.counter(
+    "vault_kdf_rejected_total", "Key derivations refused because the KDF queue was full."
+)
+ENCRYPT_SECONDS = REGISTRY.histogram("vault_encrypt_seconds", "Whole-vault encryption time.")
+DECRYPT_SECONDS = REGISTRY.histogram("vault_decrypt_seconds", "Whole-vault decryption time.")
+
+# Storage
+FILE_READ_SECONDS = REGISTRY.histogram(
+    "vault_file_read_seconds", "Vault snapshot and journal read time.", labels=("file",)
+)
+FILE_WRITE_SECONDS = REGISTRY.histogram(
+    "vault_file_write_seconds",
+    "Vault snapshot write and journal append time, including fsync.",
+    labels=("file",),
+)
+FILE_BYTES = REGISTRY.gauge(
+    "vault_file_bytes", "Size of the vault snapshot and journal.", labels=("file",)
+)
+ENTRIES = REGISTRY.gauge("vault_entries", "Entries in the vault by type.", labels=("type",))
+
+# Caches and logins
+CACHE_REQUESTS = REGISTRY.counter(
+    "vault_cache_requests_total",
+    "Lookups in the worker key and vault caches.",
+    labels=("cache", "result"),
+)
+FAILED_LOGINS = REGISTRY.counter(
+    "vault_failed_logins_total", "Wrong master passwords at login and password change."
+)
+
+# Sync
+SYNC_SECONDS = REGISTRY.histogram(
+    "vault_sync_transfer_seconds",
+    "Vault upload and download time against the sync backend.",
+    labels=("direction",),
+)
+UPLOAD_BACKLOG = REGISTRY.gauge(
+    "vault_upload_backlog", "Saves waiting to be uploaded.", mode="sum"
+)
@@ -0,0 +1,277 @@
+"""
+Request profiling for Secret Management System
+Server-Timing phase breakdown per request and 1-in-N request profiling to disk
+"""
+
+import atexit
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+# Add a Server-Timing header with the phase breakdown to /api/* responses
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes", "on")
+
+# Where sampled profiles (and the profiling switch shared by the workers) go
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./data/profiles")
+
+# Seconds between writes of a worker's aggregated profile
+PROFILE_FLUSH_INTERVAL = float(os.environ.get("PROFILE_FLUSH_INTERVAL", "10"))
+
+PROFILE_MODES = ("off", "cprofile", "sampler")
+SETTINGS_FILE = "profiling.json"
+
+_timing = contextvars.ContextVar("timing", default=None)
+_NO_PHASE = nullcontext()
+
+
+class Timing:
+    """
+    Time spent in each phase of one request. Phases nest; a phase's time
+    excludes the phases inside it, so the phases add up to at most the total.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self._stack = []
+        self._mark = self.start
+
+    def _switch(self, now: float):
+        """Book the time since the last switch to the innermost phase."""
+        if self._stack:
+            name = self._stack[-1]
+            self.phases[name] = self.phases.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        self._switch(time.perf_counter())
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._switch(time.perf_counter())
+            self._stack.pop()
+
+    def header(self) -> str:
+        """Server-Timing header value, durations in milliseconds."""
+        metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+def start_timing():
+    """Start timing the current request; returns a token for end_timing()."""
+    return _timing.set(Timing())
+
+
+def end_timing(token) -> Optional[Timing]:
+    """Stop timing the current request and return its Timing."""
+    timing = _timing.get()
+    _timing.reset(token)
+    return timing
+
+
+def phase(name: str):
+    """
+    Context manager booking its block to a phase of the current request
+    (kdf, read, decrypt, parse, preview, serialize, ...). A no-op unless
+    the request is being timed.
+    """
+    timing = _timing.get()
+    return timing.phase(name) if timing is not None else _NO_PHASE
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profiler:
+    """
+    Profiles 1 in `every` requests of this worker, either with cProfile
+    (deterministic, exact call counts) or by sampling the request thread's
+    stack every `interval_ms` (low overhead, flame graph friendly).
+
+    The switch is a settings file in `directory`, so turning profiling on
+    or off reaches every worker. Each worker aggregates its profiles and
+    writes them to cprofile-<pid>.prof (pstats) or stacks-<pid>.folded
+    (collapsed stacks) at most every `flush_interval` seconds.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 10.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._settings = {"mode": "off", "every": 100, "interval_ms": 5}
+        self._settings_mtime = None
+        self._settings_checked = 0.0
+        self._requests = 0
+        self._profiled = 0
+        self._stats = None
+        self._stacks = Counter()
+        self._sampled_threads = set()
+        self._sampler_pid = None
+        self._last_flush = time.monotonic()
+        self._dirty = False
+
+    # ---- switch ----
+
+    def _settings_path(self) -> str:
+        return os.path.join(self.directory, SETTINGS_FILE)
+
+    def settings(self) -> dict:
+        """Current switch settings, re-read from disk at most once a second."""
+        now = time.monotonic()
+        if now - self._settings_checked < 1.0:
+            return self._settings
+        self._settings_checked = now
+        try:
+            mtime = os.stat(self._settings_path()).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._settings_mtime:
+            self._settings_mtime = mtime
+            settings = {"mode": "off", "every": 100, "interval_ms": 5}
+            if mtime is not None:
+                try:
+                    with open(self._settings_path()) as f:
+                        settings.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"[Profiling] Error reading settings: {e}")
+            if settings["mode"] != self._settings["mode"]:
+                self.flush()
+            self._settings = settings
+        return self._settings
+
+    def configure(self, mode: str, every: int, interval_ms: float):
+        """Write the switch for all workers. Raises ValueError if invalid."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(PROFILE_MODES)}")
+        if every < 1 or interval_ms <= 0:
+            raise ValueError("every and interval_ms must be positive")
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"mode": mode, "every": every, "interval_ms": interval_ms}, f)
+        os.replace(tmp_path, self._settings_path())
+        self._settings_checked = 0.0
+        print(f"[Profiling] Mode {mode}, 1 in {every} requests")
+
+    # ---- per request ----
+
+    def start(self):
+        """Maybe start profiling the current request; returns a token for stop()."""
+        settings = self.settings()
+        if settings["mode"] == "off":
+            return None
+        with self._lock:
+            self._requests += 1
+            if self._requests % settings["every"]:
+                return None
+            self._profiled += 1
+
+        if settings["mode"] == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            return profile
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._sampled_threads.add(thread_id)
+            if self._sampler_pid != os.getpid():
+                self._sampler_pid = os.getpid()
+                threading.Thread(target=self._sample_loop, daemon=True).start()
+        return thread_id
+
+    def stop(self, token):
+        """Stop profiling a request started with start() and aggregate it."""
+        if token is None:
+            return
+        if isinstance(token, cProfile.Profile):
+            token.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(token)
+                else:
+                    self._stats.add(token)
+                self._dirty = True
+        else:
+            with self._lock:
+                self._sampled_threads.discard(token)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _sample_loop(self):
+        pid = os.getpid()
+        while self._sampler_pid == pid:
+            time.sleep(self._settings["interval_ms"] / 1000)
+            with self._lock:
+                threads = set(self._sampled_threads)
+            if not threads:
+                continue
+
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    with self._lock:
+                        self._stacks[";".join(reversed(stack))] += 1
+                        self._dirty = True
+
+    # ---- output ----
+
+    def flush(self):
+        """Write this worker's aggregated profiles, if anything was added."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._last_flush = time.monotonic()
+            stats = self._stats
+            stacks = "".join(f"{stack} {count}\n" for stack, count in self._stacks.items())
+
+        pid = os.getpid()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if stats is not None:
+                tmp_path = os.path.join(self.directory, f".cprofile-{pid}.tmp")
+                stats.dump_stats(tmp_path)
+                os.replace(tmp_path, os.path.join(self.directory, f"cprofile-{pid}.prof"))
+            if stacks:
+                tmp_path = os.path.join(self.directory, f".stacks-{pid}.tmp")
+                with open(tmp_path, "w") as f:
+                    f.write(stacks)
+                os.replace(tmp_path, os.path.join(self.directory, f"stacks-{pid}.folded"))
+        except OSError as e:
+            print(f"[Profiling] Error writing profile: {e}")
+
+    def status(self) -> dict:
+        """Switch settings and what this worker profiled, for the admin route."""
+        settings = self.settings()
+        with self._lock:
+            return {
+                **settings,
+                "directory": self.directory,
+                "requests": self._requests,
+                "profiled": self._profiled,
+            }
+
+
+profiler = Profiler(PROFILE_DIR, PROFILE_FLUSH_INTERVAL)
+atexit.register(profiler.flush)
@@ -0,0 +1,175 @@
+"""
+Entry schema for Secret Management System
+Entry types, the fields stored and previewed for each type and their compact storage form
+"""
+
+# Valid entry types
+VALID_ENTRY_TYPES = [
+    "login",
+    "note",
+    "credit_card",
+    "identity",
+    "api_credential",
+    "database",
+    "server",
+    "software_license",
+    "ssh_key",
+    "wifi",
+    "bank_account",
+]
+
+# Entry type field definitions. Stored entries refer to fields by their
+# position in these lists, so only ever append new fields to a type; never
+# remove or reorder existing ones.
+ENTRY_FIELDS = {
+    "login": ["url", "username", "password", "notes"],
+    "note": ["notes"],
+    "credit_card": [
+        "cardholder_name",
+        "card_number",
+        "expiration_date",
+        "security_code",
+        "pin",
+        "notes",
+    ],
+    "identity": [
+        # Personal details
+        "prefix_title",
+        "full_name",
+        "email",
+        "phone",
+        "birth_date",
+        "gender",
+        # Address details
+        "organization",
+        "address",
+        "postal_code",
+        "city",
+        "state",
+        "country",
+        # Contact details
+        "ssn",
+        "passport_number",
+        "license_number",
+        "website",
+        "x_handle",
+        "linkedin",
+        "reddit",
+        "facebook",
+        "yahoo",
+        "instagram",
+        # Work details
+        "company",
+        "job_title",
+        "work_website",
+        "work_phone",
+        "work_email",
+        "notes",
+    ],
+    "api_credential": [
+        "api_key",
+        "api_secret",
+        "expiration_date",
+        "permissions",
+        "notes",
+    ],
+    "database": [
+        "host",
+        "port",
+        "username",
+        "password",
+        "database_type",
+        "database_name",
+        "notes",
+    ],
+    "server": ["ip_address", "hostname", "os", "username", "password", "notes"],
+    "software_license": ["license_key", "product", "expiry_date", "owner", "notes"],
+    "ssh_key": ["public_key", "private_key", "passphrase", "username", "host", "notes"],
+    "wifi": ["ssid", "password", "security_type", "notes"],
+    "bank_account": [
+        "bank_name",
+        "account_number",
+        "routing_number",
+        "account_type",
+        "iban",
+        "swift_bic",
+        "holder_name",
+        "notes",
+    ],
+}
+
+# Fields shown in entry lists, per type: (preview key, source field,
+# projection). Projections: None copies the field, "last4" keeps the last
+# four characters, "excerpt" shortens long text.
+PREVIEW_FIELDS = {
+    "login": [("username", "username", None), ("url", "url", None)],
+    "note": [("preview", "notes", "excerpt")],
+    "credit_card": [
+        ("card_last4", "card_number", "last4"),
+        ("cardholder_name", "cardholder_name", None),
+    ],
+    "identity": [("full_name", "full_name", None), ("email", "email", None)],
+    "api_credential": [("permissions", "permissions", None)],
+    "database": [("host", "host", None), ("database_type", "database_type", None)],
+    "server": [("ip_address", "ip_address", None), ("hostname", "hostname", None)],
+    "software_license": [("product", "product", None), ("expiry_date", "expiry_date", None)],
+    "ssh_key": [("host", "host", None), ("username", "username", None)],
+    "wifi": [("ssid", "ssid", None), ("security_type", "security_type", None)],
+    "bank_account": [
+        ("bank_name", "bank_name", None),
+        ("account_last4", "account_number", "last4"),
+    ],
+}
+
+# Storage layout of entries in vault records and journal changes:
+#   1: every field of the type by name, empty ones as ""
+#   2: only non-empty fields, under "f" keyed by their ENTRY_FIELDS position
+ENTRY_FORMAT_VERSION = 2
+
+# Keys every entry has besides its type's fields
+ENTRY_KEYS = ("id", "type", "title", "created_at", "updated_at")
+
+# Field positions per type, for packing
+_FIELD_POSITIONS = {
+    entry_type: {field: str(i) for i, field in enumerate(fields)}
+    for entry_type, fields in ENTRY_FIELDS.items()
+}
+
+
+def pack_entry(entry: dict) -> dict:
+    """
+    Compact form of an entry for storage: the common keys, non-empty
+    schema fields under "f" keyed by position, and any other keys under "x".
+    """
+    positions = _FIELD_POSITIONS.get(entry.get("type"), {})
+    packed = {}
+    values = {}
+    extra = {}
+    for key, value in entry.items():
+        if key in ENTRY_KEYS:
+            packed[key] = value
+        elif key in positions:
+            if value != "":
+                values[positions[key]] = value
+        else:
+            extra[key] = value
+    packed["f"] = values
+    if extra:
+        packed["x"] = extra
+    return packed
+
+
+def unpack_entry(stored: dict) -> dict:
+    """
+    Expand a stored entry (either format) to the API shape: the common keys
+    plus every field of its type, "" when empty.
+    """
+    if "f" not in stored:
+        return stored  # Format 1 is already expanded
+
+    entry = {key: stored[key] for key in ENTRY_KEYS if key in stored}
+    values = stored["f"]
+    for i, field in enumerate(ENTRY_FIELDS.get(stored.get("type"), ())):
+        entry[field] = values.get(str(i), "")
+    entry.update(stored.get("x", {}))
+    return entry
@@ -0,0 +1,204 @@
+"""
+Entry search for Secret Management System
+In-memory trigram index over entry previews, ranked and paginated
+"""
+
+import hmac
+import threading
+from typing import Optional
+
+# Preview fields that are searched, with their rank weight
+SEARCH_FIELDS = {
+    "title": 3,
+    "username": 1,
+    "url": 1,
+    "full_name": 1,
+    "email": 1,
+    "ssid": 1,
+    "host": 1,
+    "hostname": 1,
+    "ip_address": 1,
+    "bank_name": 1,
+    "product": 1,
+    "cardholder_name": 1,
+    "database_type": 1,
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def _trigrams(text: str) -> set:
+    """Trigrams of a lowercased string (the whole string if shorter)."""
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _field_texts(preview: dict) -> dict:
+    """Lowercased searchable texts of a preview, by field name."""
+    return {
+        field: str(preview[field]).lower()
+        for field in SEARCH_FIELDS
+        if preview.get(field)
+    }
+
+
+def _score_term(term: str, texts: dict) -> int:
+    """
+    Best score of one query term over the fields of an entry, 0 if no field
+    contains it. Exact field matches beat word prefixes beat substrings.
+    """
+    best = 0
+    for field, text in texts.items():
+        position = text.find(term)
+        if position < 0:
+            continue
+        if text == term:
+            kind = 3
+        elif position == 0 or not text[position - 1].isalnum():
+            kind = 2
+        else:
+            kind = 1
+        best = max(best, kind * SEARCH_FIELDS[field])
+    return best
+
+
+class SearchIndex:
+    """
+    Trigram index over the preview fields of one vault.
+
+    Built from all previews on unlock and then kept in step with creates,
+    updates and deletes. It remembers which vault (data key) and revision
+    it reflects so callers can tell when it has to be rebuilt.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._previews = {}
+        self._texts = {}
+        self._postings = {}
+        self._data_key = None
+        self.revision = None
+
+    def matches(self, data_key: bytes, revision: int) -> bool:
+        """Check whether the index reflects this vault at this revision."""
+        with self._lock:
+            return (
+                self._data_key is not None
+                and self.revision == revision
+                and hmac.compare_digest(self._data_key, data_key)
+            )
+
+    def build(self, previews: list[dict], data_key: bytes, revision: int):
+        """Rebuild the index from the previews of every entry."""
+        with self._lock:
+            self._previews = {}
+            self._texts = {}
+            self._postings = {}
+            for preview in previews:
+                self._add(preview)
+            self._data_key = data_key
+            self.revision = revision
+
+    def update(
+        self,
+        previews: list[dict],
+        deleted: set,
+        data_key: bytes,
+        from_revision: int,
+        to_revision: int,
+    ) -> bool:
+        """
+        Apply created/updated previews and deleted ids for one save.
+        Returns False (and changes nothing) if the index was not at
+        `from_revision` of this vault; the caller should rebuild instead.
+        """
+        with self._lock:
+            if not self.matches(data_key, from_revision):
+                return False
+            for entry_id in deleted:
+                self._remove(entry_id)
+            for preview in previews:
+                self._remove(preview["id"])
+                self._add(preview)
+            self.revision = to_revision
+            return True
+
+    def clear(self):
+        """Forget everything."""
+        with self._lock:
+            self.build([], None, None)
+
+    def _add(self, preview: dict):
+        entry_id = preview["id"]
+        texts = _field_texts(preview)
+        self._previews[entry_id] = preview
+        self._texts[entry_id] = texts
+        for text in texts.values():
+            for gram in _trigrams(text):
+                self._postings.setdefault(gram, set()).add(entry_id)
+
+    def _remove(self, entry_id: str):
+        texts = self._texts.pop(entry_id, None)
+        self._previews.pop(entry_id, None)
+        if texts is None:
+            return
+        for text in texts.values():
+            for gram in _trigrams(text):
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del self._postings[gram]
+
+    def _candidates(self, terms: list[str]) -> set:
+        """Entry ids that may contain every term, narrowed by trigrams."""
+        candidates = None
+        for term in terms:
+            if len(term) < 3:
+                continue
+            for gram in _trigrams(term):
+                ids = self._postings.get(gram, set())
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return set()
+        return set(self._previews) if candidates is None else candidates
+
+    def search(
+        self,
+        query: str,
+        entry_type: Optional[str] = None,
+        cursor: int = 0,
+        limit: int = DEFAULT_LIMIT,
+    ) -> tuple[list[dict], Optional[int], int]:
+        """
+        Find entries whose searchable fields contain every query term.
+        Results are ranked by score, then title. Returns (page of previews,
+        cursor of the next page or None, total number of matches).
+        """
+        terms = query.lower().split()
+        limit = max(1, min(limit, MAX_LIMIT))
+        cursor = max(0, cursor)
+
+        with self._lock:
+            scored = []
+            for entry_id in self._candidates(terms):
+                preview = self._previews[entry_id]
+                if entry_type and preview["type"] != entry_type:
+                    continue
+
+                texts = self._texts[entry_id]
+                score = 0
+                for term in terms:
+                    term_score = _score_term(term, texts)
+                    if term_score == 0:
+                        break
+                    score += term_score
+                else:
+                    scored.append((-score, preview["title"].lower(), entry_id, preview))
+
+        scored.sort(key=lambda item: item[:3])
+        page = [item[3] for item in scored[cursor : cursor + limit]]
+        next_cursor = cursor + limit if cursor + limit < len(scored) else None
+        return page, next_cursor, len(scored)
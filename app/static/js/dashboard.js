@@ -1,9 +1,12 @@
 function dashboardApp() {
   return {
     entries: [],
+    revisionTag: null,
     loading: true,
     filter: "all",
     searchQuery: "",
+    searchResults: null,
+    searchNextCursor: null,
     mobileMenuOpen: false,
     modalOpen: false,
     modalMode: "create",
@@ -156,42 +159,62 @@ function dashboardApp() {
     },
 
     get filteredEntries() {
+      // Searches are ranked and paginated by the server
+      if (this.searchQuery.trim() && this.searchResults !== null) {
+        return this.searchResults;
+      }
       let filtered = this.entries;
       if (this.filter !== "all") {
         filtered = filtered.filter((e) => e.type === this.filter);
       }
-      if (this.searchQuery.trim()) {
-        const query = this.searchQuery.toLowerCase();
-        filtered = filtered.filter((e) => {
-          const searchFields = [
-            e.title,
-            e.username,
-            e.url,
-            e.full_name,
-            e.email,
-            e.ssid,
-            e.host,
-            e.hostname,
-            e.ip_address,
-            e.bank_name,
-            e.product,
-            e.cardholder_name,
-            e.database_type,
-          ];
-          return searchFields.some((f) => f && f.toLowerCase().includes(query));
-        });
-      }
       return filtered;
     },
 
     async init() {
+      this.$watch("filter", () => this.search());
       await this.loadEntries();
     },
 
+    async search(loadMore = false) {
+      const query = this.searchQuery.trim();
+      if (!query) {
+        this.searchResults = null;
+        this.searchNextCursor = null;
+        return;
+      }
+
+      const params = new URLSearchParams({ q: query });
+      if (this.filter !== "all") params.set("type", this.filter);
+      if (loadMore && this.searchNextCursor) params.set("cursor", this.searchNextCursor);
+
+      try {
+        const response = await fetch(`/api/entries/search?${params}`, {
+          headers: { "X-Requested-With": "XMLHttpRequest" },
+        });
+
+        if (response.status === 401) {
+          window.location.href = "/";
+          return;
+        }
+
+        const data = await response.json();
+        // Ignore answers to a query the user has already changed
+        if (query !== this.searchQuery.trim()) return;
+
+        const results = data.entries || [];
+        this.searchResults = loadMore ? [...(this.searchResults || []), ...results] : results;
+        this.searchNextCursor = data.next_cursor;
+      } catch (err) {
+        this.showToast("Search failed", "error");
+      }
+    },
+
     async loadEntries() {
       this.loading = true;
       try {
+        // Revalidated with the ETag; an unchanged vault answers 304
         const response = await fetch("/api/entries", {
+          cache: "no-cache",
           headers: { "X-Requested-With": "XMLHttpRequest" },
         });
 
@@ -202,6 +225,8 @@ function dashboardApp() {
 
         const data = await response.json();
         this.entries = data.entries || [];
+        this.revisionTag = data.revision_tag ?? null;
+        await this.search();
       } catch (err) {
         this.showToast("Failed to load entries", "error");
       } finally {
@@ -209,6 +234,33 @@ function dashboardApp() {
       }
     },
 
+    async syncEntries() {
+      // Apply only what changed since the revision tag we hold
+      if (this.revisionTag === null) return this.loadEntries();
+      try {
+        const response = await fetch(`/api/entries/changes?since=${this.revisionTag}`, {
+          headers: { "X-Requested-With": "XMLHttpRequest" },
+        });
+
+        if (response.status === 401) {
+          window.location.href = "/";
+          return;
+        }
+
+        const data = await response.json();
+        if (data.reset) {
+          this.entries = data.entries || [];
+        } else {
+          const gone = new Set([...(data.deleted || []), ...data.entries.map((e) => e.id)]);
+          this.entries = [...this.entries.filter((e) => !gone.has(e.id)), ...data.entries];
+        }
+        this.revisionTag = data.revision_tag ?? null;
+        await this.search();
+      } catch (err) {
+        this.showToast("Failed to load entries", "error");
+      }
+    },
+
     openModal(type) {
       this.modalMode = "create";
       this.formData = {
@@ -341,6 +393,7 @@ function dashboardApp() {
           headers: {
             "Content-Type": "application/json",
             "X-Requested-With": "XMLHttpRequest",
+            ...this.revisionHeaders(isEdit),
           },
           body: JSON.stringify(this.formData),
         });
@@ -350,6 +403,12 @@ function dashboardApp() {
           return;
         }
 
+        if (response.status === 409) {
+          this.error = "This vault was changed elsewhere. Reloaded, please try again.";
+          await this.syncEntries();
+          return;
+        }
+
         const data = await response.json();
 
         if (response.ok) {
@@ -358,7 +417,7 @@ function dashboardApp() {
             "success"
           );
           this.closeModal();
-          await this.loadEntries();
+          await this.syncEntries();
         } else {
           this.error = data.error || "Failed to save";
         }
@@ -381,7 +440,10 @@ function dashboardApp() {
       try {
         const response = await fetch(`/api/entries/${this.formData.id}`, {
           method: "DELETE",
-          headers: { "X-Requested-With": "XMLHttpRequest" },
+          headers: {
+            "X-Requested-With": "XMLHttpRequest",
+            ...this.revisionHeaders(true),
+          },
         });
 
         if (response.status === 401) {
@@ -389,10 +451,16 @@ function dashboardApp() {
           return;
         }
 
+        if (response.status === 409) {
+          this.showToast("This vault was changed elsewhere. Reloaded, please try again.", "error");
+          await this.syncEntries();
+          return;
+        }
+
         if (response.ok) {
           this.showToast("Entry deleted!", "success");
           this.closeModal();
-          await this.loadEntries();
+          await this.syncEntries();
         } else {
           const data = await response.json();
           this.showToast(data.error || "Failed to delete", "error");
@@ -402,6 +470,12 @@ function dashboardApp() {
       }
     },
 
+    revisionHeaders(checkRevision) {
+      // Edits and deletes are rejected (409) if the vault changed since the list was loaded
+      if (!checkRevision || this.revisionTag === null) return {};
+      return { "If-Match": `"${this.revisionTag}"` };
+    },
+
     async logout() {
       try {
         await fetch("/api/logout", {
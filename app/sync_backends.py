@@ -0,0 +1,197 @@
+"""
+Sync backends for Secret Management System
+Where the vault is replicated to: a local/NFS directory mirror or an
+in-memory fake (Google Drive lives in drive_sync.py)
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional, Protocol, Union
+
+# Every backend describes a stored file with these keys:
+#   name          file name, e.g. "vault.enc"
+#   checksum      MD5 hex digest of the content
+#   revision      opaque string that changes whenever the content is replaced
+#   modified_time seconds since the epoch of the last put
+#   size          size in bytes
+
+
+class SyncBackend(Protocol):
+    """A replica target the vault is uploaded to and restored from."""
+
+    def list(self) -> list[dict]:
+        """Metadata of every stored file."""
+        ...
+
+    def get(self, name: str, local_path: str) -> Optional[dict]:
+        """
+        Write the content of `name` to `local_path` (a temp file, vetted by
+        the caller). Returns its metadata, or None if it does not exist.
+        """
+        ...
+
+    def put(self, name: str, local_path: str) -> dict:
+        """Store the file at `local_path` as `name`; returns the new metadata."""
+        ...
+
+
+def file_md5(path: str) -> Optional[str]:
+    """MD5 hex digest of a file, None if it does not exist."""
+    digest = hashlib.md5()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def find_file(backend: SyncBackend, name: str) -> Optional[dict]:
+    """Metadata of one stored file, None if missing."""
+    for metadata in backend.list():
+        if metadata["name"] == name:
+            return metadata
+    return None
+
+
+class LocalDirectoryBackend:
+    """
+    Mirror into a directory, e.g. an NFS/SMB mount or a second disk.
+    Files are replaced atomically, so the mirror never holds a torn copy.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _metadata(self, name: str) -> Optional[dict]:
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return {
+            "name": name,
+            "checksum": file_md5(path),
+            "revision": str(st.st_mtime_ns),
+            "modified_time": st.st_mtime,
+            "size": st.st_size,
+        }
+
+    def list(self) -> list[dict]:
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+        return [
+            metadata
+            for name in names
+            if not name.startswith(".")
+            and os.path.isfile(os.path.join(self.directory, name))
+            and (metadata := self._metadata(name)) is not None
+        ]
+
+    def get(self, name: str, local_path: str) -> Optional[dict]:
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as src, open(local_path, "wb") as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                    dst.write(chunk)
+        except FileNotFoundError:
+            return None
+        return self._metadata(name)
+
+    def put(self, name: str, local_path: str) -> dict:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix="." + name + ".")
+        try:
+            with os.fdopen(fd, "wb") as dst, open(local_path, "rb") as src:
+                for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._metadata(name)
+
+
+class MemoryBackend:
+    """
+    In-memory fake for tests and benchmarks. Every call sleeps for
+    `latency` seconds (a number, or a callable returning one) to mimic a
+    remote round trip; `calls` records each operation so tests can check
+    which transfers were skipped. Several vaults may share one instance.
+    """
+
+    def __init__(self, latency: Union[float, Callable[[], float]] = 0.0):
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self._files = {}
+        self._revision = 0
+
+    def _wait(self):
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def _metadata(self, name: str) -> Optional[dict]:
+        item = self._files.get(name)
+        if item is None:
+            return None
+        content, revision, modified_time = item
+        return {
+            "name": name,
+            "checksum": hashlib.md5(content).hexdigest(),
+            "revision": str(revision),
+            "modified_time": modified_time,
+            "size": len(content),
+        }
+
+    def store(self, name: str, content: bytes, modified_time: Optional[float] = None) -> dict:
+        """Replace a file directly, as another machine syncing would."""
+        with self._lock:
+            self._revision += 1
+            self._files[name] = (content, self._revision, modified_time or time.time())
+            return self._metadata(name)
+
+    def remove(self, name: str):
+        """Delete a stored file."""
+        with self._lock:
+            self._files.pop(name, None)
+
+    def content(self, name: str) -> Optional[bytes]:
+        """Stored bytes of a file, None if missing."""
+        with self._lock:
+            item = self._files.get(name)
+            return item[0] if item else None
+
+    def list(self) -> list[dict]:
+        self._wait()
+        with self._lock:
+            self.calls.append("list")
+            return [self._metadata(name) for name in sorted(self._files)]
+
+    def get(self, name: str, local_path: str) -> Optional[dict]:
+        self._wait()
+        with self._lock:
+            self.calls.append("get")
+            item = self._files.get(name)
+            if item is None:
+                return None
+            with open(local_path, "wb") as f:
+                f.write(item[0])
+            return self._metadata(name)
+
+    def put(self, name: str, local_path: str) -> dict:
+        self._wait()
+        with open(local_path, "rb") as f:
+            content = f.read()
+        self.calls.append("put")
+        return self.store(name, content)
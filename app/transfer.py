@@ -0,0 +1,402 @@
+"""
+Bulk import/export for Secret Management System
+Streams entries in from Bitwarden, 1Password, KeePass and native files
+and streams the vault back out as JSON or CSV
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from app.schema import VALID_ENTRY_TYPES, ENTRY_FIELDS
+
+# Characters read from the source file at a time
+CHUNK_SIZE = 64 * 1024
+
+# Largest import file in bytes (also the request body limit of the app). A
+# single CSV field may be that long, e.g. a PEM key or a long note, instead
+# of the csv module's default of 128 KiB.
+MAX_IMPORT_SIZE = int(os.environ.get("MAX_IMPORT_SIZE", str(32 * 1024 * 1024)))
+csv.field_size_limit(MAX_IMPORT_SIZE)
+
+# Rows written per chunk of a CSV export
+EXPORT_CSV_ROWS = 100
+
+EXPORT_FORMAT = "secret-management-system"
+
+IMPORT_FORMATS = (
+    "json",
+    "csv",
+    "bitwarden-json",
+    "bitwarden-csv",
+    "1password-csv",
+    "keepass-csv",
+)
+EXPORT_FORMATS = ("json", "csv")
+
+# Every schema field once, in schema order: the native CSV columns
+CSV_FIELDS = list(dict.fromkeys(f for t in VALID_ENTRY_TYPES for f in ENTRY_FIELDS[t]))
+
+# Column names (lowercased) used by password manager CSV exports, per field
+CSV_COLUMNS = {
+    "bitwarden-csv": {
+        "type": ["type"],
+        "title": ["name"],
+        "url": ["login_uri"],
+        "username": ["login_username"],
+        "password": ["login_password"],
+        "notes": ["notes"],
+        "totp": ["login_totp"],
+        "group": ["folder"],
+        "custom": ["fields"],
+    },
+    "1password-csv": {
+        "title": ["title", "name"],
+        "url": ["url", "website", "urls"],
+        "username": ["username"],
+        "password": ["password"],
+        "notes": ["notes", "notesplain"],
+        "totp": ["otpauth", "one-time password"],
+    },
+    "keepass-csv": {
+        "title": ["title", "account"],
+        "url": ["url", "web site"],
+        "username": ["username", "user name", "login name"],
+        "password": ["password"],
+        "notes": ["notes", "comments"],
+        "totp": ["totp"],
+        "group": ["group"],
+    },
+}
+
+# Bitwarden item types
+BITWARDEN_TYPES = {1: "login", 2: "note", 3: "credit_card", 4: "identity", 5: "ssh_key"}
+
+
+def _text(value) -> str:
+    """Normalize an imported value to a string field."""
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _join(*parts, sep: str = " ") -> str:
+    return sep.join(_text(p).strip() for p in parts if _text(p).strip())
+
+
+def _with_notes(notes: str, *extra: str) -> str:
+    """Append extra lines (TOTP seeds, custom fields) to the notes."""
+    return _join(notes, *extra, sep="\n")
+
+
+def _make_record(entry_type: str, title: str, fields: dict) -> dict | None:
+    """
+    Build import data for one entry, keeping only the fields of its type.
+    Returns None for records without any content.
+    """
+    data = {field: _text(fields.get(field)).strip() for field in ENTRY_FIELDS[entry_type]}
+    title = _text(title).strip()
+    if not title and not any(data.values()):
+        return None
+
+    data["type"] = entry_type
+    data["title"] = title or data.get("url") or "Untitled"
+    return data
+
+
+def dedupe_key(data: dict) -> tuple[str, str]:
+    """Entries with the same title and URL are considered duplicates."""
+    url = _text(data.get("url")).strip().casefold().rstrip("/")
+    return _text(data.get("title")).strip().casefold(), url
+
+
+# ============== JSON ==============
+
+
+def iter_json_array(fh, key: str) -> Iterator:
+    """
+    Yield the items of the array stored under `key` in the top-level object
+    of a JSON text stream, decoding one item at a time instead of loading
+    the whole document.
+    """
+    chunks = iter(lambda: fh.read(CHUNK_SIZE), "")
+    decoder = json.JSONDecoder()
+
+    # Scan up to the opening bracket of the array, tracking nesting and
+    # strings so keys of nested objects are not mistaken for it
+    depth = 0
+    in_string = escaped = False
+    chars = []
+    last_string = None
+    pending_key = None
+    buf = None
+    for chunk in chunks:
+        for i, ch in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+                    last_string = json.loads('"' + "".join(chars) + '"')
+                    continue
+                if depth == 1:
+                    chars.append(ch)
+            elif ch == '"':
+                in_string = True
+                chars = []
+            elif ch == ":" and depth == 1:
+                pending_key = last_string
+            elif ch in "[{":
+                if ch == "[" and depth == 1 and pending_key == key:
+                    buf = chunk[i + 1 :]
+                    break
+                depth += 1
+                pending_key = None
+            elif ch in "]}":
+                depth -= 1
+            elif not ch.isspace():
+                pending_key = None
+        if buf is not None:
+            break
+
+    if buf is None:
+        raise ValueError(f"No '{key}' list found in the JSON file")
+
+    while True:
+        buf = buf.lstrip()
+        if buf.startswith(","):
+            buf = buf[1:]
+            continue
+        if buf.startswith("]"):
+            return
+
+        if buf:
+            try:
+                item, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                item = end = None
+            if end is not None:
+                yield item
+                buf = buf[end:]
+                continue
+
+        more = next(chunks, None)
+        if more is None:
+            raise ValueError("Unexpected end of JSON file")
+        buf += more
+
+
+def parse_native_json(fh) -> Iterator[dict]:
+    """Entries of a file written by export_json()."""
+    for item in iter_json_array(fh, "entries"):
+        if not isinstance(item, dict) or item.get("type") not in VALID_ENTRY_TYPES:
+            yield None
+            continue
+        yield _make_record(item["type"], item.get("title"), item)
+
+
+def parse_bitwarden_json(fh) -> Iterator[dict]:
+    """Items of an unencrypted Bitwarden JSON export."""
+    for item in iter_json_array(fh, "items"):
+        entry_type = BITWARDEN_TYPES.get(item.get("type")) if isinstance(item, dict) else None
+        if entry_type is None:
+            yield None
+            continue
+
+        custom = [
+            f"{_text(f.get('name'))}: {_text(f.get('value'))}"
+            for f in item.get("fields") or []
+            if isinstance(f, dict)
+        ]
+        notes = _with_notes(item.get("notes"), *custom)
+        title = item.get("name")
+
+        if entry_type == "login":
+            login = item.get("login") or {}
+            uris = [u.get("uri") for u in login.get("uris") or [] if isinstance(u, dict)]
+            totp = f"TOTP: {login['totp']}" if login.get("totp") else ""
+            fields = {
+                "url": uris[0] if uris else "",
+                "username": login.get("username"),
+                "password": login.get("password"),
+                "notes": _with_notes(notes, totp, *(f"URL: {u}" for u in uris[1:] if u)),
+            }
+        elif entry_type == "credit_card":
+            card = item.get("card") or {}
+            fields = {
+                "cardholder_name": card.get("cardholderName"),
+                "card_number": card.get("number"),
+                "expiration_date": _join(card.get("expMonth"), card.get("expYear"), sep="/"),
+                "security_code": card.get("code"),
+                "notes": notes,
+            }
+        elif entry_type == "identity":
+            identity = item.get("identity") or {}
+            fields = {
+                "prefix_title": identity.get("title"),
+                "full_name": _join(
+                    identity.get("firstName"),
+                    identity.get("middleName"),
+                    identity.get("lastName"),
+                ),
+                "email": identity.get("email"),
+                "phone": identity.get("phone"),
+                "company": identity.get("company"),
+                "address": _join(
+                    identity.get("address1"),
+                    identity.get("address2"),
+                    identity.get("address3"),
+                    sep=", ",
+                ),
+                "postal_code": identity.get("postalCode"),
+                "city": identity.get("city"),
+                "state": identity.get("state"),
+                "country": identity.get("country"),
+                "ssn": identity.get("ssn"),
+                "passport_number": identity.get("passportNumber"),
+                "license_number": identity.get("licenseNumber"),
+                "notes": notes,
+            }
+        elif entry_type == "ssh_key":
+            ssh_key = item.get("sshKey") or {}
+            fields = {
+                "public_key": ssh_key.get("publicKey"),
+                "private_key": ssh_key.get("privateKey"),
+                "notes": notes,
+            }
+        else:
+            fields = {"notes": notes}
+
+        yield _make_record(entry_type, title, fields)
+
+
+# ============== CSV ==============
+
+
+def _csv_rows(fh) -> Iterator[dict]:
+    """Rows of a CSV stream as dicts keyed by lowercased column name."""
+    reader = csv.reader(fh)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [name.strip().lower() for name in header]
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            yield dict(zip(columns, row))
+
+
+def parse_native_csv(fh) -> Iterator[dict]:
+    """Rows of a file written by export_csv()."""
+    for row in _csv_rows(fh):
+        entry_type = row.get("type", "").strip()
+        if entry_type not in VALID_ENTRY_TYPES:
+            yield None
+            continue
+        yield _make_record(entry_type, row.get("title"), row)
+
+
+def parse_password_manager_csv(fh, columns: dict) -> Iterator[dict]:
+    """Rows of a Bitwarden, 1Password or KeePass CSV export, as logins or notes."""
+    for row in _csv_rows(fh):
+        values = {
+            field: next((row[name] for name in names if row.get(name)), "")
+            for field, names in columns.items()
+        }
+
+        extra = []
+        if values.get("totp"):
+            extra.append(f"TOTP: {values['totp']}")
+        if values.get("group"):
+            extra.append(f"Group: {values['group']}")
+        if values.get("custom"):
+            extra.append(values["custom"])
+        notes = _with_notes(values.get("notes"), *extra)
+
+        row_type = values.get("type", "").strip().lower()
+        if row_type:
+            is_note = row_type != "login"
+        else:
+            is_note = not (values["url"] or values["username"] or values["password"])
+
+        if is_note:
+            yield _make_record("note", values["title"], {"notes": notes})
+        else:
+            yield _make_record("login", values["title"], {**values, "notes": notes})
+
+
+def parse_import(fh, file_format: str) -> Iterator[dict]:
+    """
+    Parse an import file from a text stream, one record at a time.
+    Yields entry data ({"type", "title", <fields>}) or None for records
+    that cannot be imported (unsupported item types, empty rows).
+    Raises ValueError for unknown formats and malformed files.
+    """
+    if file_format == "json":
+        return parse_native_json(fh)
+    if file_format == "csv":
+        return parse_native_csv(fh)
+    if file_format == "bitwarden-json":
+        return parse_bitwarden_json(fh)
+    if file_format in CSV_COLUMNS:
+        return parse_password_manager_csv(fh, CSV_COLUMNS[file_format])
+    raise ValueError(f"Unknown import format '{file_format}'")
+
+
+# ============== EXPORT ==============
+
+
+def _export_entry(entry: dict) -> dict:
+    """Schema fields of an entry, without its id."""
+    data = {
+        "type": entry["type"],
+        "title": entry["title"],
+        "created_at": entry.get("created_at", ""),
+        "updated_at": entry.get("updated_at", ""),
+    }
+    for field in ENTRY_FIELDS.get(entry["type"], []):
+        data[field] = entry.get(field, "")
+    return data
+
+
+def export_json(entries: Iterable[dict]) -> Iterator[str]:
+    """Stream entries as a native JSON document, one entry per chunk."""
+    exported_at = datetime.utcnow().isoformat() + "Z"
+    yield (
+        f'{{"format": "{EXPORT_FORMAT}", "version": 1, '
+        f'"exported_at": "{exported_at}", "entries": ['
+    )
+    for i, entry in enumerate(entries):
+        yield ("," if i else "") + "\n  " + json.dumps(_export_entry(entry), ensure_ascii=False)
+    yield "\n]}\n"
+
+
+def export_csv(entries: Iterable[dict]) -> Iterator[str]:
+    """Stream entries as native CSV, one column per schema field."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(
+        buffer, fieldnames=["type", "title", *CSV_FIELDS], extrasaction="ignore"
+    )
+    writer.writeheader()
+
+    for i, entry in enumerate(entries, start=1):
+        writer.writerow(_export_entry(entry))
+        if i % EXPORT_CSV_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def export_entries(entries: Iterable[dict], file_format: str) -> Iterator[str]:
+    """Stream entries in an export format. Raises ValueError if unknown."""
+    if file_format == "json":
+        return export_json(entries)
+    if file_format == "csv":
+        return export_csv(entries)
+    raise ValueError(f"Unknown export format '{file_format}'")
@@ -0,0 +1,322 @@
+"""
+Vault model for Secret Management System
+Decrypted vault held as slotted entries indexed by id and by type, with memoized previews
+"""
+
+from typing import Iterable, Iterator, Optional
+
+from app.crypto_utils import generate_entry_id
+from app.schema import ENTRY_FIELDS, ENTRY_KEYS, PREVIEW_FIELDS
+
+# Longest note text shown in a preview before it is cut off
+EXCERPT_LENGTH = 50
+
+PROJECTIONS = {
+    None: lambda value: value,
+    "last4": lambda value: value[-4:] if len(value) >= 4 else "",
+    "excerpt": lambda value: (
+        value[:EXCERPT_LENGTH] + "..." if len(value) > EXCERPT_LENGTH else value
+    ),
+}
+
+# Field positions per type, matching the values tuple of an Entry
+_POSITIONS = {
+    entry_type: {field: i for i, field in enumerate(fields)}
+    for entry_type, fields in ENTRY_FIELDS.items()
+}
+
+# PREVIEW_FIELDS compiled to (preview key, value position, projection) per
+# type; fails at import if a preview names a field its type does not have
+_PROJECTORS = {
+    entry_type: tuple(
+        (key, _POSITIONS[entry_type][field], PROJECTIONS[projection])
+        for key, field, projection in PREVIEW_FIELDS.get(entry_type, ())
+    )
+    for entry_type in ENTRY_FIELDS
+}
+
+_MISSING = object()
+
+
+def parse_revision_tag(tag: str) -> tuple[int, str]:
+    """(revision, id) of a Vault.revision_tag; raises ValueError if malformed."""
+    revision, _, revision_id = tag.partition(".")
+    return int(revision), revision_id
+
+
+class Entry:
+    """
+    One vault entry. The fields of its type are a tuple in ENTRY_FIELDS
+    order; keys outside the schema are kept in `extra`. Entries are not
+    changed in place: updated() returns a new entry, so a vault copy can
+    share entries with the cached vault and previews never go stale.
+    """
+
+    __slots__ = (
+        "id",
+        "type",
+        "title",
+        "created_at",
+        "updated_at",
+        "values",
+        "extra",
+        "_preview",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        type: str,
+        title: str = "",
+        created_at: str = "",
+        updated_at: str = "",
+        values: tuple = (),
+        extra: Optional[dict] = None,
+    ):
+        self.id = id
+        self.type = type
+        self.title = title
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.values = values
+        self.extra = extra
+        self._preview = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Entry":
+        """Entry from its API dict shape, missing fields as ""."""
+        entry_type = data["type"]
+        fields = ENTRY_FIELDS.get(entry_type, ())
+        positions = _POSITIONS.get(entry_type, {})
+        extra = {
+            key: value
+            for key, value in data.items()
+            if key not in ENTRY_KEYS and key not in positions
+        }
+        return cls(
+            data["id"],
+            entry_type,
+            data.get("title", ""),
+            data.get("created_at", ""),
+            data.get("updated_at", ""),
+            tuple(data.get(field, "") for field in fields),
+            extra or None,
+        )
+
+    @classmethod
+    def create(cls, data: dict, entry_type: str, now: str) -> "Entry":
+        """New entry with a fresh id from request data."""
+        fields = ENTRY_FIELDS.get(entry_type, ())
+        return cls(
+            generate_entry_id(),
+            entry_type,
+            data.get("title", ""),
+            now,
+            now,
+            tuple(data.get(field, "") for field in fields),
+        )
+
+    def updated(self, data: dict, now: str) -> "Entry":
+        """Copy with the title and type fields present in `data` replaced."""
+        values = tuple(
+            data.get(field, value)
+            for field, value in zip(ENTRY_FIELDS.get(self.type, ()), self.values)
+        )
+        return Entry(
+            self.id,
+            self.type,
+            data.get("title", self.title),
+            self.created_at,
+            now,
+            values,
+            self.extra,
+        )
+
+    def get(self, key: str, default=None):
+        """Value of a common key or field by name, like dict.get()."""
+        if key in ENTRY_KEYS:
+            return getattr(self, key)
+        position = _POSITIONS.get(self.type, {}).get(key)
+        if position is not None:
+            return self.values[position]
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key: str):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def to_dict(self) -> dict:
+        """API shape: the common keys, then every field of the type."""
+        data = {
+            "id": self.id,
+            "type": self.type,
+            "title": self.title,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        data.update(zip(ENTRY_FIELDS.get(self.type, ()), self.values))
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def preview(self) -> dict:
+        """
+        List fields without sensitive data, projected per PREVIEW_FIELDS.
+        Computed once per entry; the dict is shared, do not modify it.
+        """
+        preview = self._preview
+        if preview is None:
+            preview = {
+                "id": self.id,
+                "type": self.type,
+                "title": self.title,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+            values = self.values
+            for key, position, project in _PROJECTORS.get(self.type, ()):
+                preview[key] = project(values[position])
+            self._preview = preview
+        return preview
+
+
+class Vault:
+    """
+    Decrypted vault: metadata (revision, change record) and entries in
+    order, indexed by id and by type.
+
+    Use put() and remove() to change entries. copy() is shallow over the
+    entries, so taking a copy to modify costs O(entries) dict slots, not a
+    deep copy of every entry.
+    """
+
+    __slots__ = ("meta", "_entries", "_by_type")
+
+    def __init__(self, meta: Optional[dict] = None, entries: Iterable[Entry] = ()):
+        self.meta = meta if meta is not None else {}
+        self._entries = {}
+        self._by_type = {}
+        for entry in entries:
+            self.put(entry)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Vault":
+        """Vault from the decrypted dict of vault_store.open_vault()."""
+        meta = {key: value for key, value in data.items() if key != "entries"}
+        return cls(meta, (Entry.from_dict(entry) for entry in data.get("entries", [])))
+
+    def to_dict(self) -> dict:
+        """Plain dict of the vault, as encrypted into the vault file."""
+        return {**self.meta, "entries": [entry.to_dict() for entry in self]}
+
+    @property
+    def revision(self) -> int:
+        return self.meta.get("revision", 0)
+
+    @revision.setter
+    def revision(self, revision: int):
+        self.meta["revision"] = revision
+
+    @property
+    def revision_tag(self) -> str:
+        """
+        "<revision>.<id>": the revision and the random id it was saved with,
+        so a re-created or replaced vault at the same revision tags differently.
+        Just the revision for vaults saved before ids were recorded.
+        """
+        revision_id = self.meta.get("revision_ids", {}).get(str(self.revision))
+        return f"{self.revision}.{revision_id}" if revision_id else str(self.revision)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Entry]:
+        return iter(self._entries.values())
+
+    def __contains__(self, entry_id: str) -> bool:
+        return entry_id in self._entries
+
+    def get(self, entry_id: str) -> Optional[Entry]:
+        """Entry by id, None if there is none."""
+        return self._entries.get(entry_id)
+
+    def count(self, entry_type: str) -> int:
+        """Number of entries of one type."""
+        return len(self._by_type.get(entry_type, ()))
+
+    def of_type(self, entry_type: str) -> list[Entry]:
+        """Entries of one type, in vault order."""
+        return list(self._by_type.get(entry_type, {}).values())
+
+    def put(self, entry: Entry):
+        """Add an entry, or replace the one with its id in place."""
+        previous = self._entries.get(entry.id)
+        if previous is not None and previous.type != entry.type:
+            del self._by_type[previous.type][entry.id]
+        self._entries[entry.id] = entry
+        self._by_type.setdefault(entry.type, {})[entry.id] = entry
+
+    def remove(self, entry_id: str) -> Optional[Entry]:
+        """Remove an entry by id; returns it, or None if there was none."""
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            del self._by_type[entry.type][entry_id]
+        return entry
+
+    def previews(self, entry_type: Optional[str] = None) -> list[dict]:
+        """Previews of every entry (or of one type), in vault order."""
+        if entry_type is None:
+            entries = self._entries.values()
+        else:
+            entries = self._by_type.get(entry_type, {}).values()
+        return [entry.preview() for entry in entries]
+
+    def copy(self) -> "Vault":
+        """Copy to modify; entries are shared, metadata dicts are copied."""
+        vault = Vault.__new__(Vault)
+        vault.meta = {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in self.meta.items()
+        }
+        vault._entries = dict(self._entries)
+        vault._by_type = {
+            entry_type: dict(entries) for entry_type, entries in self._by_type.items()
+        }
+        return vault
+
+    def changes_since(self, since_tag: str) -> Optional[tuple[list[Entry], list[str]]]:
+        """
+        Entries put and ids of entries deleted after the revision tagged
+        `since_tag`. Returns None if that revision is not one of this vault's
+        (another or re-created vault, or from the future) or the change record
+        does not reach back that far; reload everything then.
+        """
+        meta = self.meta
+        since, revision_id = parse_revision_tag(since_tag)
+        if revision_id != meta.get("revision_ids", {}).get(str(since), ""):
+            return None
+        revision = self.revision
+        if since == revision:
+            return [], []
+        if (
+            since > revision
+            or "entry_revisions" not in meta
+            or since < meta["changelog_floor"]
+        ):
+            return None
+
+        entries = [
+            self._entries[entry_id]
+            for entry_id, put_at in meta["entry_revisions"].items()
+            if put_at > since and entry_id in self._entries
+        ]
+        deleted = [
+            entry_id
+            for entry_id, deleted_at in meta["tombstones"].items()
+            if deleted_at > since
+        ]
+        return entries, deleted
@@ -0,0 +1,582 @@
+"""
+Vault storage for Secret Management System
+Keeps vault.enc as a snapshot plus an append-only journal of entry changes
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+from app.crypto_utils import (
+    VaultKey,
+    check_journal,
+    decrypt_vault_with_key,
+    decrypt_entry_from_file,
+    encrypt_vault_with_key,
+    get_snapshot_id,
+    get_vault_file_id,
+    journal_file_header,
+    open_journal,
+    read_snapshot_id,
+    read_vault_index,
+    scan_journal,
+    seal_journal_record,
+)
+from app.metrics import FILE_READ_SECONDS, FILE_WRITE_SECONDS
+from app.profiling import phase
+
+# "journal": entry changes are appended to <vault>.journal and folded into
+#            the snapshot by a background compaction
+# "snapshot": every change rewrites the whole vault file
+STORAGE_MODE = os.environ.get("VAULT_STORAGE_MODE", "journal")
+JOURNAL_MAX_BYTES = int(os.environ.get("JOURNAL_MAX_BYTES", str(1024 * 1024)))
+JOURNAL_MAX_RECORDS = int(os.environ.get("JOURNAL_MAX_RECORDS", "256"))
+# Deleted entry ids remembered for the entry change feed
+TOMBSTONE_LIMIT = int(os.environ.get("TOMBSTONE_LIMIT", "1000"))
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def journal_path(vault_path: str) -> str:
+    """Path of the journal next to a vault snapshot."""
+    return vault_path + JOURNAL_SUFFIX
+
+
+def lock_path(vault_path: str) -> str:
+    """Path of the advisory lock file next to a vault snapshot."""
+    return vault_path + ".lock"
+
+
+class VaultLock:
+    """
+    Re-entrant lock serializing vault writes across threads and processes.
+
+    Threads of one worker queue on an RLock; the thread holding it also
+    takes an exclusive flock() on the lock file so other gunicorn workers
+    wait as well. Nested acquisitions only take the file lock once.
+    Readers take a shared flock() on the same file (read_shared()).
+    """
+
+    def __init__(self, vault_path: str):
+        self.path = lock_path(vault_path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._owner = None
+
+    def _open(self) -> int:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = self._open()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except Exception:
+                self._lock.release()
+                raise
+        self._depth += 1
+        self._owner = threading.get_ident()
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+        self._lock.release()
+
+    @contextmanager
+    def read_shared(self):
+        """
+        Shared lock for reading: excludes writers of any worker, not other
+        readers. Free for the thread already holding the write lock.
+        """
+        if self._owner == threading.get_ident():
+            yield
+            return
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+
+        fd = self._open()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _vault_lock(vault_path: str) -> VaultLock:
+    with _locks_guard:
+        lock = _locks.get(vault_path)
+        if lock is None:
+            lock = _locks[vault_path] = VaultLock(vault_path)
+        return lock
+
+
+@contextmanager
+def vault_lock(vault_path: str):
+    """Hold the exclusive write lock of a vault for a read-modify-write."""
+    lock = _vault_lock(vault_path)
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def vault_read_lock(vault_path: str):
+    """
+    Hold the shared lock of a vault while reading its files, so no write
+    or compaction swaps the snapshot and journal in between.
+    """
+    return _vault_lock(vault_path).read_shared()
+
+
+def _file_signature(path: str) -> Optional[tuple[int, int, int]]:
+    """Return (inode, size, mtime_ns) for a file, or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def vault_signature(vault_path: str) -> Optional[tuple]:
+    """Signature of the snapshot and journal files, None if no vault exists."""
+    snapshot = _file_signature(vault_path)
+    if snapshot is None:
+        return None
+    return snapshot, _file_signature(journal_path(vault_path))
+
+
+def fsync_dir(path: str):
+    """Persist a rename in a directory (no-op where unsupported)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_file(path: str) -> Optional[bytes]:
+    """Read a whole file, or None if it does not exist."""
+    kind = "journal" if path.endswith(JOURNAL_SUFFIX) else "snapshot"
+    try:
+        with phase("read"), FILE_READ_SECONDS.time(file=kind), open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def read_vault_files(
+    vault_path: str,
+) -> tuple[Optional[tuple], Optional[bytes], Optional[bytes]]:
+    """
+    (signature, snapshot, journal) of a vault, read together under the
+    shared lock so they belong to each other. Snapshot is None if there is
+    no vault, journal None if there is no journal.
+    """
+    with vault_read_lock(vault_path):
+        return (
+            vault_signature(vault_path),
+            read_file(vault_path),
+            read_file(journal_path(vault_path)),
+        )
+
+
+def journal_changes(
+    journal: Optional[bytes], vault_key: VaultKey, snapshot_id: bytes
+) -> list[dict]:
+    """
+    Decrypt the journal changes written on top of a snapshot. Raises
+    JournalCorruptError if the journal is corrupt (see open_journal()).
+    """
+    if not snapshot_id or not journal:
+        return []
+
+    with phase("decrypt"):
+        return open_journal(journal, vault_key, snapshot_id)
+
+
+def read_journal(vault_path: str, vault_key: VaultKey, snapshot_id: bytes) -> list[dict]:
+    """Read and decrypt the journal of a snapshot (call under vault_lock)."""
+    if not snapshot_id:
+        return []
+    return journal_changes(read_file(journal_path(vault_path)), vault_key, snapshot_id)
+
+
+def record_changes(vault: dict, put_ids: set, deleted_ids: set, revision: int):
+    """
+    Note in the vault metadata at which revision entries were last put or
+    deleted, for the change feed. Only the newest TOMBSTONE_LIMIT deletions
+    are kept; "changelog_floor" is the oldest revision the feed can answer
+    from, so older clients have to reload the whole list.
+    """
+    if "entry_revisions" not in vault:
+        vault["entry_revisions"] = {}
+        vault["tombstones"] = {}
+        vault["changelog_floor"] = revision - 1
+
+    entry_revisions = vault["entry_revisions"]
+    tombstones = vault["tombstones"]
+    for entry_id in put_ids:
+        entry_revisions[entry_id] = revision
+        tombstones.pop(entry_id, None)
+    for entry_id in deleted_ids:
+        entry_revisions.pop(entry_id, None)
+        tombstones[entry_id] = revision
+
+    if len(tombstones) > TOMBSTONE_LIMIT:
+        by_revision = sorted(tombstones.items(), key=lambda item: item[1])
+        dropped = by_revision[: len(tombstones) - TOMBSTONE_LIMIT]
+        for entry_id, _ in dropped:
+            del tombstones[entry_id]
+        vault["changelog_floor"] = max(vault["changelog_floor"], dropped[-1][1])
+
+
+def record_revision(vault: dict, revision: int, revision_id: str):
+    """
+    Note the random id a revision was saved with, which tells it apart from
+    the same revision number of a re-created or replaced vault. Ids of the
+    newest TOMBSTONE_LIMIT revisions are kept; the change feed cannot answer
+    from a revision whose id was dropped, so "changelog_floor" follows.
+    """
+    revision_ids = vault.setdefault("revision_ids", {})
+    revision_ids[str(revision)] = revision_id
+
+    while len(revision_ids) > TOMBSTONE_LIMIT:
+        dropped = next(iter(revision_ids))
+        del revision_ids[dropped]
+        if "changelog_floor" in vault:
+            vault["changelog_floor"] = max(vault["changelog_floor"], int(dropped))
+
+
+def apply_changes(vault: dict, changes: list[dict]) -> set:
+    """
+    Replay journal changes over a vault in order, including the vault
+    revision each change was committed at.
+    Returns the ids of entries that were put (created or updated).
+    """
+    entries = {entry["id"]: entry for entry in vault.get("entries", [])}
+    changed = set()
+
+    for change in changes:
+        if change["op"] == "put":
+            entry = change["entry"]
+            entries[entry["id"]] = entry
+            changed.add(entry["id"])
+        elif change["op"] == "delete":
+            entries.pop(change["id"], None)
+            changed.discard(change["id"])
+
+        if "revision" in change:
+            vault["revision"] = change["revision"]
+            if "revision_id" in change:
+                record_revision(vault, change["revision"], change["revision_id"])
+            if change["op"] == "put":
+                record_changes(vault, {change["entry"]["id"]}, set(), change["revision"])
+            elif change["op"] == "delete":
+                record_changes(vault, set(), {change["id"]}, change["revision"])
+
+    vault["entries"] = list(entries.values())
+    return changed
+
+
+def open_vault(
+    encrypted_data: bytes, journal: Optional[bytes], vault_key: VaultKey
+) -> Optional[dict]:
+    """
+    Decrypt a snapshot and replay its journal, both as returned by
+    read_vault_files(). Returns None if decryption fails (wrong key or
+    corrupted data); raises JournalCorruptError if the journal is corrupt.
+    """
+    vault = decrypt_vault_with_key(encrypted_data, vault_key)
+    if vault is None:
+        return None
+
+    changes = journal_changes(journal, vault_key, get_snapshot_id(encrypted_data))
+    apply_changes(vault, changes)
+    return vault
+
+
+def read_entry(
+    fh, journal: Optional[bytes], vault_key: VaultKey, entry_id: str
+) -> Optional[dict]:
+    """
+    Read one entry of a v3 snapshot, taking the journal into account.
+    `fh` must be positioned right after the header (read_vault_head) and
+    `journal` read under the same vault_read_lock() as `fh` was opened.
+    Returns None if the entry does not exist; raises ValueError if the
+    vault cannot be decrypted with this key.
+    """
+    with phase("decrypt"):
+        index, snapshot_id = read_vault_index(fh, vault_key)
+    records_start = fh.tell()
+
+    for change in reversed(journal_changes(journal, vault_key, snapshot_id)):
+        if change["op"] == "put" and change["entry"]["id"] == entry_id:
+            return change["entry"]
+        if change["op"] == "delete" and change["id"] == entry_id:
+            return None
+
+    with phase("decrypt"):
+        return decrypt_entry_from_file(fh, vault_key, index, records_start, entry_id)
+
+
+def write_snapshot(vault_path: str, encrypted_data: bytes) -> Optional[tuple]:
+    """
+    Atomically write a full vault snapshot and drop the journal it
+    supersedes. A journal bound to the same snapshot (header-only rewrite
+    on password change) is kept. Returns the vault signature after the write.
+    """
+    with vault_lock(vault_path):
+        vault_dir = os.path.dirname(vault_path) or "."
+        os.makedirs(vault_dir, exist_ok=True)
+
+        # Write a temp file next to the vault, then swap it in: readers see
+        # either the old or the new snapshot, never a torn one
+        fd, tmp_path = tempfile.mkstemp(
+            dir=vault_dir, prefix="." + os.path.basename(vault_path) + "."
+        )
+        with phase("write"), FILE_WRITE_SECONDS.time(file="snapshot"):
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(encrypted_data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, vault_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            fsync_dir(vault_dir)
+
+        journal = read_file(journal_path(vault_path))
+        if journal is not None:
+            count, _ = scan_journal(journal, get_snapshot_id(encrypted_data))
+            if count == 0:
+                os.remove(journal_path(vault_path))
+
+        return vault_signature(vault_path)
+
+
+def save_snapshot(
+    vault_path: str, vault: dict, vault_key: VaultKey, changed: Optional[set] = None
+) -> Optional[tuple]:
+    """
+    Encrypt and write a full snapshot of `vault` (journal already applied).
+    Records of entries outside `changed` and untouched by the journal are
+    copied from the current snapshot. Returns the vault signature.
+    """
+    with vault_lock(vault_path):
+        previous = read_file(vault_path)
+        if previous is not None and changed is not None:
+            changes = read_journal(vault_path, vault_key, get_snapshot_id(previous))
+            changed = changed | {c["entry"]["id"] for c in changes if c["op"] == "put"}
+
+        with phase("encrypt"):
+            encrypted_data = encrypt_vault_with_key(vault, vault_key, previous, changed)
+        return write_snapshot(vault_path, encrypted_data)
+
+
+def append_changes(
+    vault_path: str, vault_key: VaultKey, changes: list[dict]
+) -> Optional[tuple[int, tuple]]:
+    """
+    Append encrypted changes to the journal of the current snapshot.
+    Write cost depends only on the size of the changes, not of the vault.
+    Returns (journal record count, vault signature), or None when the
+    snapshot cannot take a journal (journal mode off, v1/v2 file) and the
+    caller must write a full snapshot instead.
+    """
+    if STORAGE_MODE != "journal":
+        return None
+
+    with vault_lock(vault_path):
+        try:
+            with open(vault_path, "rb") as f:
+                snapshot_id = read_snapshot_id(f)
+        except FileNotFoundError:
+            return None
+        if not snapshot_id:
+            return None
+
+        path = journal_path(vault_path)
+        # Raises JournalCorruptError rather than append behind a corrupt record
+        count, valid_length = check_journal(read_file(path) or b"", vault_key, snapshot_id)
+
+        with phase("write"), FILE_WRITE_SECONDS.time(file="journal"), open(
+            path, "r+b" if os.path.exists(path) else "wb"
+        ) as f:
+            if valid_length == 0:
+                # Missing or left over from an older snapshot: start over
+                f.truncate(0)
+                f.write(journal_file_header(snapshot_id))
+            else:
+                # Drop a torn record from an interrupted append, including
+                # one whose length prefix made it to disk but not its data
+                f.seek(valid_length)
+                f.truncate()
+
+            for change in changes:
+                with phase("encrypt"):
+                    record = seal_journal_record(vault_key, snapshot_id, count, change)
+                f.write(record)
+                count += 1
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        return count, vault_signature(vault_path)
+
+
+def journal_has_changes(vault_path: str) -> bool:
+    """Check whether the journal holds changes not yet in the snapshot."""
+    journal = read_file(journal_path(vault_path))
+    if not journal:
+        return False
+
+    try:
+        with open(vault_path, "rb") as f:
+            snapshot_id = read_snapshot_id(f)
+    except (OSError, ValueError):
+        return False
+    return bool(snapshot_id) and scan_journal(journal, snapshot_id)[0] > 0
+
+
+def journal_needs_compaction(vault_path: str, records: int) -> bool:
+    """Check whether the journal has grown past its size or record limit."""
+    try:
+        size = os.path.getsize(journal_path(vault_path))
+    except OSError:
+        return False
+    return records >= JOURNAL_MAX_RECORDS or size >= JOURNAL_MAX_BYTES
+
+
+def compact(
+    vault_path: str,
+    vault_key: VaultKey,
+    on_compacted: Optional[Callable[[tuple, VaultKey, dict], None]] = None,
+) -> bool:
+    """
+    Fold the journal into a new snapshot.
+    Only entries touched by the journal are re-encrypted; the other records
+    are copied from the old snapshot. `on_compacted(signature, key, vault)`
+    runs while writes are still blocked, so it sees exactly what was written.
+    Returns False if there was nothing to fold or the key does not fit.
+    """
+    with vault_lock(vault_path):
+        encrypted_data = read_file(vault_path)
+        if encrypted_data is None:
+            return False
+
+        changes = read_journal(vault_path, vault_key, get_snapshot_id(encrypted_data))
+        if not changes:
+            return False
+
+        vault = decrypt_vault_with_key(encrypted_data, vault_key)
+        if vault is None:
+            return False
+
+        # The key may predate a password change, which rewrote the header
+        # but kept the journal: write the header the file has now
+        vault_key = vault_key.with_header(get_vault_file_id(encrypted_data))
+        changed = apply_changes(vault, changes)
+        signature = write_snapshot(
+            vault_path,
+            encrypt_vault_with_key(vault, vault_key, encrypted_data, changed),
+        )
+
+        if on_compacted is not None:
+            on_compacted(signature, vault_key, vault)
+        return True
+
+
+class Compactor:
+    """
+    Background worker that compacts the journal off the request path.
+
+    schedule() calls coalesce: while a compaction is pending or running,
+    further requests only update the key and lead to at most one more run.
+    The key is dropped once its compaction has started, so no session's
+    key outlives the request that scheduled it.
+    """
+
+    def __init__(
+        self,
+        vault_path: str,
+        on_compacted: Optional[Callable[[tuple, VaultKey, dict], None]] = None,
+    ):
+        self.vault_path = vault_path
+        self.on_compacted = on_compacted
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._pending = threading.Event()
+        self._vault_key = None
+        self._thread = None
+
+    def schedule(self, vault_key: VaultKey):
+        """Request a compaction with the given key."""
+        with self._lock:
+            self._vault_key = vault_key
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._pending.set()
+
+    def _take_key(self) -> Optional[VaultKey]:
+        with self._lock:
+            vault_key, self._vault_key = self._vault_key, None
+            return vault_key
+
+    def _compact(self, vault_key: VaultKey):
+        with self._compacting:
+            compact(self.vault_path, vault_key, self.on_compacted)
+
+    def flush(self):
+        """
+        Fold a pending journal now, in the calling thread (shutdown); waits
+        for a compaction already running.
+        """
+        vault_key = self._take_key()
+        if vault_key is not None:
+            self._compact(vault_key)
+        else:
+            with self._compacting:
+                pass
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            vault_key = self._take_key()
+            if vault_key is None:
+                continue  # Taken by flush()
+
+            try:
+                self._compact(vault_key)
+            except Exception as e:
+                print(f"[Vault Store] Error compacting journal: {e}")
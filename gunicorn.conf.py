@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for Secret Management System
+Runs the startup vault sync once in the master, before any worker is forked
+"""
+
+import os
+
+# Workers import the app themselves; preloading would import it (and start
+# a background sync) in the master before on_starting runs
+preload_app = False
+
+
+def on_starting(server):
+    """Clear metric files of the last run and sync the vault, once per server."""
+    from app.drive_sync import run_startup_sync
+    from app.metrics import REGISTRY
+
+    REGISTRY.clear_files()
+    run_startup_sync(os.environ.get("VAULT_FILE_PATH", "./vault.enc"))
+
+
+def child_exit(server, worker):
+    """Keep the counters of an exited worker and free its metric file."""
+    from app.metrics import REGISTRY
+
+    REGISTRY.archive_worker(worker.pid)
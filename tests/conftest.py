@@ -0,0 +1,97 @@
+"""
+Shared fixtures. The environment is set before the app modules are
+imported: cheap Argon2id parameters, and no configured sync backend
+(tests install a MemoryBackend instead). The Flask app serves a vault in
+the test's temporary directory, with empty caches.
+"""
+
+import os
+
+os.environ["ARGON2_TIME_COST"] = "2"
+os.environ["ARGON2_MEMORY_COST"] = "19456"
+os.environ["ARGON2_PARALLELISM"] = "1"
+os.environ["SYNC_BACKEND"] = "none"
+os.environ.pop("VAULT_STARTUP_SYNCED", None)
+
+import pytest
+
+import app.app as web
+from app.admission import AttemptThrottle
+from app.crypto_utils import create_vault_key
+from app.drive_sync import use_sync_backend
+from app.search import SearchIndex
+from app.sync_backends import MemoryBackend
+
+MASTER_PASSWORD = "correct horse battery staple"
+
+# Marks API calls from the dashboard: 401 instead of a redirect to the login page
+XHR = {"X-Requested-With": "XMLHttpRequest"}
+
+
+@pytest.fixture(scope="session")
+def vault_key():
+    return create_vault_key(MASTER_PASSWORD)
+
+
+@pytest.fixture
+def vault_path(tmp_path):
+    return str(tmp_path / "vault.enc")
+
+
+@pytest.fixture
+def client(vault_path, tmp_path, monkeypatch):
+    """Test client of the app, serving a vault at `vault_path`."""
+    monkeypatch.setattr(web, "VAULT_FILE", vault_path)
+    monkeypatch.setattr(web.session_keys, "directory", str(tmp_path / "sessions"))
+    monkeypatch.setattr(web.compactor, "vault_path", vault_path)
+    monkeypatch.setattr(web, "search_index", SearchIndex())
+    monkeypatch.setattr(
+        web,
+        "login_throttle",
+        AttemptThrottle(web.login_throttle.max_attempts, web.login_throttle.window),
+    )
+    web.key_cache.clear()
+    web.vault_cache.invalidate()
+    web.app.config["TESTING"] = True
+    return web.app.test_client()
+
+
+@pytest.fixture
+def logged_in(client):
+    """Client of a new vault, logged in with MASTER_PASSWORD."""
+    response = client.post(
+        "/api/setup",
+        json={"master_password": MASTER_PASSWORD, "confirm_password": MASTER_PASSWORD},
+    )
+    assert response.status_code == 200
+    return client
+
+
+def session_key(client):
+    """The vault key cached for the client's session."""
+    with client.session_transaction() as session:
+        return web.key_cache.get(session["key_handle"])
+
+
+@pytest.fixture
+def backend():
+    memory = MemoryBackend()
+    use_sync_backend(memory)
+    yield memory
+    use_sync_backend(None)
+
+
+
+def login_entry(entry_id: str, password: str = "") -> dict:
+    """A login entry in the API shape, every field present."""
+    return {
+        "id": entry_id,
+        "type": "login",
+        "title": f"Title {entry_id}",
+        "created_at": "2024-01-01T00:00:00",
+        "updated_at": "2024-01-01T00:00:00",
+        "url": "https://example.com",
+        "username": "user",
+        "password": password or f"secret-{entry_id}",
+        "notes": "",
+    }
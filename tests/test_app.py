@@ -0,0 +1,615 @@
+"""API routes, through the Flask test client."""
+
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import app.app as web
+import app.crypto_utils as crypto_utils
+from app.admission import AttemptThrottle, KdfExecutor
+from app.crypto_utils import KDF_MIN_MEMORY_COST, KdfParams, header_kdf_params, parse_vault_file
+
+from conftest import MASTER_PASSWORD, XHR
+
+
+def create_note(client, title: str = "note", **headers) -> dict:
+    response = client.post(
+        "/api/entries", json={"type": "note", "title": title}, headers={**XHR, **headers}
+    )
+    assert response.status_code == 200
+    return response.get_json()
+
+
+# ============== SESSIONS ==============
+
+
+def test_session_does_not_hold_the_master_password(logged_in):
+    response = logged_in.post("/api/login", json={"master_password": MASTER_PASSWORD})
+    assert response.status_code == 200
+
+    with logged_in.session_transaction() as session:
+        assert "master_password" not in session
+        assert MASTER_PASSWORD not in str(dict(session))
+
+
+def test_session_key_is_shared_by_workers(logged_in):
+    # Another worker: nothing in its key cache
+    web.key_cache.clear()
+
+    response = logged_in.get("/api/entries", headers=XHR)
+    assert response.status_code == 200
+
+
+def test_missing_session_key_requires_login(logged_in):
+    with logged_in.session_transaction() as session:
+        handle = session["key_handle"]
+    web.key_cache.clear()
+    web.session_keys.evict(handle)
+
+    response = logged_in.get("/api/entries", headers=XHR)
+    assert response.status_code == 401
+
+
+def test_logout_forgets_the_session_key(logged_in, tmp_path):
+    logged_in.post("/api/logout", headers=XHR)
+
+    assert list((tmp_path / "sessions").iterdir()) == []
+
+
+def test_password_change_elsewhere_requires_login(logged_in):
+    other = web.app.test_client()
+    response = other.post("/api/login", json={"master_password": MASTER_PASSWORD})
+    assert response.status_code == 200
+    response = other.post(
+        "/api/change-password",
+        json={
+            "current_password": MASTER_PASSWORD,
+            "new_password": "password2",
+            "confirm_password": "password2",
+        },
+        headers=XHR,
+    )
+    assert response.status_code == 200
+
+    assert logged_in.get("/api/entries", headers=XHR).status_code == 401
+    assert other.get("/api/entries", headers=XHR).status_code == 200
+
+
+# ============== REVISIONS ==============
+
+
+def test_every_write_bumps_the_revision(logged_in):
+    first = create_note(logged_in)
+    second = create_note(logged_in)
+
+    assert second["revision"] == first["revision"] + 1
+
+
+def test_stale_if_match_is_a_conflict(logged_in):
+    stale = create_note(logged_in)
+    saved = create_note(logged_in)
+    url = f"/api/entries/{saved['entry']['id']}"
+    headers = {**XHR, "If-Match": f'"{stale["revision_tag"]}"'}
+
+    response = logged_in.post("/api/entries", json={"type": "note", "title": "x"}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()["revision_tag"] == saved["revision_tag"]
+    assert logged_in.put(url, json={"title": "x"}, headers=headers).status_code == 409
+    assert logged_in.delete(url, headers=headers).status_code == 409
+
+    titles = [e["title"] for e in logged_in.get("/api/entries", headers=XHR).get_json()["entries"]]
+    assert titles == ["note", "note"]
+
+
+def test_current_if_match_is_saved(logged_in):
+    first = create_note(logged_in)
+
+    saved = create_note(logged_in, "second", **{"If-Match": f'"{first["revision_tag"]}"'})
+    assert saved["revision"] == first["revision"] + 1
+    create_note(logged_in, "third", **{"If-Match": "*"})
+
+
+# ============== SEARCH ==============
+
+
+def search(client, **params) -> dict:
+    response = client.get("/api/entries/search", query_string=params, headers=XHR)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def titles(entries: list) -> list[str]:
+    return [entry["title"] for entry in entries]
+
+
+def test_search_ranks_title_matches_first(logged_in):
+    logged_in.post(
+        "/api/entries",
+        json={"type": "login", "title": "Mail", "username": "github-bot", "password": "x"},
+        headers=XHR,
+    )
+    create_note(logged_in, "GitHub recovery codes")
+    create_note(logged_in, "Bank")
+
+    result = search(logged_in, q="github")
+    assert titles(result["entries"]) == ["GitHub recovery codes", "Mail"]
+    assert result["total"] == 2
+    assert "password" not in result["entries"][1]
+
+    assert titles(search(logged_in, q="github", type="login")["entries"]) == ["Mail"]
+
+
+def test_search_pages(logged_in):
+    for title in ("a1", "a2", "a3"):
+        create_note(logged_in, title)
+
+    first = search(logged_in, limit=2)
+    second = search(logged_in, limit=2, cursor=first["next_cursor"])
+
+    assert titles(first["entries"] + second["entries"]) == ["a1", "a2", "a3"]
+    assert second["next_cursor"] is None
+    assert first["total"] == 3
+
+
+def test_search_follows_writes(logged_in):
+    entry = create_note(logged_in, "old title")["entry"]
+    assert search(logged_in, q="old")["total"] == 1
+
+    logged_in.put(f"/api/entries/{entry['id']}", json={"title": "new title"}, headers=XHR)
+    assert search(logged_in, q="old")["total"] == 0
+    assert search(logged_in, q="new")["total"] == 1
+
+    logged_in.delete(f"/api/entries/{entry['id']}", headers=XHR)
+    assert search(logged_in, q="new")["total"] == 0
+
+
+def test_search_rejects_bad_parameters(logged_in):
+    response = logged_in.get("/api/entries/search?limit=x", headers=XHR)
+    assert response.status_code == 400
+    response = logged_in.get("/api/entries/search?type=nope", headers=XHR)
+    assert response.status_code == 400
+
+
+# ============== ETAG AND CHANGE FEED ==============
+
+
+def changes(client, since: str) -> dict:
+    response = client.get("/api/entries/changes", query_string={"since": since}, headers=XHR)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def recreate_vault(client):
+    """Replace the vault with a new one, as a restore or a re-setup would."""
+    os.remove(web.VAULT_FILE)
+    web.vault_cache.invalidate()
+    response = client.post(
+        "/api/setup",
+        json={"master_password": MASTER_PASSWORD, "confirm_password": MASTER_PASSWORD},
+    )
+    assert response.status_code == 200
+
+
+def test_unchanged_entry_list_is_not_modified(logged_in):
+    create_note(logged_in)
+    response = logged_in.get("/api/entries", headers=XHR)
+    etag = response.headers["ETag"]
+    assert etag == f'"{response.get_json()["revision_tag"]}"'
+
+    response = logged_in.get("/api/entries", headers={**XHR, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    create_note(logged_in)
+    response = logged_in.get("/api/entries", headers={**XHR, "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_change_feed_sends_only_changes(logged_in):
+    kept = create_note(logged_in, "kept")
+    gone = create_note(logged_in, "gone")["entry"]
+    since = logged_in.get("/api/entries", headers=XHR).get_json()["revision_tag"]
+
+    added = create_note(logged_in, "added")
+    logged_in.delete(f"/api/entries/{gone['id']}", headers=XHR)
+    result = changes(logged_in, since)
+
+    assert result["reset"] is False
+    assert titles(result["entries"]) == ["added"]
+    assert result["deleted"] == [gone["id"]]
+    assert result["revision"] == added["revision"] + 1
+    assert changes(logged_in, result["revision_tag"])["entries"] == []
+    assert kept["entry"]["id"] not in result["deleted"]
+
+
+def test_recreated_vault_at_the_same_revision_is_another_vault(logged_in):
+    create_note(logged_in, "old")
+    response = logged_in.get("/api/entries", headers=XHR)
+    etag, old_tag = response.headers["ETag"], response.get_json()["revision_tag"]
+
+    recreate_vault(logged_in)
+    new = create_note(logged_in, "new")
+    assert new["revision"] == int(old_tag.split(".")[0])
+
+    response = logged_in.get("/api/entries", headers={**XHR, "If-None-Match": etag})
+    assert response.status_code == 200
+    result = changes(logged_in, old_tag)
+    assert result["reset"] is True
+    assert titles(result["entries"]) == ["new"]
+    headers = {**XHR, "If-Match": f'"{old_tag}"'}
+    assert logged_in.delete(f"/api/entries/{new['entry']['id']}", headers=headers).status_code == 409
+
+
+def test_change_feed_resets_for_an_untagged_revision(logged_in):
+    revision = create_note(logged_in)["revision"]
+    create_note(logged_in)
+
+    assert changes(logged_in, str(revision))["reset"] is True
+    response = logged_in.get("/api/entries/changes?since=x", headers=XHR)
+    assert response.status_code == 400
+
+
+# ============== BATCH ==============
+
+
+def batch(client, operations: list):
+    return client.post("/api/entries/batch", json={"operations": operations}, headers=XHR)
+
+
+def entry_titles(client) -> list[str]:
+    return titles(client.get("/api/entries", headers=XHR).get_json()["entries"])
+
+
+def test_batch_is_saved_once(logged_in):
+    kept = create_note(logged_in, "kept")["entry"]
+    gone = create_note(logged_in, "gone")
+    operations = [
+        {"op": "create", "type": "note", "title": "one"},
+        {"op": "create", "type": "note", "title": "two"},
+        {"op": "update", "id": kept["id"], "title": "renamed"},
+        {"op": "delete", "id": gone["entry"]["id"]},
+    ]
+
+    response = batch(logged_in, operations)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [result["status"] for result in data["results"]] == [
+        "created",
+        "created",
+        "updated",
+        "deleted",
+    ]
+    assert data["revision"] == gone["revision"] + 1
+    assert sorted(entry_titles(logged_in)) == ["one", "renamed", "two"]
+
+    result = changes(logged_in, gone["revision_tag"])
+    assert sorted(titles(result["entries"])) == ["one", "renamed", "two"]
+    assert result["deleted"] == [gone["entry"]["id"]]
+
+
+def test_created_and_deleted_in_one_batch_is_not_in_the_feed(logged_in):
+    since = create_note(logged_in)["revision_tag"]
+    response = batch(logged_in, [{"op": "create", "type": "note", "title": "tmp"}])
+    created = response.get_json()["results"][0]["id"]
+    # Later operations see earlier ones
+    response = batch(
+        logged_in,
+        [
+            {"op": "create", "type": "note", "title": "brief"},
+            {"op": "update", "id": created, "title": "tmp2"},
+            {"op": "delete", "id": created},
+        ],
+    )
+    assert response.status_code == 200
+
+    result = changes(logged_in, since)
+    assert titles(result["entries"]) == ["brief"]
+    assert result["deleted"] == [created]
+
+
+def test_invalid_batch_saves_nothing(logged_in):
+    before = create_note(logged_in, "before")
+    operations = [
+        {"op": "create", "type": "note", "title": "never"},
+        {"op": "update", "id": "missing", "title": "x"},
+        {"op": "rename"},
+        {"op": "create", "type": "nope"},
+    ]
+
+    response = batch(logged_in, operations)
+    assert response.status_code == 400
+    results = response.get_json()["results"]
+    errors = {result["index"]: result["error"] for result in results if "error" in result}
+    assert sorted(errors) == [1, 2, 3]
+    assert errors[1] == "Entry not found"
+
+    assert entry_titles(logged_in) == ["before"]
+    assert changes(logged_in, before["revision_tag"])["entries"] == []
+
+
+def test_batch_size_is_checked(logged_in, monkeypatch):
+    monkeypatch.setattr(web, "MAX_BATCH_OPERATIONS", 2)
+
+    assert batch(logged_in, []).status_code == 400
+    operation = {"op": "create", "type": "note", "title": "x"}
+    assert batch(logged_in, [operation] * 3).status_code == 400
+    assert batch(logged_in, [operation] * 2).status_code == 200
+
+
+# ============== IMPORT / EXPORT ==============
+
+
+def import_file(client, content: str, file_format: str, **headers):
+    return client.post(
+        "/api/import",
+        data={"format": file_format, "file": (io.BytesIO(content.encode("utf-8")), "export")},
+        headers={**XHR, **headers},
+    )
+
+
+def add_login(client, title: str, password: str):
+    response = client.post(
+        "/api/entries",
+        json={"type": "login", "title": title, "url": "https://example.com", "password": password},
+        headers=XHR,
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("file_format", ["json", "csv"])
+def test_export_imports_back(logged_in, file_format):
+    add_login(logged_in, "Mail", "hunter2")
+    create_note(logged_in, "Recovery codes")
+
+    response = logged_in.get(f"/api/export?format={file_format}", headers=XHR)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "attachment" in response.headers["Content-Disposition"]
+    exported = response.get_data(as_text=True)
+    if file_format == "json":
+        assert len(json.loads(exported)["entries"]) == 2
+
+    recreate_vault(logged_in)
+    response = import_file(logged_in, exported, file_format)
+    assert response.status_code == 200
+    assert response.get_json()["imported"] == 2
+
+    entries = logged_in.get("/api/entries", headers=XHR).get_json()["entries"]
+    assert sorted(titles(entries)) == ["Mail", "Recovery codes"]
+    (login,) = [entry for entry in entries if entry["type"] == "login"]
+    response = logged_in.get(f"/api/entries/{login['id']}", headers=XHR)
+    assert response.get_json()["entry"]["password"] == "hunter2"
+
+
+def test_import_skips_duplicates(logged_in):
+    add_login(logged_in, "Mail", "hunter2")
+    content = (
+        "type,name,login_uri,login_username,login_password,notes\n"
+        "login,Mail,https://example.com,me,other,\n"
+        "login,Bank,https://bank.example,me,secret,\n"
+        "login,Bank,https://bank.example,me,secret,\n"
+        "note,Codes,,,,1234\n"
+    )
+
+    response = import_file(logged_in, content, "bitwarden-csv")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data["imported"], data["duplicates"]) == (2, 2)
+    assert sorted(entry_titles(logged_in)) == ["Bank", "Codes", "Mail"]
+
+
+def test_malformed_import_saves_nothing(logged_in):
+    before = create_note(logged_in, "before")
+    content = '{"entries": [{"type": "note", "title": "half"}, '
+
+    response = import_file(logged_in, content, "json")
+    assert response.status_code == 400
+    assert entry_titles(logged_in) == ["before"]
+    assert changes(logged_in, before["revision_tag"])["entries"] == []
+
+
+def test_import_and_export_check_their_parameters(logged_in):
+    assert import_file(logged_in, "", "lastpass").status_code == 400
+    response = logged_in.post("/api/import", data={"format": "json"}, headers=XHR)
+    assert response.status_code == 400
+    assert logged_in.get("/api/export?format=xml", headers=XHR).status_code == 400
+
+    stale = create_note(logged_in)["revision_tag"]
+    create_note(logged_in)
+    response = import_file(logged_in, '{"entries": []}', "json", **{"If-Match": f'"{stale}"'})
+    assert response.status_code == 409
+
+
+# ============== MASTER PASSWORD ==============
+
+
+def login(client, password: str):
+    return client.post("/api/login", json={"master_password": password})
+
+
+def change_password(client, current: str, new: str, confirm: str = None):
+    return client.post(
+        "/api/change-password",
+        json={
+            "current_password": current,
+            "new_password": new,
+            "confirm_password": new if confirm is None else confirm,
+        },
+        headers=XHR,
+    )
+
+
+def vault_header() -> bytes:
+    with open(web.VAULT_FILE, "rb") as f:
+        return parse_vault_file(f.read())[1]
+
+
+def test_change_password_rewraps_the_data_key(logged_in):
+    create_note(logged_in, "kept")
+    with open(web.VAULT_FILE, "rb") as f:
+        before = f.read()
+
+    assert change_password(logged_in, "wrong password", "password2").status_code == 401
+    assert change_password(logged_in, MASTER_PASSWORD, "password2", "password3").status_code == 400
+    assert change_password(logged_in, MASTER_PASSWORD, "short").status_code == 400
+    assert change_password(logged_in, MASTER_PASSWORD, "password2").status_code == 200
+
+    with open(web.VAULT_FILE, "rb") as f:
+        after = f.read()
+    # Only the header changed
+    assert after[-100:] == before[-100:]
+    assert entry_titles(logged_in) == ["kept"]
+
+    logged_in.post("/api/logout", headers=XHR)
+    assert login(logged_in, MASTER_PASSWORD).status_code == 401
+    assert login(logged_in, "password2").status_code == 200
+    assert entry_titles(logged_in) == ["kept"]
+
+
+def test_login_rewraps_with_this_hosts_kdf_parameters(logged_in, monkeypatch):
+    create_note(logged_in, "kept")
+    calibrated = KdfParams(3, KDF_MIN_MEMORY_COST, 1)
+    assert header_kdf_params(vault_header()) != calibrated
+    monkeypatch.setattr(crypto_utils, "KDF_PARAMS", calibrated)
+
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+
+    assert header_kdf_params(vault_header()) == calibrated
+    assert entry_titles(logged_in) == ["kept"]
+    logged_in.post("/api/logout", headers=XHR)
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+
+
+def test_login_rewraps_only_after_the_startup_sync(logged_in, monkeypatch):
+    header = vault_header()
+    monkeypatch.setattr(crypto_utils, "KDF_PARAMS", KdfParams(3, KDF_MIN_MEMORY_COST, 1))
+    monkeypatch.setattr(web, "startup_sync_done", lambda: False)
+
+    # Logging in only reads the vault, so it works while syncing
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+    assert vault_header() == header
+
+    monkeypatch.setattr(web, "startup_sync_done", lambda: True)
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+    assert vault_header() != header
+
+
+# ============== ADMISSION ==============
+
+
+@pytest.fixture
+def throttle(monkeypatch):
+    """Three failed logins per client allowed."""
+    throttle = AttemptThrottle(max_attempts=3, window=60)
+    monkeypatch.setattr(web, "login_throttle", throttle)
+    return throttle
+
+
+@pytest.fixture
+def behind_proxy(monkeypatch):
+    """App behind one reverse proxy, as with TRUSTED_PROXIES=1."""
+    monkeypatch.setattr(web, "TRUSTED_PROXIES", 1)
+    monkeypatch.setattr(web.app, "wsgi_app", ProxyFix(web.app.wsgi_app, x_for=1))
+
+
+def login_from(client, address: str, password: str):
+    return client.post(
+        "/api/login",
+        json={"master_password": password},
+        headers={"X-Forwarded-For": address},
+    )
+
+
+def test_failed_logins_are_throttled(logged_in, throttle):
+    for _ in range(3):
+        assert login(logged_in, "wrong password").status_code == 401
+
+    response = login(logged_in, MASTER_PASSWORD)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert change_password(logged_in, MASTER_PASSWORD, "password2").status_code == 429
+
+
+def test_successful_login_clears_failures(logged_in, throttle):
+    for _ in range(2):
+        login(logged_in, "wrong password")
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+
+    for _ in range(2):
+        login(logged_in, "wrong password")
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+
+
+def test_throttle_keys_on_the_forwarded_client(logged_in, throttle, behind_proxy):
+    for _ in range(3):
+        assert login_from(logged_in, "203.0.113.1", "wrong password").status_code == 401
+
+    assert login_from(logged_in, "203.0.113.1", MASTER_PASSWORD).status_code == 429
+    assert login_from(logged_in, "203.0.113.2", MASTER_PASSWORD).status_code == 200
+
+
+def test_forwarded_address_is_ignored_without_trusted_proxies(
+    logged_in, throttle, monkeypatch, capsys
+):
+    monkeypatch.setattr(web, "_proxy_warning_shown", False)
+    for _ in range(3):
+        login_from(logged_in, "203.0.113.1", "wrong password")
+
+    # A spoofed header does not get a fresh budget
+    assert login_from(logged_in, "203.0.113.2", MASTER_PASSWORD).status_code == 429
+    assert capsys.readouterr().out.count("TRUSTED_PROXIES is 0") == 1
+
+
+def test_busy_kdf_executor_answers_503(logged_in, monkeypatch):
+    executor = KdfExecutor(max_in_flight=1, max_queue=0)
+    monkeypatch.setattr(web, "kdf_executor", executor)
+    release = threading.Event()
+    busy = threading.Thread(target=executor.run, args=(release.wait,))
+    busy.start()
+    try:
+        while executor.status()["in_flight"] == 0:
+            release.wait(0.01)
+
+        response = login(logged_in, MASTER_PASSWORD)
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) > 0
+    finally:
+        release.set()
+        busy.join()
+
+    assert login(logged_in, MASTER_PASSWORD).status_code == 200
+
+
+# ============== METRICS ==============
+
+
+def scrape(client, remote_addr: str = "127.0.0.1", **headers):
+    return client.get("/metrics", headers=headers, environ_base={"REMOTE_ADDR": remote_addr})
+
+
+def test_metrics_without_token_are_local_only(client, monkeypatch):
+    monkeypatch.setattr(web, "METRICS_TOKEN", "")
+
+    response = scrape(client)
+    assert response.status_code == 200
+    assert response.content_type == web.CONTENT_TYPE
+    assert scrape(client, "203.0.113.5").status_code == 403
+
+
+def test_metrics_of_a_proxied_client_are_not_local(client, monkeypatch, behind_proxy):
+    monkeypatch.setattr(web, "METRICS_TOKEN", "")
+
+    response = scrape(client, **{"X-Forwarded-For": "203.0.113.5"})
+    assert response.status_code == 403
+
+
+def test_metrics_need_the_token(client, monkeypatch):
+    monkeypatch.setattr(web, "METRICS_TOKEN", "s3cret")
+
+    assert scrape(client).status_code == 401
+    assert scrape(client, Authorization="Bearer wrong").status_code == 401
+    assert scrape(client, "203.0.113.5", Authorization="Bearer s3cret").status_code == 200
@@ -0,0 +1,82 @@
+"""Production assets: the build step and serving its output."""
+
+import gzip
+import os
+import re
+
+import pytest
+from flask import Flask, render_template, url_for
+
+import app.app as web
+from app.assets import build_assets, use_built_assets
+
+
+def source(name: str) -> bytes:
+    with open(os.path.join(web.app.static_folder, name), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def built_app(tmp_path):
+    """App with the project's static files and templates, serving their build."""
+    app = Flask(web.app.import_name, root_path=web.app.root_path)
+    app.add_url_rule("/", view_func=lambda: render_template("index.html", vault_exists=True))
+    build_dir = str(tmp_path / "build")
+    manifest = build_assets(app, build_dir)
+    assert use_built_assets(app, build_dir) is True
+    return app, manifest
+
+
+def test_build_fingerprints_and_compresses(built_app, tmp_path):
+    _, manifest = built_app
+
+    built = manifest["assets"]["js/index.js"]
+    assert re.fullmatch(r"js/index\.[0-9a-f]{12}\.js", built)
+    assert "gzip" in manifest["encodings"][built]
+    with open(tmp_path / "build" / "static" / (built + ".gz"), "rb") as f:
+        assert gzip.decompress(f.read()) == source("js/index.js")
+    assert os.listdir(tmp_path / "build" / "templates")
+    assert not os.path.exists(tmp_path / "build.tmp")
+
+
+def test_pages_link_to_built_assets(built_app):
+    app, manifest = built_app
+
+    page = app.test_client().get("/").get_data(as_text=True)
+    assert f'/static/{manifest["assets"]["js/index.js"]}' in page
+    assert f'/static/{manifest["assets"]["css/index.css"]}' in page
+    assert "/static/js/index.js" not in page
+
+
+def test_built_assets_are_sent_precompressed_and_immutable(built_app):
+    app, manifest = built_app
+    client = app.test_client()
+    url = f'/static/{manifest["assets"]["js/index.js"]}'
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/javascript"
+    assert gzip.decompress(response.get_data()) == source("js/index.js")
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    assert "Accept-Encoding" in response.vary
+
+    response = client.get(url)
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == source("js/index.js")
+
+
+def test_unbuilt_names_fall_back_to_the_sources(built_app):
+    app, _ = built_app
+
+    response = app.test_client().get("/static/js/index.js")
+    assert response.status_code == 200
+    assert response.get_data() == source("js/index.js")
+
+
+def test_without_a_build_sources_are_served(tmp_path):
+    app = Flask(web.app.import_name, root_path=web.app.root_path)
+
+    assert use_built_assets(app, str(tmp_path / "missing")) is False
+    with app.test_request_context():
+        assert url_for("static", filename="js/index.js") == "/static/js/index.js"
@@ -0,0 +1,59 @@
+"""Session keys shared by the workers."""
+
+import os
+import time
+
+from app.cache import SessionKeyStore
+from app.crypto_utils import VaultKey
+
+
+def test_session_key_round_trip(tmp_path, vault_key):
+    store = SessionKeyStore(str(tmp_path), ttl=60)
+    handle, secret = "a" * 43, store.new_secret()
+    store.put(handle, secret, vault_key)
+
+    assert store.get(handle, secret) == vault_key
+    (path,) = tmp_path.iterdir()
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert vault_key.data_key not in path.read_bytes()
+
+
+def test_session_key_keeps_legacy_fields(tmp_path):
+    store = SessionKeyStore(str(tmp_path), ttl=60)
+    vault_key = VaultKey(b"k" * 32, b"header", legacy_salt=b"s" * 16, legacy_key=b"l" * 32)
+    secret = store.new_secret()
+    store.put("a" * 43, secret, vault_key)
+
+    assert store.get("a" * 43, secret) == vault_key
+
+
+def test_session_key_needs_the_cookie_secret(tmp_path, vault_key):
+    store = SessionKeyStore(str(tmp_path), ttl=60)
+    store.put("a" * 43, store.new_secret(), vault_key)
+
+    assert store.get("a" * 43, store.new_secret()) is None
+    assert store.get("a" * 43, "") is None
+    assert store.get("b" * 43, store.new_secret()) is None
+    assert store.get("../" + "a" * 43, store.new_secret()) is None
+
+
+def test_session_key_expires(tmp_path, vault_key):
+    store = SessionKeyStore(str(tmp_path), ttl=60)
+    secret = store.new_secret()
+    store.put("a" * 43, secret, vault_key)
+    old = time.time() - 61
+    os.utime(tmp_path / ("a" * 43), (old, old))
+
+    assert store.get("a" * 43, secret) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_put_prunes_expired_keys(tmp_path, vault_key):
+    store = SessionKeyStore(str(tmp_path), ttl=60)
+    store.put("a" * 43, store.new_secret(), vault_key)
+    old = time.time() - 61
+    os.utime(tmp_path / ("a" * 43), (old, old))
+
+    store.put("b" * 43, store.new_secret(), vault_key)
+
+    assert [path.name for path in tmp_path.iterdir()] == ["b" * 43]
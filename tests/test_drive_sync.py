@@ -0,0 +1,267 @@
+"""Checksum-based startup sync and the background uploader, against the in-memory backend."""
+
+import glob
+import os
+import time
+
+import pytest
+
+from app.crypto_utils import encrypt_vault_with_key
+from app.drive_sync import (
+    VAULT_FILENAME,
+    UploadQueue,
+    read_sync_state,
+    sync_on_startup,
+    upload_vault,
+    use_sync_backend,
+    write_sync_state,
+)
+from app.sync_backends import MemoryBackend, file_md5
+from app.vault_store import append_changes, save_snapshot
+
+
+class FlakyBackend(MemoryBackend):
+    """MemoryBackend whose first `failures` uploads raise."""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def put(self, name, local_path):
+        if self.failures > 0:
+            self.failures -= 1
+            self.calls.append("put-failed")
+            raise ConnectionError("backend unavailable")
+        return super().put(name, local_path)
+
+
+class BrokenBackend(MemoryBackend):
+    """MemoryBackend that cannot even list its files."""
+
+    def list(self):
+        raise ConnectionError("backend unavailable")
+
+
+def vault_file(vault_key, revision: int) -> bytes:
+    return encrypt_vault_with_key({"revision": revision, "entries": []}, vault_key)
+
+
+def write_local(path: str, content: bytes, mtime: float = None):
+    with open(path, "wb") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def read_local(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def install_backend():
+    """Sync against a given backend for the rest of the test."""
+    yield use_sync_backend
+    use_sync_backend(None)
+
+
+@pytest.fixture
+def uploads():
+    """Stand-in for the background uploader, recording what was queued."""
+    return []
+
+
+# ============== STARTUP SYNC ==============
+
+
+def test_fresh_install(vault_path, backend, uploads):
+    assert sync_on_startup(vault_path, upload=uploads.append) is False
+    assert not os.path.exists(vault_path)
+    assert uploads == []
+
+
+def test_no_local_vault_downloads(vault_path, vault_key, backend, uploads):
+    remote = vault_file(vault_key, 1)
+    backend.store(VAULT_FILENAME, remote)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert read_local(vault_path) == remote
+    assert read_sync_state(vault_path)["checksum"] == file_md5(vault_path)
+    assert uploads == []
+
+
+def test_no_remote_vault_uploads(vault_path, vault_key, backend, uploads):
+    write_local(vault_path, vault_file(vault_key, 1))
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert uploads == [vault_path]
+
+
+def test_same_checksum_does_nothing(vault_path, vault_key, backend, uploads):
+    content = vault_file(vault_key, 1)
+    write_local(vault_path, content)
+    backend.store(VAULT_FILENAME, content)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert uploads == []
+    assert backend.calls == ["list"]
+    # Remembered, so the next upload of the same content is skipped
+    assert read_sync_state(vault_path)["checksum"] == file_md5(vault_path)
+
+
+def test_same_checksum_with_pending_journal_uploads(vault_path, vault_key, backend, uploads):
+    save_snapshot(vault_path, {"revision": 1, "entries": []}, vault_key)
+    backend.store(VAULT_FILENAME, read_local(vault_path))
+    write_sync_state(vault_path, {"checksum": file_md5(vault_path)})
+    append_changes(vault_path, vault_key, [{"op": "delete", "id": "gone", "revision": 2}])
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert uploads == [vault_path]
+
+
+def test_only_local_changed_uploads(vault_path, vault_key, backend, uploads):
+    synced = backend.store(VAULT_FILENAME, vault_file(vault_key, 1))
+    write_sync_state(vault_path, synced)
+    # Older than the remote copy, but the remote one has not changed since the sync
+    write_local(vault_path, vault_file(vault_key, 2), mtime=time.time() - 3600)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert uploads == [vault_path]
+    assert "get" not in backend.calls
+
+
+def test_only_remote_changed_downloads(vault_path, vault_key, backend, uploads):
+    write_local(vault_path, vault_file(vault_key, 1))
+    write_sync_state(vault_path, {"checksum": file_md5(vault_path)})
+    remote = vault_file(vault_key, 2)
+    # Older than the local file, but the local one has not changed since the sync
+    backend.store(VAULT_FILENAME, remote, modified_time=time.time() - 3600)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert read_local(vault_path) == remote
+    assert glob.glob(vault_path + ".conflict-*") == []
+    assert uploads == []
+
+
+def test_both_changed_local_newer_uploads(vault_path, vault_key, backend, uploads):
+    local = vault_file(vault_key, 2)
+    write_local(vault_path, local)
+    backend.store(VAULT_FILENAME, vault_file(vault_key, 1), modified_time=time.time() - 3600)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert uploads == [vault_path]
+    assert read_local(vault_path) == local
+
+
+def test_both_changed_remote_newer_downloads_and_keeps_local(
+    vault_path, vault_key, backend, uploads
+):
+    local = vault_file(vault_key, 1)
+    write_local(vault_path, local, mtime=time.time() - 3600)
+    remote = vault_file(vault_key, 2)
+    backend.store(VAULT_FILENAME, remote)
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert read_local(vault_path) == remote
+    (conflict,) = glob.glob(vault_path + ".conflict-*")
+    assert read_local(conflict) == local
+    assert uploads == []
+
+
+def test_bad_download_keeps_local(vault_path, vault_key, backend, uploads):
+    local = vault_file(vault_key, 1)
+    write_local(vault_path, local, mtime=time.time() - 3600)
+    backend.store(VAULT_FILENAME, b"not a vault file")
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert read_local(vault_path) == local
+    assert glob.glob(vault_path + ".conflict-*") == []
+    assert os.listdir(os.path.dirname(vault_path)) == ["vault.enc"]
+
+
+def test_backend_failure_uses_local(vault_path, vault_key, install_backend, uploads):
+    local = vault_file(vault_key, 1)
+    write_local(vault_path, local)
+    install_backend(BrokenBackend())
+
+    assert sync_on_startup(vault_path, upload=uploads.append) is True
+    assert read_local(vault_path) == local
+    assert uploads == []
+
+
+# ============== CONDITIONAL UPLOADS ==============
+
+
+def test_upload_skipped_when_unchanged(vault_path, vault_key, backend):
+    write_local(vault_path, vault_file(vault_key, 1))
+
+    assert upload_vault(vault_path) is True
+    assert upload_vault(vault_path) is True
+    assert backend.calls == ["put"]
+    assert backend.content(VAULT_FILENAME) == read_local(vault_path)
+
+
+def test_queue_coalesces_saves(vault_path):
+    uploaded = []
+    queue = UploadQueue(lambda path: uploaded.append(path) or True, debounce=0.05)
+    for _ in range(5):
+        queue.request(vault_path)
+
+    assert wait_for(lambda: uploaded)
+    time.sleep(0.1)
+    assert uploaded == [vault_path]
+    assert queue.status()["queue_depth"] == 0
+
+
+def test_queue_retries_failed_uploads(vault_path, vault_key, install_backend):
+    flaky = FlakyBackend(failures=2)
+    install_backend(flaky)
+    write_local(vault_path, vault_file(vault_key, 1))
+    queue = UploadQueue(upload_vault, debounce=0, retry_base=0.01, retry_max=0.05)
+    queue.request(vault_path)
+
+    assert wait_for(lambda: flaky.content(VAULT_FILENAME) == read_local(vault_path))
+
+    assert flaky.calls == ["put-failed", "put-failed", "put"]
+    assert wait_for(lambda: queue.status()["consecutive_failures"] == 0)
+    assert queue.status()["last_success"] is not None
+
+
+def test_retry_uploads_latest_save(vault_path, vault_key, install_backend):
+    flaky = FlakyBackend(failures=1)
+    install_backend(flaky)
+    write_local(vault_path, vault_file(vault_key, 1))
+    queue = UploadQueue(upload_vault, debounce=0, retry_base=0.2, retry_max=0.2)
+    queue.request(vault_path)
+    assert wait_for(lambda: "put-failed" in flaky.calls)
+
+    # Saved again while waiting to retry: one upload of the newest file
+    latest = vault_file(vault_key, 2)
+    write_local(vault_path, latest)
+    queue.request(vault_path)
+
+    assert wait_for(lambda: flaky.content(VAULT_FILENAME) == latest)
+
+    assert flaky.calls == ["put-failed", "put"]
+
+
+def test_flush_gives_up_after_a_failed_attempt(vault_path, vault_key, install_backend):
+    install_backend(FlakyBackend(failures=100))
+    write_local(vault_path, vault_file(vault_key, 1))
+    queue = UploadQueue(upload_vault, debounce=60, retry_base=60)
+    queue.request(vault_path)
+
+    assert queue.flush(timeout=5) is False
+
+    # The save stays queued for the next attempt
+    assert queue.status()["queue_depth"] == 1
+    assert queue.status()["consecutive_failures"] == 1
@@ -0,0 +1,233 @@
+"""Journal replay and compaction."""
+
+import os
+import time
+
+import pytest
+
+import app.app as web
+import app.vault_store as vault_store
+from app.crypto_utils import (
+    JOURNAL_LEN_SIZE,
+    NONCE_SIZE,
+    JournalCorruptError,
+    create_vault_key,
+    get_snapshot_id,
+    journal_file_header,
+    read_vault_head,
+    replace_vault_header,
+    rewrap_vault_key,
+    unlock_vault_key,
+)
+from app.vault_store import (
+    Compactor,
+    append_changes,
+    compact,
+    journal_path,
+    open_vault,
+    read_entry,
+    read_file,
+    read_vault_files,
+    record_changes,
+    record_revision,
+    save_snapshot,
+    vault_read_lock,
+    write_snapshot,
+)
+
+from conftest import MASTER_PASSWORD, XHR, login_entry, session_key
+
+
+def put(entry: dict, revision: int) -> dict:
+    return {"op": "put", "entry": entry, "revision": revision, "revision_id": f"id{revision}"}
+
+
+def delete(entry_id: str, revision: int) -> dict:
+    return {"op": "delete", "id": entry_id, "revision": revision, "revision_id": f"id{revision}"}
+
+
+def load(vault_path: str, vault_key) -> dict:
+    _, snapshot, journal = read_vault_files(vault_path)
+    return open_vault(snapshot, journal, vault_key)
+
+
+def entries_by_id(vault: dict) -> dict:
+    return {entry["id"]: entry for entry in vault["entries"]}
+
+
+def read_journal_file(vault_path: str) -> bytes:
+    with open(journal_path(vault_path), "rb") as f:
+        return f.read()
+
+
+def write_journal_file(vault_path: str, data: bytes):
+    with open(journal_path(vault_path), "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def vault_with_journal(vault_path, vault_key):
+    """Snapshot with entries a and b, then a journal of three changes."""
+    vault = {"revision": 1, "entries": [login_entry("a"), login_entry("b")]}
+    save_snapshot(vault_path, vault, vault_key)
+    append_changes(vault_path, vault_key, [put(login_entry("c"), 2)])
+    append_changes(vault_path, vault_key, [put(login_entry("a", "changed"), 3)])
+    append_changes(vault_path, vault_key, [delete("b", 4)])
+    return vault_path
+
+
+# ============== JOURNAL REPLAY ==============
+
+
+def test_replay_applies_changes_in_order(vault_with_journal, vault_key):
+    vault = load(vault_with_journal, vault_key)
+
+    entries = entries_by_id(vault)
+    assert sorted(entries) == ["a", "c"]
+    assert entries["a"]["password"] == "changed"
+    assert entries["c"] == login_entry("c")
+    assert vault["revision"] == 4
+    assert vault["entry_revisions"] == {"a": 3, "c": 2}
+    assert vault["tombstones"] == {"b": 4}
+    assert vault["revision_ids"] == {"2": "id2", "3": "id3", "4": "id4"}
+
+
+def test_revision_ids_are_bounded(monkeypatch):
+    monkeypatch.setattr(vault_store, "TOMBSTONE_LIMIT", 2)
+    vault = {"revision": 0, "entries": []}
+    record_changes(vault, {"a"}, set(), 1)
+    for revision in (1, 2, 3):
+        record_revision(vault, revision, f"id{revision}")
+
+    assert vault["revision_ids"] == {"2": "id2", "3": "id3"}
+    # Revision 1 can no longer be told apart from another vault's
+    assert vault["changelog_floor"] == 1
+
+
+def test_read_entry_sees_journal(vault_with_journal, vault_key):
+    def read(entry_id):
+        with vault_read_lock(vault_with_journal):
+            journal = read_journal_file(vault_with_journal)
+            with open(vault_with_journal, "rb") as f:
+                read_vault_head(f)
+                return read_entry(f, journal, vault_key, entry_id)
+
+    assert read("a")["password"] == "changed"
+    assert read("b") is None
+    assert read("c") == login_entry("c")
+    assert read("missing") is None
+
+
+def test_compact_folds_journal(vault_with_journal, vault_key):
+    before = load(vault_with_journal, vault_key)
+
+    assert compact(vault_with_journal, vault_key) is True
+    assert not os.path.exists(journal_path(vault_with_journal))
+    assert load(vault_with_journal, vault_key) == before
+    assert compact(vault_with_journal, vault_key) is False
+
+
+def test_journal_of_older_snapshot_is_ignored(vault_with_journal, vault_key):
+    stale = read_journal_file(vault_with_journal)
+    save_snapshot(vault_with_journal, {"revision": 5, "entries": []}, vault_key)
+    write_journal_file(vault_with_journal, stale)
+
+    assert load(vault_with_journal, vault_key)["entries"] == []
+
+    # The next append starts the journal over
+    assert append_changes(vault_with_journal, vault_key, [put(login_entry("d"), 6)])[0] == 1
+    assert sorted(entries_by_id(load(vault_with_journal, vault_key))) == ["d"]
+
+
+@pytest.mark.parametrize("damage", ["cut", "flip"])
+def test_torn_last_record_is_skipped_and_truncated(vault_with_journal, vault_key, damage):
+    data = read_journal_file(vault_with_journal)
+    if damage == "cut":
+        # Length prefix written, record data only partly
+        data = data[:-5]
+    else:
+        data = data[:-5] + bytes([data[-5] ^ 0xFF]) + data[-4:]
+    write_journal_file(vault_with_journal, data)
+
+    # The delete of b was torn
+    assert sorted(entries_by_id(load(vault_with_journal, vault_key))) == ["a", "b", "c"]
+
+    count, _ = append_changes(vault_with_journal, vault_key, [delete("c", 4)])
+    assert count == 3
+    assert sorted(entries_by_id(load(vault_with_journal, vault_key))) == ["a", "b"]
+
+
+def test_corrupt_record_before_the_last_fails_loudly(vault_with_journal, vault_key):
+    _, snapshot, journal = read_vault_files(vault_with_journal)
+    data = bytearray(journal)
+    first_record = len(journal_file_header(get_snapshot_id(snapshot))) + JOURNAL_LEN_SIZE
+    data[first_record + NONCE_SIZE] ^= 0xFF
+    write_journal_file(vault_with_journal, bytes(data))
+
+    with pytest.raises(JournalCorruptError):
+        load(vault_with_journal, vault_key)
+    with pytest.raises(JournalCorruptError):
+        append_changes(vault_with_journal, vault_key, [delete("c", 5)])
+    assert read_journal_file(vault_with_journal) == bytes(data)
+
+
+def test_wrong_key_does_not_open(vault_with_journal):
+    assert load(vault_with_journal, create_vault_key("another password")) is None
+
+
+# ============== PASSWORD CHANGES ==============
+
+
+def change_password(vault_path: str, vault_key, new_password: str):
+    """Re-wrap the data key in the header, as /api/change-password does."""
+    new_key = rewrap_vault_key(vault_key, new_password)
+    write_snapshot(vault_path, replace_vault_header(read_file(vault_path), new_key.header))
+
+
+def test_compaction_keeps_a_password_change(vault_with_journal, vault_key):
+    change_password(vault_with_journal, vault_key, "the new password")
+
+    # A key taken before the password change still folds the journal...
+    assert compact(vault_with_journal, vault_key) is True
+
+    # ...but keeps the new header
+    _, encrypted_data, journal = read_vault_files(vault_with_journal)
+    assert journal is None
+    assert unlock_vault_key(encrypted_data, MASTER_PASSWORD) is None
+    new_key = unlock_vault_key(encrypted_data, "the new password")
+    assert sorted(entries_by_id(open_vault(encrypted_data, None, new_key))) == ["a", "c"]
+
+
+def test_compactor_drops_the_key_once_compacted(vault_with_journal, vault_key):
+    compactor = Compactor(vault_with_journal)
+    compactor.schedule(vault_key)
+
+    deadline = time.monotonic() + 5
+    while os.path.exists(journal_path(vault_with_journal)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(journal_path(vault_with_journal))
+    assert compactor._vault_key is None
+
+
+def test_flush_after_password_change_keeps_the_new_password(logged_in):
+    web.compactor.schedule(session_key(logged_in))
+    response = logged_in.post("/api/entries", json={"type": "note", "title": "n"}, headers=XHR)
+    assert response.status_code == 200
+    response = logged_in.post(
+        "/api/change-password",
+        json={
+            "current_password": MASTER_PASSWORD,
+            "new_password": "password2",
+            "confirm_password": "password2",
+        },
+        headers=XHR,
+    )
+    assert response.status_code == 200
+
+    web.compactor.flush()
+
+    _, encrypted_data, journal = read_vault_files(web.VAULT_FILE)
+    assert unlock_vault_key(encrypted_data, MASTER_PASSWORD) is None
+    vault_key = unlock_vault_key(encrypted_data, "password2")
+    vault = open_vault(encrypted_data, journal, vault_key)
+    assert [entry["title"] for entry in vault["entries"]] == ["n"]